@@ -0,0 +1,199 @@
+import array
+import socket
+import subprocess
+import sys
+import time
+
+from listener import Ka9qRadioStatusListener
+from rtp import RtpHeader, RtpReceiver
+from rtptime import LatencyHistogram
+from status import Encoding, StatusType, OPUS_SAMPRATE
+
+DEFAULT_LATENCY_REPORT_INTERVAL = 30.0   # Seconds between latency log summaries
+
+OPUS_MAX_FRAME = 5760                    # 120ms @ 48kHz, largest Opus frame
+
+class Ka9qRtpAudioStream(RtpReceiver):
+    """In process replacement for pcmrecord: receives a channel's RTP stream and pipes it into sox as S16LE PCM.
+
+    Raw PCM and Opus encoded streams are supported, the encoding is taken from the channel's status.
+    As the RTP timestamps are mapped back to radiod's GPS time (see rtptime.py) the end to end latency,
+    from sample capture at radiod to delivery to the sink, is measured for every packet written.
+    """
+
+    ssrc: int
+    audio_device: str
+    audio_rate: int
+    channels: int
+    encoding: Encoding | None        # None - taken from the channel's status
+    sinkLatencyMs: float
+
+    ka9q_rs: Ka9qRadioStatusListener | None
+    sinkProcess: subprocess.Popen | None
+    opusDecoder: object | None
+
+    latency: LatencyHistogram
+    latencyMs: float                 # Live (most recent) end to end latency
+    latencyReportInterval: float
+    lastLatencyReport: float
+    bytesOut: int
+
+    decodeCpuNs: int                 # Thread CPU time spent decoding payloads
+    startedNs: int
+
+    def __init__(self, group_ip: str, port: int, ssrc: int, audio_device: str, audio_rate: int,
+                 ka9q_rs: Ka9qRadioStatusListener | None = None, channels: int = 1, encoding: Encoding | None = None,
+                 sinkLatencyMs: float = 0.0, latencyReportInterval: float = DEFAULT_LATENCY_REPORT_INTERVAL,
+                 sock: socket.socket | None = None, iface: str | None = None, source: str | None = None):
+        super().__init__(group_ip, port, [ssrc], sock, iface, source)
+
+        self.ssrc = ssrc
+        self.audio_device = audio_device
+        self.audio_rate = audio_rate
+        self.channels = channels
+        self.encoding = encoding
+        self.sinkLatencyMs = sinkLatencyMs
+        self.ka9q_rs = ka9q_rs
+        self.sinkProcess = None
+        self.opusDecoder = None
+
+        self.latency = LatencyHistogram()
+        self.latencyMs = float('nan')
+        self.latencyReportInterval = latencyReportInterval
+        self.lastLatencyReport = time.monotonic()
+        self.bytesOut = 0
+
+        self.decodeCpuNs = 0
+        self.startedNs = time.monotonic_ns()
+
+    def configureFromStatus(self):
+        s = self.ka9q_rs.status.get(self.ssrc, {}) if self.ka9q_rs else {}
+
+        if (self.encoding is None):
+            enc = s.get(StatusType.OUTPUT_ENCODING, Encoding.S16BE.value)
+            try:
+                self.encoding = Encoding(enc)
+            except ValueError:
+                self.log.warning(f"SSRC: [{self.ssrc}] Unknown OUTPUT_ENCODING: [{enc}], assuming S16BE.")
+                self.encoding = Encoding.S16BE
+        if (self.encoding == Encoding.NO_ENCODING):
+            self.encoding = Encoding.S16BE
+
+        self.channels = s.get(StatusType.OUTPUT_CHANNELS, self.channels) or self.channels
+        if (self.encoding != Encoding.OPUS):
+            self.audio_rate = s.get(StatusType.OUTPUT_SAMPRATE, self.audio_rate) or self.audio_rate
+
+    def sinkRate(self) -> int:
+        return OPUS_SAMPRATE if (self.encoding == Encoding.OPUS) else self.audio_rate
+
+    def sinkCommand(self) -> list[str]:
+        return ["sox", "-t", "raw", "-c", str(self.channels), "-r", str(self.sinkRate()), "-b", "16", "-e", "signed", "-L", "-",
+                "-t", "pulseaudio", self.audio_device]
+
+    def start(self):
+        self.configureFromStatus()
+        if (self.encoding == Encoding.OPUS):
+            self.opusDecoder = self.createOpusDecoder()
+        elif (self.encoding not in (Encoding.S16BE, Encoding.S16LE)):
+            raise Exception(f"SSRC: [{self.ssrc}] Output encoding: [{self.encoding.name}] is not supported.")
+
+        self.sinkProcess = subprocess.Popen(self.sinkCommand(), stdin=subprocess.PIPE)
+        self.log.info(f"SSRC: [{self.ssrc}] Audio sink process started with PID: [{self.sinkProcess.pid}]  "
+                      f"Encoding: [{self.encoding.name}]  Rate: [{self.sinkRate()}]  Channels: [{self.channels}]")
+        self.startedNs = time.monotonic_ns()
+        self.startReceiver()
+
+    def setSsrc(self, ssrc: int):
+        # Follow another channel on the same RTP group and format, the sink keeps running (see AudioPipelineSupervisor)
+        self.lastSeq.pop(ssrc, None)
+        self.ssrc = ssrc
+        self.ssrcFilter = {ssrc}
+
+    def createOpusDecoder(self):
+        # Optional dependency, only needed for Opus encoded channels: pip install opuslib
+        try:
+            import opuslib
+        except ImportError:
+            raise Exception("Opus encoded stream requires the 'opuslib' package (and libopus) to be installed.")
+
+        return opuslib.Decoder(OPUS_SAMPRATE, self.channels)
+
+    def isAlive(self) -> bool:
+        return self.receiverRunning and (self.receiverThread is not None) and self.receiverThread.is_alive() and \
+               (self.sinkProcess is not None) and (self.sinkProcess.poll() is None)
+
+    def stop(self):
+        self.stopReceiver()
+        if (self.sinkProcess):
+            self.report()
+            try:
+                self.sinkProcess.stdin.close()
+            except OSError:
+                pass
+            self.sinkProcess.terminate()
+            try:
+                self.sinkProcess.wait(2)
+            except subprocess.TimeoutExpired:
+                self.sinkProcess.kill()
+            self.sinkProcess = None
+
+    def close(self):
+        self.stop()
+        super().close()
+
+    def decodePayload(self, hdr: RtpHeader, payload: memoryview) -> tuple[bytes, int]:
+        # Returns S16LE PCM and the number of sample frames it contains
+        match (self.encoding):
+            case Encoding.OPUS:
+                pcm = self.opusDecoder.decode(bytes(payload), OPUS_MAX_FRAME)
+                return pcm, len(pcm) // (2 * self.channels)
+            case Encoding.S16LE:
+                return bytes(payload), len(payload) // (2 * self.channels)
+            case _:
+                # radiod PCM is big endian S16, sox has been told to expect little endian.
+                pcm = array.array('h', payload)
+                if (sys.byteorder == 'little'):
+                    pcm.byteswap()
+                return pcm.tobytes(), len(pcm) // self.channels
+
+    def decodeCpuPercent(self) -> float:
+        elapsed = time.monotonic_ns() - self.startedNs
+        return (100.0 * self.decodeCpuNs / elapsed) if elapsed > 0 else 0.0
+
+    def onRtpPacket(self, hdr: RtpHeader, payload: memoryview, arrival: float):
+        t0 = time.thread_time_ns()
+        pcm, samples = self.decodePayload(hdr, payload)
+        self.decodeCpuNs += time.thread_time_ns() - t0
+
+        try:
+            self.sinkProcess.stdin.write(pcm)
+            self.sinkProcess.stdin.flush()
+        except (OSError, AttributeError, ValueError):
+            return
+        self.bytesOut += len(pcm)
+
+        self.measureLatency(hdr, samples)
+
+        now = time.monotonic()
+        if (now - self.lastLatencyReport >= self.latencyReportInterval):
+            self.lastLatencyReport = now
+            self.report()
+
+    def measureLatency(self, hdr: RtpHeader, samples: int):
+        if (self.ka9q_rs is None):
+            return
+
+        clock = self.ka9q_rs.rtpClocks.get(self.ssrc)
+        if (clock is None) or (not clock.isValid()):
+            return
+
+        # Capture time of the last sample in this packet
+        captured = clock.rtpToUnix((hdr.timestamp + samples) & 0xFFFFFFFF)
+        self.latencyMs = ((time.time() - captured) * 1000.0) + self.sinkLatencyMs
+        self.latency.observe(self.latencyMs)
+
+    def report(self):
+        clock = self.ka9q_rs.rtpClocks.get(self.ssrc) if self.ka9q_rs else None
+        drift = f"{clock.drift_ppm:.2f}ppm" if clock else "n/a"
+        self.log.info(f"SSRC: [{self.ssrc}] End-to-end latency: {self.latency.summary()}  Drift: [{drift}]  "
+                      f"Lost: [{self.lost}]  Decode ({self.encoding.name}) CPU: [{self.decodeCpuPercent():.2f}%]")
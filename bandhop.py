@@ -0,0 +1,264 @@
+import argparse
+import logging
+import random
+import threading
+import time
+
+from control import Ka9qRadioControl, DEFAULT_MCAST_GROUP
+from dataclasses import dataclass
+from listener import Ka9qRadioStatusListener
+from status import StatusType
+from typing import Any, Callable
+
+# Time slotted band hopping, ie a channel rotating across bands on WSPR (2 minute) or FT8 (15 second) slots.
+#
+# The rotation is a list of 'hz[:mode[:slots]]' entries, each holding the channel for 'slots' consecutive slots.
+# Slots are numbered from the unix epoch (UTC) so every station running the same rotation is on the same band.
+# Each entry's control packet is encoded once up front and sent 'lead' seconds before its slot boundary. The
+# status packet echoing its COMMAND_TAG confirms the retune and the margin it landed before the boundary is logged.
+#
+# Waiting is done with a sleep to within a few milliseconds of the send time and a final short sleep
+# (clock_nanosleep, sub millisecond on Linux), never spinning.
+
+WSPR_SLOT_SECONDS = 120.0
+FT8_SLOT_SECONDS = 15.0
+DEFAULT_LEAD = 0.25             # Seconds before the slot boundary the retune is sent
+FINE_WAIT = 0.005               # Final (uninterruptible) sleep before a send
+
+HopCallback = Callable[['HopEntry'], None]
+
+
+@dataclass
+class HopEntry:
+    freq: float
+    mode: str
+    slots: int = 1
+    tag: int = 0                # COMMAND_TAG of the pre-encoded packet
+    packet: bytes = b''
+
+
+def parseRotation(entries: list[str], mode: str) -> list[HopEntry]:
+    res = []
+    for e in entries:
+        for part in e.split(','):
+            part = part.strip()
+            if (not part):
+                continue
+            fields = part.split(':')
+            res.append(HopEntry(float(fields[0]), fields[1].lower() if len(fields) > 1 and fields[1] else mode,
+                                int(fields[2]) if len(fields) > 2 else 1))
+    if (not res):
+        raise Exception("Band hop rotation is empty.")
+    return res
+
+def parseSlot(s: str) -> float:
+    # 'wspr', 'ft8' or seconds
+    slot = {'wspr': WSPR_SLOT_SECONDS, 'ft8': FT8_SLOT_SECONDS}.get(s.lower())
+    return slot if slot is not None else float(s)
+
+
+class HopStats():
+
+    retunes: int
+    confirmed: int
+    late: int                   # Confirmed after the slot boundary
+    missed: int                 # Never confirmed
+    sendErrorMs: float          # Worst send time error (ms after the target)
+    marginMs: list[float]       # Confirmation before the boundary (ms, negative is late)
+
+    def __init__(self):
+        self.retunes = 0
+        self.confirmed = 0
+        self.late = 0
+        self.missed = 0
+        self.sendErrorMs = 0.0
+        self.marginMs = []
+
+
+class Ka9qBandHopScheduler():
+
+    log: logging.Logger
+
+    ka9q_rc: Ka9qRadioControl
+    ka9q_rs: Ka9qRadioStatusListener
+    ssrc: int
+    rotation: list[HopEntry]
+    cycleSlots: int
+    slotSeconds: float
+    lead: float
+
+    current: HopEntry | None    # Last entry sent
+    pending: HopEntry | None    # Sent, awaiting its COMMAND_TAG echo
+    pendingSlot: float | None   # Unix time of the pending entry's slot boundary, None joining a slot in progress
+    hopCallbacks: list[HopCallback]
+    stats: HopStats
+
+    stopEvent: threading.Event
+    schedulerThread: threading.Thread | None
+
+    def __init__(self, ka9q_rc: Ka9qRadioControl, ka9q_rs: Ka9qRadioStatusListener, ssrc: int, rotation: list[HopEntry],
+                 slotSeconds: float = WSPR_SLOT_SECONDS, lead: float = DEFAULT_LEAD):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.ka9q_rc = ka9q_rc
+        self.ka9q_rs = ka9q_rs
+        self.ssrc = ssrc
+        self.rotation = rotation
+        self.cycleSlots = sum(e.slots for e in rotation)
+        self.slotSeconds = slotSeconds
+        self.lead = lead
+
+        self.current = None
+        self.pending = None
+        self.pendingSlot = 0.0
+        self.hopCallbacks = []
+        self.stats = HopStats()
+        self.stopEvent = threading.Event()
+        self.schedulerThread = None
+
+        if (self.cycleSlots < 1) or (lead >= slotSeconds):
+            raise Exception(f"Invalid rotation, slots: [{self.cycleSlots}]  lead: [{lead}]  slot: [{slotSeconds}].")
+
+        self.encode()
+        if (ssrc not in self.ka9q_rs.ssrcFilter) and (self.ka9q_rs.ssrcFilter):
+            self.ka9q_rs.ssrcFilter.append(ssrc)
+        self.ka9q_rs.addStatusCallback(self.onStatus)
+
+    def encode(self):
+        tags = set()
+        for e in self.rotation:
+            while (e.tag == 0) or (e.tag in tags):
+                e.tag = random.getrandbits(32)
+            tags.add(e.tag)
+            e.packet = self.ka9q_rc.encode_control(self.ssrc, {StatusType.RADIO_FREQUENCY: e.freq, StatusType.PRESET: e.mode}, e.tag)
+
+    def addHopCallback(self, cb: HopCallback):
+        self.hopCallbacks.append(cb)
+
+    def removeHopCallback(self, cb: HopCallback):
+        if cb in self.hopCallbacks:
+            self.hopCallbacks.remove(cb)
+
+    def entryForSlot(self, slot: int) -> HopEntry:
+        pos = slot % self.cycleSlots
+        for e in self.rotation:
+            if (pos < e.slots):
+                return e
+            pos -= e.slots
+        return self.rotation[-1]
+
+    def waitUntil(self, t: float) -> bool:
+        # Returns False if stopped while waiting
+        while True:
+            remaining = t - time.time()
+            if (remaining <= FINE_WAIT):
+                break
+            if (self.stopEvent.wait(remaining - FINE_WAIT)):
+                return False
+        remaining = t - time.time()
+        if (remaining > 0):
+            time.sleep(remaining)
+        return not self.stopEvent.is_set()
+
+    def send(self, e: HopEntry, slotTime: float | None):
+        if (self.pending is not None):
+            self.stats.missed += 1
+            self.log.warning(f"SSRC: [{self.ssrc}] Retune to: [{self.pending.freq}] for slot: [{self.pendingSlot}] was never confirmed.")
+        self.pending = e
+        self.pendingSlot = slotTime
+        self.current = e
+        self.ka9q_rc.send_control(e.packet, e.tag)
+        self.stats.retunes += 1
+
+    def onStatus(self, ssrc: int, stat: dict[StatusType, Any]):
+        e = self.pending
+        if (ssrc != self.ssrc) or (e is None) or (stat.get(StatusType.COMMAND_TAG) != e.tag):
+            return
+        self.pending = None
+        self.stats.confirmed += 1
+        if (self.pendingSlot is None):
+            self.log.info(f"SSRC: [{ssrc}] Freq: [{e.freq}] Mode: [{e.mode}] joined the slot in progress.")
+        else:
+            self.scoreMargin(e, ssrc, (self.pendingSlot - time.time()) * 1000.0)
+        for cb in self.hopCallbacks:
+            cb(e)
+
+    def scoreMargin(self, e: HopEntry, ssrc: int, marginMs: float):
+        self.stats.marginMs.append(marginMs)
+        if (marginMs < 0):
+            self.stats.late += 1
+            self.log.warning(f"SSRC: [{ssrc}] Freq: [{e.freq}] Mode: [{e.mode}] landed [{-marginMs:.1f}ms] AFTER the slot boundary.")
+        else:
+            self.log.info(f"SSRC: [{ssrc}] Freq: [{e.freq}] Mode: [{e.mode}] landed [{marginMs:.1f}ms] before the slot boundary.")
+
+    def schedulerHandler(self):
+        # Straight onto the current slot's band, then each boundary in turn
+        self.send(self.entryForSlot(int(time.time() // self.slotSeconds)), None)
+
+        while not self.stopEvent.is_set():
+            slot = int((time.time() + self.lead) // self.slotSeconds) + 1
+            e = self.entryForSlot(slot)
+            slotTime = slot * self.slotSeconds
+            if (e is self.current):
+                # Staying on this band, nothing to send
+                if (not self.waitUntil(slotTime - self.lead)):
+                    break
+                continue
+            target = slotTime - self.lead
+            if (not self.waitUntil(target)):
+                break
+            self.stats.sendErrorMs = max(self.stats.sendErrorMs, (time.time() - target) * 1000.0)
+            self.send(e, slotTime)
+
+    def report(self) -> str:
+        m = self.stats.marginMs
+        margins = f"min / mean: [{min(m):.1f} / {sum(m) / len(m):.1f}ms]" if m else "none"
+        return (f"SSRC: [{self.ssrc}] Retunes: [{self.stats.retunes}]  Confirmed: [{self.stats.confirmed}]  Late: [{self.stats.late}]  "
+                f"Missed: [{self.stats.missed}]  Margin {margins}  Worst send error: [{self.stats.sendErrorMs:.2f}ms]")
+
+    def start(self):
+        self.stopEvent.clear()
+        self.schedulerThread = threading.Thread(target=self.schedulerHandler, daemon=True)
+        self.schedulerThread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if (self.schedulerThread):
+            self.schedulerThread.join(2)
+            self.schedulerThread = None
+        self.ka9q_rs.removeStatusCallback(self.onStatus)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio time slotted band hopping scheduler")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_MCAST_GROUP, help="Multicast group name/ip for control / status.")
+    parser.add_argument("ssrc", type=int, help="SSRC of the channel to rotate.")
+    parser.add_argument("rotation", type=str, nargs='+', help="Rotation entries: 'hz[:mode[:slots]]'.")
+    parser.add_argument("--mode", type=str, default='usb', help="Mode for entries without one.")
+    parser.add_argument("--slot", type=str, default='wspr', help="Slot length: 'wspr' (120s), 'ft8' (15s) or seconds.")
+    parser.add_argument("--lead", type=float, default=DEFAULT_LEAD, help="Seconds before each slot boundary the retune is sent.")
+    args = parser.parse_args()
+
+    slot = parseSlot(args.slot)
+
+    rc = Ka9qRadioControl(args.mcast_group)
+    rs = Ka9qRadioStatusListener(args.mcast_group, [args.ssrc])
+    rs.startHandler()
+    scheduler = Ka9qBandHopScheduler(rc, rs, args.ssrc, parseRotation(args.rotation, args.mode), slot, args.lead)
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(slot)
+            scheduler.log.info(scheduler.report())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+        rs.stopHandler()
+        rc.close()
+
+
+if __name__ == "__main__":
+    main()
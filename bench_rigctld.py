@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+import psutil
+
+from fakeradiod import DEFAULT_FAKE_MCAST_GROUP, DEFAULT_BASE_SSRC
+from hamlibserver import dump
+
+# Load / latency benchmark for the Hamlib rigctld server. Starts fakeradiod.py and hamlibserver.py
+# as child processes (so the server's CPU can be measured on its own), then opens many concurrent
+# rigctl protocol clients, each sending a weighted mix of commands back to back, and reports
+# per command latency (p50 / p99 / max), throughput and server CPU. Results are saved as JSON and
+# can be compared against a previous run:
+#
+#   python bench_rigctld.py --clients 200 --duration 30 --output before.json
+#   python bench_rigctld.py --clients 200 --duration 30 --output after.json --compare before.json
+
+DEFAULT_BENCH_PORT = 14575
+DEFAULT_CLIENTS = 100
+DEFAULT_DURATION = 20.0
+
+# Command, weight - roughly what a logger, WSJT-X and a band map polling the same rig look like
+DEFAULT_MIX = {
+    'f': 40,
+    'm': 20,
+    'F': 10,
+    'M': 5,
+    '\\chk_vfo': 15,
+    '\\dump_state': 10,
+}
+
+# Lines in each command's reply
+REPLY_LINES = {
+    'f': 1,
+    'm': 2,
+    'F': 1,
+    'M': 1,
+    '\\chk_vfo': 1,
+    '\\dump_state': dump.count('\n'),
+}
+
+MODES = ['USB', 'LSB']
+
+
+def commandText(cmd: str, freq: float) -> str:
+    if (cmd == 'F'):
+        return f"F {freq + random.randint(-1000, 1000) * 10:.0f}\n"
+    if (cmd == 'M'):
+        return f"M {random.choice(MODES)} 2400\n"
+    return f"{cmd}\n"
+
+
+class BenchClient():
+
+    stats: dict[str, list[float]]
+    connectTimes: list[float]
+    errors: int
+    timeouts: int
+
+    def __init__(self):
+        self.stats = {cmd: [] for cmd in REPLY_LINES}
+        self.connectTimes = []
+        self.errors = 0
+        self.timeouts = 0
+
+    async def session(self, host: str, port: int, mix: dict[str, int], deadline: float, freq: float,
+                      think: float, timeout: float):
+        cmds = list(mix.keys())
+        weights = list(mix.values())
+
+        t0 = time.perf_counter()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        self.connectTimes.append(time.perf_counter() - t0)
+        try:
+            while time.monotonic() < deadline:
+                cmd = random.choices(cmds, weights)[0]
+                t0 = time.perf_counter()
+                writer.write(commandText(cmd, freq).encode())
+                await writer.drain()
+                for _ in range(REPLY_LINES[cmd]):
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                    if (not line):
+                        raise ConnectionError("Server closed the connection.")
+                self.stats[cmd].append(time.perf_counter() - t0)
+                if (think > 0):
+                    await asyncio.sleep(think)
+        finally:
+            writer.close()
+
+    async def run(self, host: str, port: int, mix: dict[str, int], deadline: float, freq: float,
+                  think: float, timeout: float):
+        # A lost / late reply leaves the connection out of step, so reconnect and carry on
+        while time.monotonic() < deadline:
+            try:
+                await self.session(host, port, mix, deadline, freq, think, timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                self.errors += 1
+                await asyncio.sleep(0.1)
+
+
+def waitForPort(host: str, port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1) as s:
+                # Wait until the server has seen the channel's status, 'f' is answered from it
+                s.sendall(b"f\nq\n")
+                if (s.recv(64).strip()):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise Exception(f"Hamlib server on {host}:{port} did not become ready.")
+
+def summarise(samples: list[float]) -> dict:
+    if (not samples):
+        return {'count': 0}
+    a = np.array(samples) * 1000.0
+    return {
+        'count': len(samples),
+        'mean_ms': float(a.mean()),
+        'p50_ms': float(np.percentile(a, 50)),
+        'p99_ms': float(np.percentile(a, 99)),
+        'max_ms': float(a.max()),
+    }
+
+def gitVersion() -> str | None:
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def runClients(args, mix: dict[str, int]) -> tuple[list[BenchClient], float, float]:
+    clients = [BenchClient() for _ in range(args.clients)]
+    t0 = time.monotonic()
+    deadline = t0 + args.duration
+    await asyncio.gather(*(c.run(args.host, args.port, mix, deadline, args.freq, args.think, args.timeout) for c in clients))
+    return clients, t0, time.monotonic()
+
+def runBenchmark(args) -> dict:
+    log = logging.getLogger(__name__)
+    here = os.path.dirname(os.path.abspath(__file__))
+    mix = args.mix or DEFAULT_MIX
+
+    procs = []
+    try:
+        if (not args.no_fakeradiod):
+            procs.append(subprocess.Popen([sys.executable, os.path.join(here, "fakeradiod.py"), args.mcast_group,
+                                           "-n", str(args.channels), "--base-ssrc", str(args.ssrc),
+                                           "-sr", str(args.status_rate)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        server = subprocess.Popen([sys.executable, os.path.join(here, "hamlibserver.py"), args.mcast_group, str(args.ssrc),
+                                   str(int(args.freq)), "usb", "--host", args.host, "--port", str(args.port)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        procs.append(server)
+        waitForPort(args.host, args.port, 15)
+
+        sp = psutil.Process(server.pid)
+        cpu0 = sp.cpu_times()
+        log.info(f"Running {args.clients} clients for {args.duration}s against {args.host}:{args.port}...")
+        clients, t0, t1 = asyncio.run(runClients(args, mix))
+        cpu1 = sp.cpu_times()
+        rss = sp.memory_info().rss
+    finally:
+        for p in reversed(procs):
+            p.send_signal(signal.SIGTERM)
+        for p in reversed(procs):
+            try:
+                p.wait(5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+    elapsed = t1 - t0
+    cpu = (cpu1.user - cpu0.user) + (cpu1.system - cpu0.system)
+    perCmd = {cmd: summarise([x for c in clients for x in c.stats[cmd]]) for cmd in REPLY_LINES}
+    allSamples = [x for c in clients for v in c.stats.values() for x in v]
+    return {
+        'version': gitVersion(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'config': {'clients': args.clients, 'duration': args.duration, 'channels': args.channels,
+                   'status_rate': args.status_rate, 'think': args.think, 'mix': mix},
+        'elapsed_s': elapsed,
+        'commands': len(allSamples),
+        'throughput_cps': len(allSamples) / elapsed if elapsed else 0.0,
+        'errors': sum(c.errors for c in clients),
+        'timeouts': sum(c.timeouts for c in clients),
+        'connect': summarise([x for c in clients for x in c.connectTimes]),
+        'server_cpu_s': cpu,
+        'server_cpu_pct': 100.0 * cpu / elapsed if elapsed else 0.0,
+        'server_rss_mb': rss / (1024 * 1024),
+        'latency': summarise(allSamples),
+        'per_command': perCmd,
+    }
+
+def printResults(res: dict, prev: dict | None = None):
+    def delta(key: str, cur: float, old: dict | None) -> str:
+        if (not old) or (key not in old) or (not old[key]):
+            return ""
+        return f" ({(cur - old[key]) / old[key] * 100.0:+.0f}%)"
+
+    print(f"Version: {res['version']}  Clients: {res['config']['clients']}  Elapsed: {res['elapsed_s']:.1f}s  Errors: {res['errors']}  Timeouts: {res['timeouts']}")
+    print(f"Throughput: {res['throughput_cps']:.1f} cmds/sec{delta('throughput_cps', res['throughput_cps'], prev)}  "
+          f"Server CPU: {res['server_cpu_pct']:.1f}%{delta('server_cpu_pct', res['server_cpu_pct'], prev)}  "
+          f"RSS: {res['server_rss_mb']:.1f}MB")
+    if (res['connect']['count']):
+        print(f"Connect: p50 {res['connect']['p50_ms']:.2f}ms  p99 {res['connect']['p99_ms']:.2f}ms  max {res['connect']['max_ms']:.2f}ms")
+    print(f"{'Command':<14}{'Count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = list(res['per_command'].items()) + [('ALL', res['latency'])]
+    for cmd, s in rows:
+        if (not s['count']):
+            continue
+        old = (prev['per_command'].get(cmd) if cmd != 'ALL' else prev['latency']) if prev else None
+        print(f"{cmd:<14}{s['count']:>8}{s['p50_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}"
+              f"{delta('p50_ms', s['p50_ms'], old)}{delta('p99_ms', s['p99_ms'], old)}")
+
+def parseMix(s: str) -> dict[str, int]:
+    # Only commands with a known reply length can be timed
+    try:
+        mix = json.loads(s)
+    except ValueError as e:
+        raise Exception(f"--mix is not valid JSON: {e}")
+    if (not isinstance(mix, dict)) or (not mix):
+        raise Exception("--mix must be a JSON object of command weights.")
+    unknown = [cmd for cmd in mix if cmd not in REPLY_LINES]
+    if (unknown):
+        raise Exception(f"--mix commands: {unknown} are not supported, use: {list(REPLY_LINES)}")
+    if any((not isinstance(w, (int, float))) or (w < 0) for w in mix.values()) or (sum(mix.values()) <= 0):
+        raise Exception("--mix weights must be non negative numbers, not all 0.")
+    return mix
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Hamlib rigctld server load / latency benchmark")
+    parser.add_argument("-c", "--clients", type=int, default=DEFAULT_CLIENTS, help="Number of concurrent rigctl clients.")
+    parser.add_argument("-d", "--duration", type=float, default=DEFAULT_DURATION, help="Seconds to run the clients for.")
+    parser.add_argument("--think", type=float, default=0.0, help="Seconds each client waits between commands.")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Seconds to wait for a reply before counting a timeout and reconnecting.")
+    parser.add_argument("--mix", type=str, help="JSON command weights, ie '{\"f\": 80, \"m\": 20}'.")
+    parser.add_argument("--mcast-group", type=str, default=DEFAULT_FAKE_MCAST_GROUP, help="Multicast group ip for fakeradiod / the server.")
+    parser.add_argument("--ssrc", type=int, default=DEFAULT_BASE_SSRC, help="SSRC the server controls.")
+    parser.add_argument("--freq", type=float, default=7074000.0, help="Initial frequency (Hz).")
+    parser.add_argument("--channels", type=int, default=10, help="Channels simulated by fakeradiod.")
+    parser.add_argument("--status-rate", type=float, default=10.0, help="fakeradiod status packets / sec per channel.")
+    parser.add_argument("--no-fakeradiod", action='store_true', help="Use an already running (fake or real) radiod.")
+    parser.add_argument("--host", type=str, default='localhost', help="Host name/ip the server binds to.")
+    parser.add_argument("--port", type=int, default=DEFAULT_BENCH_PORT, help="Port the server binds to.")
+    parser.add_argument("-o", "--output", type=str, help="Save results to this JSON file.")
+    parser.add_argument("--compare", type=str, help="Previous results JSON file to compare against.")
+    args = parser.parse_args()
+    if (args.mix):
+        try:
+            args.mix = parseMix(args.mix)
+        except Exception as e:
+            parser.error(str(e))
+
+    res = runBenchmark(args)
+    prev = None
+    if (args.compare):
+        with open(args.compare) as f:
+            prev = json.load(f)
+    printResults(res, prev)
+
+    if (args.output):
+        with open(args.output, 'w') as f:
+            json.dump(res, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
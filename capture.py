@@ -0,0 +1,515 @@
+import argparse
+import bisect
+import logging
+import os
+import queue
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+
+from control import DEFAULT_STAT_PORT
+from listener import Ka9qRadioStatusListener
+from mcastsock import connect_mcast, familyOf, listen_mcast
+from resolver import resolve_name
+from rtp import RtpReceiver
+
+# Records the raw datagrams (status, control and RTP) seen on one or more multicast group:port
+# endpoints into an indexed capture file, and replays them at 1x, Nx or as fast as possible -
+# either back onto the network or straight into an in process consumer via a ReplaySocket.
+#
+# File format (little endian):
+#  - Header: magic "KCAP" (4s), version (u16), endpoint count (u16)
+#            followed by each endpoint: group ip family (u8: 4 or 6), ip (16s), port (u16)
+#  - Records: unix time (f64), endpoint index (u8), source ip family (u8), source ip (16s), source port (u16),
+#             length (u32), datagram
+#  - IPv4 addresses are in the first 4 bytes of the 16. Version 1 captures (IPv4 only, 4s addresses without
+#    the family) are still read.
+#  - Index (written on close): every INDEX_INTERVAL secs - unix time (f64), file offset (u64), record number (u64)
+#  - Trailer: index offset (u64), index entries (u64), record count (u64), magic "KIDX" (4s)
+#
+# A capture that was not closed cleanly has no index / trailer, it is still readable (scanned from the start).
+
+CAPTURE_MAGIC = b'KCAP'
+CAPTURE_VERSION = 2
+INDEX_MAGIC = b'KIDX'
+
+FILE_HEADER = struct.Struct('<4sHH')
+ENDPOINT = struct.Struct('<B16sH')
+RECORD_HEADER = struct.Struct('<dBB16sHI')
+ENDPOINT_V1 = struct.Struct('<4sH')
+RECORD_HEADER_V1 = struct.Struct('<dB4sHI')
+INDEX_ENTRY = struct.Struct('<dQQ')
+TRAILER = struct.Struct('<QQQ4s')
+
+DEFAULT_INDEX_INTERVAL = 1.0
+DEFAULT_REPLAY_QUEUE = 10000      # Datagrams buffered per ReplaySocket
+
+Endpoint = tuple[str, int]        # (group ip, port)
+
+def packAddress(ip: str) -> tuple[int, bytes]:
+    if (familyOf(ip) == socket.AF_INET6):
+        return 6, socket.inet_pton(socket.AF_INET6, ip)
+    return 4, socket.inet_aton(ip) + bytes(12)
+
+def unpackAddress(family: int, b: bytes) -> str:
+    if (family == 6):
+        return socket.inet_ntop(socket.AF_INET6, b)
+    return socket.inet_ntoa(b[:4])
+
+
+class CaptureWriter():
+
+    path: str
+    endpoints: list[Endpoint]
+    indexInterval: float
+
+    f: object
+    index: list[tuple[float, int, int]]
+    records: int
+    lastIndexTime: float | None
+
+    def __init__(self, path: str, endpoints: list[Endpoint], indexInterval: float = DEFAULT_INDEX_INTERVAL):
+        self.path = path
+        self.endpoints = endpoints
+        self.indexInterval = indexInterval
+        self.index = []
+        self.records = 0
+        self.lastIndexTime = None
+
+        self.f = open(path, 'wb')
+        self.f.write(FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, len(endpoints)))
+        for ip, port in endpoints:
+            self.f.write(ENDPOINT.pack(*packAddress(ip), port))
+
+    def write(self, t: float, ep: int, src: Endpoint, data) -> None:
+        if (self.lastIndexTime is None) or (t - self.lastIndexTime >= self.indexInterval):
+            self.index.append((t, self.f.tell(), self.records))
+            self.lastIndexTime = t
+
+        self.f.write(RECORD_HEADER.pack(t, ep, *packAddress(src[0]), src[1], len(data)))
+        self.f.write(data)
+        self.records += 1
+
+    def close(self):
+        if (self.f is None):
+            return
+        indexOffset = self.f.tell()
+        for entry in self.index:
+            self.f.write(INDEX_ENTRY.pack(*entry))
+        self.f.write(TRAILER.pack(indexOffset, len(self.index), self.records, INDEX_MAGIC))
+        self.f.close()
+        self.f = None
+
+
+class CaptureReader():
+
+    path: str
+    version: int
+    endpoints: list[Endpoint]
+    dataOffset: int
+    dataEnd: int
+    index: list[tuple[float, int, int]]
+    records: int | None          # None when the capture has no trailer
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index = []
+        self.records = None
+
+        with open(path, 'rb') as f:
+            magic, version, count = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+            if (magic != CAPTURE_MAGIC) or (version not in (1, CAPTURE_VERSION)):
+                raise Exception(f"[{path}] is not a capture file (or unsupported version: [{version}]).")
+            self.version = version
+            self.endpoints = []
+            for _ in range(count):
+                if (version == 1):
+                    ip, port = ENDPOINT_V1.unpack(f.read(ENDPOINT_V1.size))
+                    self.endpoints.append((socket.inet_ntoa(ip), port))
+                else:
+                    family, ip, port = ENDPOINT.unpack(f.read(ENDPOINT.size))
+                    self.endpoints.append((unpackAddress(family, ip), port))
+            self.dataOffset = f.tell()
+
+            size = os.fstat(f.fileno()).st_size
+            self.dataEnd = size
+            if (size - self.dataOffset >= TRAILER.size):
+                f.seek(size - TRAILER.size)
+                indexOffset, entries, records, magic = TRAILER.unpack(f.read(TRAILER.size))
+                if (magic == INDEX_MAGIC):
+                    f.seek(indexOffset)
+                    raw = f.read(entries * INDEX_ENTRY.size)
+                    self.index = [INDEX_ENTRY.unpack_from(raw, i * INDEX_ENTRY.size) for i in range(entries)]
+                    self.records = records
+                    self.dataEnd = indexOffset
+
+    def endpointIndex(self, group_ip: str, port: int) -> int:
+        try:
+            return self.endpoints.index((group_ip, port))
+        except ValueError:
+            raise Exception(f"Endpoint: [{group_ip}:{port}] is not in capture: [{self.path}].")
+
+    def startTime(self) -> float | None:
+        return self.index[0][0] if self.index else None
+
+    def read(self, start: float | None = None):
+        # Yields (unix time, endpoint index, (source ip, source port), datagram), from start (unix time) if given
+        offset = self.dataOffset
+        if (start is not None) and (self.index):
+            i = bisect.bisect_right([e[0] for e in self.index], start) - 1
+            if (i >= 0):
+                offset = self.index[i][1]
+
+        header = RECORD_HEADER_V1 if self.version == 1 else RECORD_HEADER
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while f.tell() + header.size <= self.dataEnd:
+                if (self.version == 1):
+                    t, ep, ip, port, n = header.unpack(f.read(header.size))
+                    ip = socket.inet_ntoa(ip)
+                else:
+                    t, ep, family, ip, port, n = header.unpack(f.read(header.size))
+                    ip = unpackAddress(family, ip)
+                data = f.read(n)
+                if (len(data) < n):
+                    break       # Truncated capture
+                if (start is not None) and (t < start):
+                    continue
+                yield t, ep, (ip, port), data
+
+
+class ReplaySocket():
+    """Enough of a UDP socket (recv_into / recv / recvfrom, settimeout, close) for the listener and
+    RTP receivers to consume replayed datagrams as if they arrived from the network."""
+
+    q: queue.Queue
+    timeout: float | None
+    closed: bool
+    dropped: int
+    inFlight: bool      # A datagram has been handed to the consumer, which hasn't come back for the next one yet
+
+    def __init__(self, maxQueue: int = DEFAULT_REPLAY_QUEUE):
+        self.q = queue.Queue(maxQueue)
+        self.timeout = None
+        self.closed = False
+        self.dropped = 0
+        self.inFlight = False
+
+    def feed(self, data: bytes, src: Endpoint, block: bool = False):
+        if (self.closed):
+            return
+        if (block):
+            self.q.put((data, src))
+        else:
+            try:
+                self.q.put_nowait((data, src))
+            except queue.Full:
+                self.dropped += 1       # A real socket buffer would overflow too
+
+    def join(self):
+        # Returns once every datagram fed has been consumed, not just dequeued
+        self.q.join()
+
+    def settimeout(self, timeout: float | None):
+        self.timeout = timeout
+
+    def gettimeout(self) -> float | None:
+        return self.timeout
+
+    def recvfrom(self, bufsize: int = 65536) -> tuple[bytes, Endpoint]:
+        if (self.closed):
+            raise OSError("ReplaySocket is closed.")
+        if (self.inFlight):
+            # The consumer is back for another, so it has finished with the last one
+            self.inFlight = False
+            self.q.task_done()
+        try:
+            data, src = self.q.get(timeout=self.timeout)
+        except queue.Empty:
+            raise socket.timeout("timed out")
+        self.inFlight = True
+        return data[:bufsize], src
+
+    def recv(self, bufsize: int = 65536) -> bytes:
+        return self.recvfrom(bufsize)[0]
+
+    def recvfrom_into(self, buf, nbytes: int = 0) -> tuple[int, Endpoint]:
+        data, src = self.recvfrom(nbytes or len(buf))
+        n = len(data)
+        buf[:n] = data
+        return n, src
+
+    def recv_into(self, buf, nbytes: int = 0) -> int:
+        return self.recvfrom_into(buf, nbytes)[0]
+
+    def close(self):
+        self.closed = True
+
+
+class Capturer():
+
+    log: logging.Logger
+
+    writer: CaptureWriter
+    socks: list[socket.socket]
+
+    running: bool
+    thread: threading.Thread | None
+    packets: int
+    bytes: int
+
+    def __init__(self, writer: CaptureWriter):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+        self.writer = writer
+        self.socks = [listen_mcast(ip, port, bind_group=True) for ip, port in writer.endpoints]
+        self.running = False
+        self.thread = None
+        self.packets = 0
+        self.bytes = 0
+
+    def captureHandler(self):
+        sel = selectors.DefaultSelector()
+        for i, s in enumerate(self.socks):
+            s.setblocking(False)
+            sel.register(s, selectors.EVENT_READ, i)
+
+        buf = bytearray(65536)
+        while self.running:
+            for key, _ in sel.select(0.5):
+                try:
+                    n, src = key.fileobj.recvfrom_into(buf)
+                except BlockingIOError:
+                    continue
+                self.writer.write(time.time(), key.data, src, memoryview(buf)[:n])
+                self.packets += 1
+                self.bytes += n
+        sel.close()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.captureHandler, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if (self.thread):
+            self.thread.join(2)
+        for s in self.socks:
+            s.close()
+        self.writer.close()
+        self.log.info(f"Capture: [{self.writer.path}] closed.  Packets: [{self.packets}]  Bytes: [{self.bytes}]")
+
+
+class CaptureReplayer():
+    """Replays a capture at speed x real time (0 = as fast as the consumers can take it) into ReplaySockets
+    and / or back onto the network."""
+
+    log: logging.Logger
+
+    reader: CaptureReader
+    speed: float
+    startAt: float | None       # Unix time in the capture to start from
+    toNetwork: bool
+
+    sockets: dict[int, list[ReplaySocket]]
+    s_out: dict[int, socket.socket]      # Key: address family, sending to the endpoints' groups
+
+    running: bool
+    done: threading.Event
+    thread: threading.Thread | None
+    replayed: int
+    lag: float                   # Worst lateness (secs) replaying a datagram vs its scaled capture time
+
+    def __init__(self, reader: CaptureReader, speed: float = 1.0, start: float | None = None, toNetwork: bool = False):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.reader = reader
+        self.speed = speed
+        self.startAt = start
+        self.toNetwork = toNetwork
+        self.sockets = {}
+        self.s_out = {familyOf(ip): connect_mcast(group_ip=ip) for ip, _ in reader.endpoints} if toNetwork else {}
+        self.running = False
+        self.done = threading.Event()
+        self.thread = None
+        self.replayed = 0
+        self.lag = 0.0
+
+    def socketFor(self, group_ip: str, port: int, maxQueue: int = DEFAULT_REPLAY_QUEUE) -> ReplaySocket:
+        sock = ReplaySocket(maxQueue)
+        self.sockets.setdefault(self.reader.endpointIndex(group_ip, port), []).append(sock)
+        return sock
+
+    def replayHandler(self):
+        block = (self.speed <= 0)
+        t0 = None
+        wall0 = time.monotonic()
+        for t, ep, src, data in self.reader.read(self.startAt):
+            if (not self.running):
+                break
+
+            if (not block):
+                if (t0 is None):
+                    t0 = t
+                due = wall0 + (t - t0) / self.speed
+                delay = due - time.monotonic()
+                if (delay > 0):
+                    time.sleep(delay)
+                else:
+                    self.lag = max(self.lag, -delay)
+
+            for sock in self.sockets.get(ep, ()):
+                sock.feed(data, src, block)
+            if (self.s_out):
+                dest = self.reader.endpoints[ep]
+                self.s_out[familyOf(dest[0])].sendto(data, dest)
+            self.replayed += 1
+
+        self.done.set()
+
+    def start(self):
+        self.running = True
+        self.done.clear()
+        self.thread = threading.Thread(target=self.replayHandler, daemon=True)
+        self.thread.start()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self.done.wait(timeout)
+
+    def stop(self):
+        self.running = False
+        if (self.thread):
+            self.thread.join(2)
+        for s in self.s_out.values():
+            s.close()
+        self.s_out = {}
+        dropped = sum(s.dropped for socks in self.sockets.values() for s in socks)
+        self.log.info(f"Replayed: [{self.replayed}] datagrams  Dropped: [{dropped}]  Max lag: [{self.lag*1000:.1f}ms]")
+
+
+# ================ Command line ================================================
+
+def parseEndpoint(s: str) -> Endpoint:
+    name, _, port = s.rpartition(':')
+    if (not name):
+        name, port = s, DEFAULT_STAT_PORT
+    names = resolve_name(name)
+    if (not names):
+        raise Exception(f"Failed to resolve multicast group name: [{name}].")
+    return (names[0].compressed, int(port))
+
+def cmdRecord(args):
+    endpoints = [parseEndpoint(e) for e in args.endpoints]
+    cap = Capturer(CaptureWriter(args.file, endpoints))
+    cap.start()
+    print(f"Capturing {endpoints} to {args.file}, press Ctrl-C to stop...")
+    try:
+        deadline = time.monotonic() + args.duration if args.duration else None
+        while (deadline is None) or (time.monotonic() < deadline):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.stop()
+
+def cmdInfo(args):
+    reader = CaptureReader(args.file)
+    counts = [0] * len(reader.endpoints)
+    nbytes = 0
+    first = last = None
+    for t, ep, src, data in reader.read():
+        counts[ep] += 1
+        nbytes += len(data)
+        first = t if first is None else first
+        last = t
+    print(f"Capture: {args.file}  Indexed: {reader.records is not None}  Index entries: {len(reader.index)}")
+    if (first is not None):
+        print(f"Duration: {last - first:.3f}s  Datagrams: {sum(counts)}  Bytes: {nbytes}")
+    for (ip, port), n in zip(reader.endpoints, counts):
+        print(f"  {ip}:{port}  Datagrams: {n}")
+
+def cmdReplay(args):
+    reader = CaptureReader(args.file)
+    start = reader.startTime() + args.start if (args.start and reader.startTime()) else None
+    replayer = CaptureReplayer(reader, args.speed, start, toNetwork=True)
+    try:
+        replayer.start()
+        while not replayer.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        replayer.stop()
+
+def cmdBench(args):
+    # Decode throughput: replay as fast as possible into a status listener per status endpoint
+    # (no size filter) and an RTP receiver per other endpoint.
+    reader = CaptureReader(args.file)
+    replayer = CaptureReplayer(reader, speed=0)
+
+    decoded = [0]
+    consumers = []
+    for ip, port in reader.endpoints:
+        sock = replayer.socketFor(ip, port)
+        sock.settimeout(0.1)
+        if (port == DEFAULT_STAT_PORT):
+            rs = Ka9qRadioStatusListener(ip, minPacketSize=0, maxPacketSize=65536, sock=sock)
+            rs.addStatusCallback(lambda ssrc, stat: decoded.__setitem__(0, decoded[0] + 1))
+            rs.startHandler()
+            consumers.append((sock, rs.stopHandler))
+        else:
+            rr = RtpReceiver(ip, port, sock=sock)
+            rr.startReceiver()
+            consumers.append((sock, rr.stopReceiver))
+
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    replayer.start()
+    replayer.wait()
+    for sock, _ in consumers:
+        sock.join()
+    elapsed = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+
+    for _, stop in consumers:
+        stop()
+    replayer.stop()
+    print(f"Datagrams: {replayer.replayed}  Status decoded: {decoded[0]}  Elapsed: {elapsed:.3f}s  "
+          f"CPU: {cpu:.3f}s  Rate: {replayer.replayed / elapsed if elapsed else 0:.0f} datagrams/sec")
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio multicast capture and replay")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("record", help="Capture datagrams from one or more group[:port] endpoints.")
+    p.add_argument("file", type=str, help="Capture file to write.")
+    p.add_argument("endpoints", type=str, nargs='+', help=f"Multicast group name/ip and port, ie hf.local:{DEFAULT_STAT_PORT} hf-pcm.local:5004")
+    p.add_argument("-d", "--duration", type=float, help="Seconds to capture for (default until Ctrl-C).")
+    p.set_defaults(func=cmdRecord)
+
+    p = sub.add_parser("info", help="Summarise a capture file.")
+    p.add_argument("file", type=str, help="Capture file to read.")
+    p.set_defaults(func=cmdInfo)
+
+    p = sub.add_parser("replay", help="Replay a capture back onto the network.")
+    p.add_argument("file", type=str, help="Capture file to read.")
+    p.add_argument("-s", "--speed", type=float, default=1.0, help="Replay speed x real time, 0 = as fast as possible.")
+    p.add_argument("--start", type=float, default=0.0, help="Seconds into the capture to start from.")
+    p.set_defaults(func=cmdReplay)
+
+    p = sub.add_parser("bench", help="Measure in process decode throughput replaying a capture as fast as possible.")
+    p.add_argument("file", type=str, help="Capture file to read.")
+    p.set_defaults(func=cmdBench)
+
+    args = parser.parse_args()
+    args.func(args)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
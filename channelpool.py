@@ -0,0 +1,238 @@
+import argparse
+import collections
+import logging
+import threading
+import time
+
+from control import Ka9qRadioControl, DEFAULT_MCAST_GROUP
+from dataclasses import dataclass
+from listener import Ka9qRadioStatusListener
+from status import StatusType
+from typing import Any
+
+# Hot standby channel pool. Idle channels are created up front on a list of frequencies / modes (ie the FT8
+# dial frequencies) so a band change can switch which SSRC feeds the rig instead of retuning radiod, avoiding
+# the filter / AGC transient the decoder would otherwise see.
+#
+# Idle channels are parked with an SNR squelch that never opens, so radiod sends no RTP for them, only their
+# (infrequent) status. The pool is bounded, the least recently used idle channel is evicted (its frequency set
+# to 0 so radiod removes it) to make room for a new one.
+
+DEFAULT_POOL_SIZE = 16
+PARK_SQUELCH_DB = 100.0         # SNR (dB) squelch threshold no signal reaches
+EVICT_FREQUENCY = 0.0           # radiod removes dynamic channels tuned to 0Hz
+
+FT8_DIAL_FREQS = [1840000, 3573000, 5357000, 7074000, 10136000, 14074000, 18100000, 21074000, 24915000, 28074000, 50313000]
+
+PARK_VALUES = {StatusType.SNR_SQUELCH: True, StatusType.SQUELCH_OPEN: PARK_SQUELCH_DB, StatusType.SQUELCH_CLOSE: PARK_SQUELCH_DB}
+SQUELCH_FIELDS = (StatusType.SNR_SQUELCH, StatusType.SQUELCH_OPEN, StatusType.SQUELCH_CLOSE)
+DEFAULT_UNPARK_VALUES = {StatusType.SNR_SQUELCH: False}
+
+
+@dataclass
+class PooledChannel:
+    ssrc: int
+    freq: float
+    mode: str
+    lastUsed: float
+
+
+def poolKey(freq: float, mode: str) -> tuple[int, str]:
+    return (int(round(freq)), mode.lower())
+
+def isParked(stat: dict[StatusType, Any] | None) -> bool:
+    return (stat is not None) and (stat.get(StatusType.SQUELCH_OPEN, 0.0) >= PARK_SQUELCH_DB)
+
+def unparkValues(stat: dict[StatusType, Any] | None) -> dict[StatusType, Any]:
+    # The squelch settings of an active (not parked) channel, to apply when a parked channel takes over from it
+    if (not stat) or (isParked(stat)):
+        return dict(DEFAULT_UNPARK_VALUES)
+    return {t: stat[t] for t in SQUELCH_FIELDS if t in stat} or dict(DEFAULT_UNPARK_VALUES)
+
+def parsePoolSpec(entries: list[str], mode: str) -> list[tuple[int, str]]:
+    # "7074000", "7074000:usb" or "ft8" (all the FT8 dial frequencies)
+    res = []
+    for e in entries:
+        for part in e.split(','):
+            part = part.strip()
+            if (not part):
+                continue
+            if (part.lower() == 'ft8'):
+                res.extend((f, mode) for f in FT8_DIAL_FREQS)
+            elif (':' in part):
+                f, m = part.split(':', 1)
+                res.append((int(float(f)), m.lower()))
+            else:
+                res.append((int(float(part)), mode))
+    return res
+
+
+class Ka9qChannelPool():
+
+    log: logging.Logger
+
+    ka9q_rc: Ka9qRadioControl
+    ka9q_rs: Ka9qRadioStatusListener | None
+
+    maxSize: int
+    nextSsrc: int
+    reserved: set[int]               # SSRCs never allocated to the pool, ie the rig's own channels
+
+    idle: collections.OrderedDict[tuple[int, str], PooledChannel]     # Least recently used first
+    busy: dict[int, PooledChannel]   # Key: SSRC - channels currently feeding the rig
+    lock: threading.Lock
+
+    evictions: int
+
+    def __init__(self, ka9q_rc: Ka9qRadioControl, baseSsrc: int, ka9q_rs: Ka9qRadioStatusListener | None = None,
+                 maxSize: int = DEFAULT_POOL_SIZE, reserved: list[int] = []):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.ka9q_rc = ka9q_rc
+        self.ka9q_rs = ka9q_rs
+        self.maxSize = maxSize
+        self.nextSsrc = baseSsrc
+        self.reserved = set(reserved)
+        self.idle = collections.OrderedDict()
+        self.busy = {}
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.idle) + len(self.busy)
+
+    def allocateSsrc(self) -> int:
+        used = self.reserved | set(self.busy) | {ch.ssrc for ch in self.idle.values()}
+        while (self.nextSsrc in used) or (self.nextSsrc == 0):
+            self.nextSsrc = (self.nextSsrc + 1) & 0xFFFFFFFF
+        ssrc = self.nextSsrc
+        self.nextSsrc = (self.nextSsrc + 1) & 0xFFFFFFFF
+        return ssrc
+
+    def add(self, freq: float, mode: str) -> PooledChannel | None:
+        key = poolKey(freq, mode)
+        with self.lock:
+            ch = self.idle.get(key)
+            if (ch is None):
+                ch = next((c for c in self.busy.values() if poolKey(c.freq, c.mode) == key), None)
+            if (ch is not None):
+                return ch
+
+            if (len(self) >= self.maxSize) and (not self.evict()):
+                self.log.warning(f"Pool full, all [{len(self.busy)}] channels busy. Not adding: [{freq}] [{mode}]")
+                return None
+
+            ch = PooledChannel(self.allocateSsrc(), float(freq), mode.lower(), time.monotonic())
+            self.idle[key] = ch
+
+        if (self.ka9q_rs is not None):
+            self.ka9q_rs.ssrcFilter.append(ch.ssrc)
+        # Created parked, in a single command
+        self.ka9q_rc.control_set(ch.ssrc, {StatusType.RADIO_FREQUENCY: ch.freq, StatusType.PRESET: ch.mode, **PARK_VALUES})
+        self.log.info(f"SSRC: [{ch.ssrc}] Pooled channel created  Freq: [{ch.freq}]  Mode: [{ch.mode}]")
+        return ch
+
+    def preload(self, channels: list[tuple[float, str]]):
+        for freq, mode in channels:
+            self.add(freq, mode)
+
+    def evict(self) -> bool:
+        # Lock held. Removes the least recently used idle channel
+        if (not self.idle):
+            return False
+        _, ch = self.idle.popitem(last=False)
+        self.evictions += 1
+        self.ka9q_rc.control_set(ch.ssrc, {StatusType.RADIO_FREQUENCY: EVICT_FREQUENCY})
+        if (self.ka9q_rs is not None):
+            if ch.ssrc in self.ka9q_rs.ssrcFilter:
+                self.ka9q_rs.ssrcFilter.remove(ch.ssrc)
+            self.ka9q_rs.status.pop(ch.ssrc, None)
+        self.log.info(f"SSRC: [{ch.ssrc}] Pooled channel evicted  Freq: [{ch.freq}]  Mode: [{ch.mode}]")
+        return True
+
+    def isPooled(self, ssrc: int) -> bool:
+        return ssrc in self.busy
+
+    def matches(self, ssrc: int, freq: float, mode: str) -> bool:
+        ch = self.busy.get(ssrc)
+        return (ch is not None) and (poolKey(ch.freq, ch.mode) == poolKey(freq, mode))
+
+    def acquire(self, freq: float, mode: str, unpark: dict[StatusType, Any]) -> PooledChannel | None:
+        # Takes the idle channel on freq / mode (if any) and opens its squelch with the given settings
+        with self.lock:
+            ch = self.idle.pop(poolKey(freq, mode), None)
+            if (ch is None):
+                return None
+            ch.lastUsed = time.monotonic()
+            self.busy[ch.ssrc] = ch
+        self.ka9q_rc.control_set(ch.ssrc, unpark)
+        return ch
+
+    def release(self, ssrc: int):
+        # A busy channel returns to the pool (most recently used), parked
+        with self.lock:
+            ch = self.busy.pop(ssrc, None)
+            if (ch is None):
+                return
+            ch.lastUsed = time.monotonic()
+            self.idle[poolKey(ch.freq, ch.mode)] = ch
+        self.park(ssrc)
+
+    def park(self, ssrc: int):
+        self.ka9q_rc.control_set(ssrc, PARK_VALUES)
+
+    def unpark(self, ssrc: int, values: dict[StatusType, Any]):
+        self.ka9q_rc.control_set(ssrc, values)
+
+    def recreate(self):
+        # radiod restarted, its dynamic channels are gone: create the pooled ones again as they were
+        with self.lock:
+            idle = list(self.idle.values())
+            busy = list(self.busy.values())
+        for ch in idle:
+            self.ka9q_rc.control_set(ch.ssrc, {StatusType.RADIO_FREQUENCY: ch.freq, StatusType.PRESET: ch.mode, **PARK_VALUES})
+        for ch in busy:
+            self.ka9q_rc.control_set_frequency(ch.freq, ch.mode, ch.ssrc)
+
+    def ssrcs(self) -> list[int]:
+        with self.lock:
+            return [ch.ssrc for ch in self.idle.values()] + list(self.busy)
+
+    def close(self):
+        # Remove the idle channels, busy ones are left to their users
+        with self.lock:
+            while self.evict():
+                pass
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio hot standby channel pool")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_MCAST_GROUP, help="Multicast group name/ip for control.")
+    parser.add_argument("base_ssrc", type=int, nargs='?', default=9999000, help="First SSRC allocated to pooled channels.")
+    parser.add_argument("channels", type=str, nargs='*', default=['ft8'], help="Pooled frequencies: 'hz', 'hz:mode' or 'ft8'.")
+    parser.add_argument("--mode", type=str, default='usb', help="Mode for entries without one.")
+    parser.add_argument("--size", type=int, default=DEFAULT_POOL_SIZE, help="Maximum pooled channels.")
+    args = parser.parse_args()
+
+    rc = Ka9qRadioControl(args.mcast_group)
+    rs = Ka9qRadioStatusListener(args.mcast_group, [])
+    pool = Ka9qChannelPool(rc, args.base_ssrc, rs, args.size)
+    pool.preload(parsePoolSpec(args.channels, args.mode))
+    rs.startHandler()
+    try:
+        while True:
+            time.sleep(2)
+            parked = sum(1 for s in pool.ssrcs() if isParked(rs.status.get(s)))
+            print(f"Pooled: [{len(pool)}]  Status seen: [{sum(1 for s in pool.ssrcs() if s in rs.status)}]  Parked: [{parked}]")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
+        rs.stopHandler()
+        rc.close()
+
+
+if __name__ == "__main__":
+    main()
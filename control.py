@@ -1,11 +1,16 @@
 
 import logging
+import metrics
 import random
+import mcastsock
 import socket
-import struct
+import threading
+import time
+import tracing
 
 from resolver import resolve_name
-from status import StatusType, encode_double, encode_eol, encode_int, encode_str
+from status import Encoding, StatusType, encode_eol, encode_int, encode_status
+from typing import Any
 
 
 DEFAULT_MCAST_PORT=5004
@@ -20,19 +25,33 @@ KA9Q_PRESETS = ['lsb', 'usb', 'cwl', 'cwu',
                 'fm', 'nfm', 'wfm', 'pm', 'npm', 'wpm', 
                 'iq', 'ame', 'wspr', 'spectrum']
 
+POLL_ALL_SSRC = 0xFFFFFFFF   # Command to this SSRC has radiod send the status of every channel
+MAX_PENDING_ACKS = 1000      # Command tags awaiting their echo in a status packet
+
+CONTROL_SENT = metrics.Counter('ka9q_control_packets_sent_total', 'Control packets sent')
+CONTROL_ACK_SECONDS = metrics.Histogram('ka9q_control_ack_seconds', 'Command sent to COMMAND_TAG echoed in status')
+CONTROL_ACK_LOST = metrics.Counter('ka9q_control_acks_lost_total', 'Commands never acknowledged (pending list overflowed)')
+
 class Ka9qRadioControl():
 
     log: logging.Logger
 
     mcast_group: str
     mcast_group_ip: str
+    iface: str | None               # Interface multicast is sent on, None the default route
 
     s_out: socket.socket    # Outbound mcast Socket
 
-    def __init__(self, mcast_group:str=DEFAULT_MCAST_GROUP):
+    pendingAcks: dict[int, float]    # Command tag -> perf_counter() when sent, only tracked with metrics enabled
+    pendingLock: threading.Lock
+
+    def __init__(self, mcast_group:str=DEFAULT_MCAST_GROUP, iface:str|None=None):
         self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
 
         self.mcast_group = mcast_group
+        self.iface = iface
+        self.pendingAcks = {}
+        self.pendingLock = threading.Lock()
 
         names = resolve_name(mcast_group)
         if names and len(names) > 0:
@@ -44,40 +63,73 @@ class Ka9qRadioControl():
 
 
     def connect_mcast(self) -> socket.socket:
-        
-        # Create the socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-        # Set a timeout so the socket does not block indefinitely when trying
-        # to receive data.
-        sock.settimeout(0.2)
-
-        # Set the time-to-live for messages to 1 so they do not go past the
-        # local network segment.
-        ttl = struct.pack('b', 1)
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
-
-        return sock
+        return mcastsock.connect_mcast(group_ip=self.mcast_group_ip, iface=self.iface)
 
     def send(self, buf: bytes):
         server_address = (self.mcast_group_ip, DEFAULT_STAT_PORT)
         self.s_out.sendto(buf, server_address)
     
 
-    def control_set_frequency(self, f: float, m:str, ssrc:int):
-        buf = bytes()
-        
+    def encode_control(self, ssrc:int, values: dict[StatusType, Any], tag:int) -> bytes:
         # 00 - Status Update / 01 - Control update
         buf = bytes([1])
-        buf = encode_double(buf, StatusType.RADIO_FREQUENCY, f)
-        buf = encode_str(buf, StatusType.PRESET, m)                           # Mode Preset
+        for t, v in values.items():
+            buf = encode_status(buf, t, v)
         buf = encode_int(buf, StatusType.OUTPUT_SSRC, ssrc)                   # Specific SSRC
-        buf = encode_int(buf, StatusType.COMMAND_TAG, random.getrandbits(32)) # Append a command tag
-        buf = encode_eol(buf)
-
-        self.log.debug(f"Encoded: [{len(buf)}] bytes, sending to server... [{buf.hex()}]")
+        buf = encode_int(buf, StatusType.COMMAND_TAG, tag)                    # Append a command tag
+        return encode_eol(buf)
+
+    def send_control(self, buf: bytes, tag:int):
+        # Sends an encoded (possibly pre-encoded, see encode_control) command
+        if (self.log.isEnabledFor(logging.DEBUG)):
+            self.log.debug(f"Encoded: [{len(buf)}] bytes, sending to server... [{buf.hex()}]")
+        if (metrics.enabled):
+            self.trackAck(tag)
+            CONTROL_SENT.inc()
         self.send(buf)
 
+    @tracing.traced('control.set')
+    def control_set(self, ssrc:int, values: dict[StatusType, Any]) -> int:
+        tag = random.getrandbits(32)
+        self.send_control(self.encode_control(ssrc, values, tag), tag)
+        return tag
+
+    @tracing.traced('control.poll')
+    def control_poll(self, ssrc:int=POLL_ALL_SSRC, tag:int | None=None) -> int:
+        # Status only request, radiod replies with the channel's (or every channel's) status echoing the tag
+        tag = tag if tag is not None else random.getrandbits(32)
+        self.send_control(self.encode_control(ssrc, {}, tag), tag)
+        return tag
+
+    def trackAck(self, tag: int):
+        with self.pendingLock:
+            if (len(self.pendingAcks) >= MAX_PENDING_ACKS):
+                del self.pendingAcks[next(iter(self.pendingAcks))]
+                CONTROL_ACK_LOST.inc()
+            self.pendingAcks[tag] = time.perf_counter()
+
+    def onStatus(self, ssrc: int, stat: dict[StatusType, Any]):
+        # Status callback (see Ka9qRadioStatusListener.addStatusCallback), measures command ack latency
+        if (not self.pendingAcks):
+            return
+        tag = stat.get(StatusType.COMMAND_TAG)
+        if (tag):
+            with self.pendingLock:
+                sent = self.pendingAcks.pop(tag, None)
+            if (sent is not None):
+                CONTROL_ACK_SECONDS.observe(time.perf_counter() - sent)
+
+    @tracing.traced('control.set_frequency')
+    def control_set_frequency(self, f: float, m:str, ssrc:int) -> int:
+        return self.control_set(ssrc, {StatusType.RADIO_FREQUENCY: f,
+                                       StatusType.PRESET: m})                 # Mode Preset
+
+    def control_set_encoding(self, ssrc:int, encoding: Encoding, opus_bitrate:int | None = None) -> int:
+        values: dict[StatusType, Any] = {StatusType.OUTPUT_ENCODING: encoding.value}
+        if (encoding == Encoding.OPUS) and (opus_bitrate is not None):
+            values[StatusType.OPUS_BIT_RATE] = opus_bitrate
+        return self.control_set(ssrc, values)
+
     def close(self):
         if (self.s_out):
             self.s_out.close()
@@ -1,16 +1,23 @@
 #!/usr/bin/env python
 
-"""Example of browsing for a service.
+"""Live registry of ka9q-radio services (control and RTP) discovered over zeroconf.
 
-The default is HTTP and HAP; use --find to search for all available services in the network
+Follows service changes until Ctrl-C (or prints the registry after --once seconds); use --find to search for
+all available services in the network
 """
 
 from __future__ import annotations
 
 import argparse
+import dataclasses
+import json
 import logging
+import os
+import queue
+import threading
+import time
 from time import sleep
-from typing import cast
+from typing import Callable, cast
 
 from zeroconf import (
     IPVersion,
@@ -29,32 +36,234 @@ KA9Q_RADIO_SVC_TYPES_ALL = [
         KA9Q_RADIO_RTP_SVC,    # RTP Streams
     ]
 
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'ka9q-radio', 'services.json')
+DEFAULT_INFO_TIMEOUT_MS = 3000
+DEFAULT_WARM_EXPIRE = 10.0      # Seconds cached services have to be seen live before they are dropped
+
+# Change notifications: 'added', 'updated' (address / port / properties changed), 'removed', and 'restarted'
+# (added again after being removed, ie radiod restarted). Called on the registry's worker thread.
+ServiceCallback = Callable[[str, 'KA9QService'], None]
+
+
+@dataclasses.dataclass
+class KA9QService:
+    name: str
+    type: str
+    server: str | None
+    addresses: list[str]
+    port: int | None
+    properties: dict[str, str]
+    updated: float                  # Unix time last resolved
+    cached: bool = False            # From the warm start snapshot, not yet seen live
+
+    def key(self) -> tuple:
+        return (self.server, tuple(self.addresses), self.port, tuple(sorted(self.properties.items())))
+
+
+def serviceFromInfo(info: ServiceInfo) -> KA9QService:
+    props = {}
+    for k, v in (info.properties or {}).items():
+        props[k.decode(errors='replace') if isinstance(k, bytes) else str(k)] = \
+            v.decode(errors='replace') if isinstance(v, bytes) else ('' if v is None else str(v))
+    return KA9QService(info.name, info.type, info.server, list(info.parsed_scoped_addresses()), info.port, props, time.time())
+
+
 class KA9QRadioServiceDiscovery:
+    """Long lived registry of ka9q-radio services. Services are indexed by name and (multicast address, port),
+    kept current from the zeroconf browser's Added / Updated / Removed events and persisted to a snapshot so the
+    next start has them immediately. Lookups never block."""
+
+    log: logging.Logger
 
     serviceTypes: list[str]
-    serviceTypeInfos: dict[str, list[ServiceInfo]]
+    services: dict[str, KA9QService]                        # Key: service name
+    byAddress: dict[tuple[str, int | None], set[str]]       # Key: (address, port) - service names
+    removed: set[str]                                       # Names removed while running, re-added is a restart
+    changeCallbacks: list[ServiceCallback]
+    cachePath: str | None
+    warmExpire: float
+    lock: threading.Lock
+
+    events: queue.Queue
+    workerThread: threading.Thread
+
+    def __init__(self, serviceTypes: list=KA9Q_RADIO_SVC_TYPES_ALL, ipVersion:IPVersion=IPVersion.All,
+                 cachePath: str | None = None, warmExpire: float = DEFAULT_WARM_EXPIRE) -> None:
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
 
-    def __init__(self, serviceTypes: list=KA9Q_RADIO_SVC_TYPES_ALL, ipVersion:IPVersion=IPVersion.All) -> None:
-        self.zeroconf = Zeroconf(ip_version=ipVersion)
         self.serviceTypes = serviceTypes
-        self.serviceTypeInfos = {}
+        self.services = {}
+        self.byAddress = {}
+        self.removed = set()
+        self.changeCallbacks = []
+        self.cachePath = cachePath
+        self.warmExpire = warmExpire
+        self.lock = threading.Lock()
+
+        if (cachePath):
+            self.load(cachePath)
+
+        # Resolving a service can block for seconds, so it's done on a worker rather than the browser's thread
+        self.events = queue.Queue()
+        self.workerThread = threading.Thread(target=self.workerHandler, daemon=True)
+        self.workerThread.start()
+
+        self.zeroconf = Zeroconf(ip_version=ipVersion)
         self.browser = ServiceBrowser(self.zeroconf, serviceTypes, handlers=[self.on_service_state_change])
 
     def close(self):
+        self.events.put(None)
         self.zeroconf.close()
+        self.workerThread.join(2)
 
     def on_service_state_change(
         self, zeroconf: Zeroconf, service_type: str, name: str, state_change: ServiceStateChange
     ) -> None:
-        #print(f"Service {name} of type {service_type} state changed: {state_change}")
+        self.events.put((service_type, name, state_change))
+
+    def workerHandler(self):
+        expireAt = time.monotonic() + self.warmExpire
+        while True:
+            try:
+                ev = self.events.get(timeout=max(0.1, expireAt - time.monotonic()) if expireAt else None)
+            except queue.Empty:
+                ev = ()
+            if (ev is None):
+                break
+            if (expireAt) and (time.monotonic() >= expireAt):
+                self.expireCached()
+                expireAt = 0
+            if (not ev):
+                continue
 
-        if state_change is ServiceStateChange.Added:
-            info = zeroconf.get_service_info(service_type, name)
-            if (info):
-                if (not self.serviceTypeInfos or (service_type not in self.serviceTypeInfos.keys())):
-                    self.serviceTypeInfos[service_type] = [info]
+            service_type, name, state_change = ev
+            try:
+                if (state_change is ServiceStateChange.Removed):
+                    self.remove(name)
                 else:
-                    self.serviceTypeInfos[service_type].append(info)
+                    info = self.zeroconf.get_service_info(service_type, name, DEFAULT_INFO_TIMEOUT_MS)
+                    if (info):
+                        self.update(serviceFromInfo(info))
+            except Exception as e:
+                self.log.error(f"Service: [{name}] An error occurred handling: [{state_change}]: {e}")
+
+    def index(self, svc: KA9QService, add: bool):
+        # Lock held
+        for addr in svc.addresses:
+            k = (addr, svc.port)
+            if (add):
+                self.byAddress.setdefault(k, set()).add(svc.name)
+            elif (k in self.byAddress):
+                self.byAddress[k].discard(svc.name)
+                if (not self.byAddress[k]):
+                    del self.byAddress[k]
+
+    def update(self, svc: KA9QService):
+        with self.lock:
+            old = self.services.get(svc.name)
+            if (old is not None):
+                self.index(old, False)
+            self.services[svc.name] = svc
+            self.index(svc, True)
+            restarted = svc.name in self.removed
+            self.removed.discard(svc.name)
+
+        if (restarted):
+            change = 'restarted'
+        elif (old is None):
+            change = 'added'
+        elif (old.key() != svc.key()):
+            change = 'updated'
+        else:
+            return      # Re-announced unchanged (or a cached entry confirmed live)
+        self.log.info(f"Service {change}: [{svc.name}]  Addresses: [{svc.addresses}]  Port: [{svc.port}]")
+        self.changed(change, svc)
+
+    def remove(self, name: str):
+        with self.lock:
+            svc = self.services.pop(name, None)
+            if (svc is None):
+                return
+            self.index(svc, False)
+            self.removed.add(name)
+        self.log.info(f"Service removed: [{name}]")
+        self.changed('removed', svc)
+
+    def expireCached(self):
+        # Snapshot entries not seen live by now are gone
+        with self.lock:
+            stale = [s.name for s in self.services.values() if s.cached]
+        for name in stale:
+            self.remove(name)
+            self.removed.discard(name)
+
+    def changed(self, change: str, svc: KA9QService):
+        if (self.cachePath):
+            self.save(self.cachePath)
+        for cb in list(self.changeCallbacks):
+            try:
+                cb(change, svc)
+            except Exception as e:
+                self.log.error(f"Service: [{svc.name}] An error occurred in a change callback: {e}")
+
+    def addChangeCallback(self, cb: ServiceCallback):
+        self.changeCallbacks.append(cb)
+
+    def removeChangeCallback(self, cb: ServiceCallback):
+        if cb in self.changeCallbacks:
+            self.changeCallbacks.remove(cb)
+
+    # Lookups, from memory
+
+    def lookup(self, name: str) -> KA9QService | None:
+        # Full service name, instance name (ie 'hf-status') or server host name (ie 'hf.local')
+        svc = self.services.get(name)
+        if (svc is not None):
+            return svc
+        host = name.rstrip('.') + '.'
+        for s in list(self.services.values()):
+            if (s.name.split('.')[0] == name) or (s.server == host):
+                return s
+        return None
+
+    def findByAddress(self, addr: str, port: int | None = None) -> list[KA9QService]:
+        with self.lock:
+            names = set().union(*(v for (a, p), v in self.byAddress.items() if (a == addr) and (port is None or p == port)))
+            return [self.services[n] for n in names]
+
+    def findByType(self, service_type: str) -> list[KA9QService]:
+        return [s for s in list(self.services.values()) if s.type == service_type]
+
+    def resolve(self, name: str) -> str | None:
+        svc = self.lookup(name)
+        return svc.addresses[0] if (svc) and (svc.addresses) else None
+
+    # Warm start snapshot
+
+    def save(self, path: str):
+        with self.lock:
+            data = [dataclasses.asdict(s) for s in self.services.values()]
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'saved': time.time(), 'services': data}, f, indent=1)
+        os.replace(tmp, path)
+
+    def load(self, path: str):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self.log.warning(f"Ignoring unreadable service snapshot: [{path}]: {e}")
+            return
+        with self.lock:
+            for d in data.get('services', []):
+                svc = KA9QService(**dict(d, cached=True))
+                self.services[svc.name] = svc
+                self.index(svc, True)
+        self.log.info(f"Warm start: [{len(self.services)}] services from: [{path}]")
 
 
 def listServiceTypes(ip_version:IPVersion) -> list[str]:
@@ -81,12 +290,20 @@ def printServiceInfo(info:ServiceInfo):
         print("\n")
 
 
+def printService(change: str, svc: KA9QService):
+    print(f"{change:<10} {svc.name}  {', '.join(svc.addresses)}:{svc.port}  server: {svc.server}  {svc.properties}"
+          f"{'  (cached)' if svc.cached else ''}")
+
+
 def main():
-    logging.basicConfig(level=logging.DEBUG)
+    logging.basicConfig(level=logging.INFO)
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--find", action="store_true", help="Browse all available services")
+    parser.add_argument("--cache", type=str, default=DEFAULT_CACHE_PATH, help="Warm start snapshot file.")
+    parser.add_argument("--no-cache", action="store_true", help="Don't load / save the snapshot.")
+    parser.add_argument("--once", type=float, help="Print the registry after this many seconds and exit, rather than following changes.")
     version_group = parser.add_mutually_exclusive_group()
     version_group.add_argument("--v6-only", action="store_true")
     version_group.add_argument("--v4-only", action="store_true")
@@ -107,26 +324,27 @@ def main():
         serviceTypes = listServiceTypes(ip_version)
 
     print(f"\nBrowsing {len(serviceTypes)} service types(s), press Ctrl-C to exit...\n")
-    
-    dss = KA9QRadioServiceDiscovery(serviceTypes=serviceTypes, ipVersion=ip_version)
+
+    dss = KA9QRadioServiceDiscovery(serviceTypes=serviceTypes, ipVersion=ip_version,
+                                    cachePath=None if args.no_cache else args.cache)
+    for svc in list(dss.services.values()):
+        printService('cached', svc)
+    if (args.once is None):
+        dss.addChangeCallback(printService)
 
     try:
-        # while True:
-            # sleep(0.1)
-        sleep(2.0)
+        if (args.once is not None):
+            sleep(args.once)
+            for svc in sorted(dss.services.values(), key=lambda s: s.name):
+                printService(svc.type, svc)
+        else:
+            while True:
+                sleep(1)
     except KeyboardInterrupt:
         pass
     finally:
         dss.close()
 
-    for st in dss.serviceTypeInfos.keys():
-        infos = dss.serviceTypeInfos[st]
-        print(f"Discovered {len(infos)} services for Service Type: [{st}]")
-        for info in infos:
-            print(f"Info from zeroconf.get_service_info: {info!r}")
-            printServiceInfo(info)  
-    
-
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
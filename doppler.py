@@ -0,0 +1,346 @@
+import argparse
+import datetime
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+from control import Ka9qRadioControl, DEFAULT_MCAST_GROUP
+from listener import Ka9qRadioStatusListener
+from status import StatusType
+from statusrate import Ka9qStatusRateManager, DEFAULT_ACTIVE_INTERVAL
+from typing import Any
+
+# Doppler tracking. Rather than retuning many times a second, the channel is sent a Doppler offset and rate
+# (DOPPLER_FREQUENCY / DOPPLER_FREQUENCY_RATE) which radiod integrates itself. Each update is the longest
+# straight line from now that stays within the tolerance of the pass profile, so the next one is only needed
+# when the curve bends away from it, typically a few per minute and more often around closest approach.
+#
+# Pass profiles are a time / offset table (unix time or ISO 8601 UTC, then Hz, one pair per line) or are
+# computed from a TLE (requires the optional 'skyfield' package). Offsets are the shift of the received signal,
+# positive while the satellite approaches, and are added to the channel's frequency by radiod.
+
+DEFAULT_TOLERANCE_HZ = 1.0
+DEFAULT_TICK_INTERVAL = 0.1     # Seconds between checks of the commanded line against the profile
+DEFAULT_MAX_SPAN = 300.0        # Longest single segment (seconds)
+DEFAULT_PROFILE_STEP = 1.0      # Seconds between TLE profile points
+DEFAULT_PASS_DURATION = 900.0
+PLAN_STEP = 0.5                 # Resolution segments are fitted at
+PLAN_MARGIN = 0.5               # Segments are fitted to this fraction of the tolerance, leaving room for latency
+
+SPEED_OF_LIGHT = 299792458.0
+
+
+class DopplerProfile():
+
+    times: np.ndarray           # Unix time
+    offsets: np.ndarray         # Hz
+    rates: np.ndarray           # Hz / sec
+
+    def __init__(self, times: np.ndarray, offsets: np.ndarray):
+        order = np.argsort(times)
+        self.times = np.asarray(times, dtype=np.float64)[order]
+        self.offsets = np.asarray(offsets, dtype=np.float64)[order]
+        if (len(self.times) < 2):
+            raise Exception("A Doppler profile needs at least two points.")
+        self.rates = np.gradient(self.offsets, self.times)
+
+    @property
+    def start(self) -> float:
+        return float(self.times[0])
+
+    @property
+    def end(self) -> float:
+        return float(self.times[-1])
+
+    def offset(self, t: float | np.ndarray) -> float | np.ndarray:
+        return np.interp(t, self.times, self.offsets)
+
+    def rate(self, t: float) -> float:
+        return float(np.interp(t, self.times, self.rates))
+
+    def shifted(self, dt: float) -> 'DopplerProfile':
+        return DopplerProfile(self.times + dt, self.offsets)
+
+    def planSegment(self, t0: float, tolerance: float, maxSpan: float = DEFAULT_MAX_SPAN) -> tuple[float, float, float]:
+        # Returns (offset, rate, until): the longest line from the profile at t0 within tolerance of it
+        d0 = float(self.offset(t0))
+        span = min(maxSpan, self.end - t0)
+        if (span <= PLAN_STEP):
+            return d0, self.rate(t0), self.end
+
+        dt = np.arange(1, int(span / PLAN_STEP) + 1) * PLAN_STEP
+        dd = self.offset(t0 + dt) - d0
+        rate, until = self.rate(t0), t0 + PLAN_STEP
+        for k in range(len(dt)):
+            slope = dd[k] / dt[k]
+            if (np.abs(dd[:k + 1] - slope * dt[:k + 1]).max() > tolerance):
+                break
+            rate, until = slope, t0 + dt[k]
+        return d0, float(rate), float(until)
+
+
+def parseTime(s: str) -> float:
+    try:
+        return float(s)
+    except ValueError:
+        t = datetime.datetime.fromisoformat(s.replace('Z', '+00:00'))
+        if (t.tzinfo is None):
+            t = t.replace(tzinfo=datetime.timezone.utc)
+        return t.timestamp()
+
+def loadTable(path: str) -> DopplerProfile:
+    times = []
+    offsets = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if (not line):
+                continue
+            parts = line.replace(',', ' ').split()
+            times.append(parseTime(parts[0]))
+            offsets.append(float(parts[1]))
+    return DopplerProfile(np.array(times), np.array(offsets))
+
+def profileFromTle(path: str, freq_hz: float, lat: float, lon: float, alt_m: float = 0.0, name: str | None = None,
+                   start: float | None = None, duration: float = DEFAULT_PASS_DURATION,
+                   step: float = DEFAULT_PROFILE_STEP) -> DopplerProfile:
+    # Optional dependency, only needed for TLE pass profiles: pip install skyfield
+    try:
+        from skyfield.api import EarthSatellite, load, wgs84
+    except ImportError:
+        raise Exception("TLE pass profiles require the 'skyfield' package to be installed.")
+
+    with open(path) as f:
+        lines = [l.strip() for l in f if l.strip()]
+    sets = []
+    for i, l in enumerate(lines):
+        if l.startswith('1 ') and (i + 1 < len(lines)) and lines[i + 1].startswith('2 '):
+            sets.append((lines[i - 1] if (i > 0) and not lines[i - 1][:2] in ('1 ', '2 ') else None, l, lines[i + 1]))
+    if (name):
+        sets = [s for s in sets if s[0] and (s[0].strip().upper() == name.strip().upper())]
+    if (not sets):
+        raise Exception(f"No TLE found in: [{path}]{f' for: [{name}]' if name else ''}.")
+
+    ts = load.timescale()
+    satName, l1, l2 = sets[0]
+    sat = EarthSatellite(l1, l2, satName, ts)
+    observer = wgs84.latlon(lat, lon, elevation_m=alt_m)
+
+    t0 = start if start is not None else time.time()
+    times = t0 + np.arange(0.0, duration + step / 2, step)
+    t = ts.from_datetimes([datetime.datetime.fromtimestamp(x, datetime.timezone.utc) for x in times])
+    rangeRate = (sat - observer).at(t).frame_latlon_and_rates(observer)[5].km_per_s * 1000.0
+    return DopplerProfile(times, -freq_hz * rangeRate / SPEED_OF_LIGHT)
+
+
+class ResidualStats():
+
+    count: int
+    sumSq: float
+    maxAbs: float
+
+    def __init__(self):
+        self.count = 0
+        self.sumSq = 0.0
+        self.maxAbs = 0.0
+
+    def add(self, err: float):
+        self.count += 1
+        self.sumSq += err * err
+        self.maxAbs = max(self.maxAbs, abs(err))
+
+    def rms(self) -> float:
+        return math.sqrt(self.sumSq / self.count) if self.count else 0.0
+
+
+class DopplerTracker():
+
+    log: logging.Logger
+
+    ka9q_rc: Ka9qRadioControl
+    ka9q_rs: Ka9qRadioStatusListener | None
+    statusRate: Ka9qStatusRateManager | None
+    ssrc: int
+    profile: DopplerProfile
+    tolerance: float
+    maxSpan: float
+    tickInterval: float
+
+    # Line last commanded: offset + rate * (t - cmdTime)
+    cmdTime: float | None
+    cmdOffset: float
+    cmdRate: float
+    segmentEnd: float
+
+    packets: int
+    trackStart: float | None
+    modelResidual: ResidualStats        # Profile vs the commanded line, every tick
+    reportedResidual: ResidualStats     # Profile vs the DOPPLER_FREQUENCY radiod reports
+
+    running: bool
+    trackerThread: threading.Thread | None
+
+    def __init__(self, ka9q_rc: Ka9qRadioControl, ssrc: int, profile: DopplerProfile,
+                 tolerance: float = DEFAULT_TOLERANCE_HZ, ka9q_rs: Ka9qRadioStatusListener | None = None,
+                 maxSpan: float = DEFAULT_MAX_SPAN, tickInterval: float = DEFAULT_TICK_INTERVAL,
+                 statusRate: Ka9qStatusRateManager | None = None):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.ka9q_rc = ka9q_rc
+        self.ka9q_rs = ka9q_rs
+        self.statusRate = statusRate
+        self.ssrc = ssrc
+        self.profile = profile
+        self.tolerance = tolerance
+        self.maxSpan = maxSpan
+        self.tickInterval = tickInterval
+
+        self.cmdTime = None
+        self.cmdOffset = 0.0
+        self.cmdRate = 0.0
+        self.segmentEnd = 0.0
+
+        self.packets = 0
+        self.trackStart = None
+        self.modelResidual = ResidualStats()
+        self.reportedResidual = ResidualStats()
+
+        self.running = False
+        self.trackerThread = None
+
+        if (self.ka9q_rs is not None):
+            self.ka9q_rs.addStatusCallback(self.onStatus)
+
+    def update(self, now: float):
+        d0, rate, until = self.profile.planSegment(now, self.tolerance * PLAN_MARGIN, self.maxSpan)
+        self.ka9q_rc.control_set(self.ssrc, {StatusType.DOPPLER_FREQUENCY: d0, StatusType.DOPPLER_FREQUENCY_RATE: rate})
+        self.cmdTime, self.cmdOffset, self.cmdRate, self.segmentEnd = now, d0, rate, until
+        self.packets += 1
+        self.log.debug("SSRC: [%s] Doppler: [%.1fHz]  Rate: [%.3fHz/s]  For: [%.1fs]", self.ssrc, d0, rate, until - now)
+
+    def tick(self, now: float) -> bool:
+        # Returns False once the pass is over
+        if (now < self.profile.start):
+            return True
+        if (now > self.profile.end):
+            return False
+        if (self.trackStart is None):
+            self.trackStart = now
+
+        if (self.cmdTime is not None):
+            err = float(self.profile.offset(now)) - (self.cmdOffset + self.cmdRate * (now - self.cmdTime))
+            self.modelResidual.add(err)
+            if (abs(err) <= self.tolerance) and (now < self.segmentEnd):
+                return True
+        self.update(now)
+        return True
+
+    def onStatus(self, ssrc: int, stat: dict[StatusType, Any]):
+        if (ssrc != self.ssrc) or (self.cmdTime is None):
+            return
+        reported = stat.get(StatusType.DOPPLER_FREQUENCY)
+        now = time.time()
+        if (reported is not None) and (self.profile.start <= now <= self.profile.end):
+            self.reportedResidual.add(reported - float(self.profile.offset(now)))
+
+    def packetsPerMinute(self) -> float:
+        if (self.trackStart is None):
+            return 0.0
+        elapsed = min(time.time(), self.profile.end) - self.trackStart
+        return 60.0 * self.packets / elapsed if elapsed > 0 else 0.0
+
+    def report(self) -> str:
+        return (f"SSRC: [{self.ssrc}] Doppler updates: [{self.packets}] ([{self.packetsPerMinute():.1f}]/min)  "
+                f"Model residual rms / max: [{self.modelResidual.rms():.2f} / {self.modelResidual.maxAbs:.2f}Hz]  "
+                f"Reported residual rms / max: [{self.reportedResidual.rms():.2f} / {self.reportedResidual.maxAbs:.2f}Hz]")
+
+    def trackerHandler(self):
+        while self.running:
+            if (not self.tick(time.time())):
+                break
+            time.sleep(self.tickInterval)
+        # Pass over, leave the channel without an offset
+        self.ka9q_rc.control_set(self.ssrc, {StatusType.DOPPLER_FREQUENCY: 0.0, StatusType.DOPPLER_FREQUENCY_RATE: 0.0})
+        self.running = False
+        self.log.info(self.report())
+
+    def start(self):
+        if (self.statusRate):
+            self.statusRate.hold(self.ssrc, 'doppler')
+        self.running = True
+        self.trackerThread = threading.Thread(target=self.trackerHandler, daemon=True)
+        self.trackerThread.start()
+
+    def stop(self):
+        self.running = False
+        if (self.trackerThread):
+            self.trackerThread.join(2)
+            self.trackerThread = None
+        if (self.statusRate):
+            self.statusRate.release(self.ssrc, 'doppler')
+        if (self.ka9q_rs is not None):
+            self.ka9q_rs.removeStatusCallback(self.onStatus)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio Doppler tracker")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_MCAST_GROUP, help="Multicast group name/ip for control / status.")
+    parser.add_argument("ssrc", type=int, help="SSRC of the channel to track.")
+    parser.add_argument("--table", type=str, help="Pass profile: time (unix or ISO 8601 UTC), offset (Hz) per line.")
+    parser.add_argument("--start-now", action='store_true', help="Shift the --table profile to start now (testing / replays).")
+    parser.add_argument("--tle", type=str, help="TLE file to compute the pass profile from (requires skyfield).")
+    parser.add_argument("--sat", type=str, help="Satellite name in the TLE file (default the first).")
+    parser.add_argument("--freq", type=float, help="Satellite downlink frequency (Hz), also tunes the channel.")
+    parser.add_argument("--mode", type=str, default='usb', help="Mode to tune the channel to with --freq.")
+    parser.add_argument("--lat", type=float, help="Observer latitude (degrees).")
+    parser.add_argument("--lon", type=float, help="Observer longitude (degrees).")
+    parser.add_argument("--alt", type=float, default=0.0, help="Observer altitude (m).")
+    parser.add_argument("--start", type=str, help="Profile start time (unix or ISO 8601 UTC), default now.")
+    parser.add_argument("--duration", type=float, default=DEFAULT_PASS_DURATION, help="TLE profile duration (seconds).")
+    parser.add_argument("--status-active", type=int, default=DEFAULT_ACTIVE_INTERVAL, help="Channel STATUS_INTERVAL (frames) while tracking, 0 leaves it unchanged.")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE_HZ, help="Allowed frequency error (Hz).")
+    args = parser.parse_args()
+
+    if (args.table):
+        profile = loadTable(args.table)
+        if (args.start_now):
+            profile = profile.shifted(time.time() - profile.start)
+    elif (args.tle):
+        if (args.freq is None) or (args.lat is None) or (args.lon is None):
+            parser.error("--tle requires --freq, --lat and --lon.")
+        profile = profileFromTle(args.tle, args.freq, args.lat, args.lon, args.alt, args.sat,
+                                 parseTime(args.start) if args.start else None, args.duration)
+    else:
+        parser.error("A pass profile (--table or --tle) is required.")
+
+    rc = Ka9qRadioControl(args.mcast_group)
+    rs = Ka9qRadioStatusListener(args.mcast_group, [args.ssrc])
+    rs.startHandler()
+    if (args.freq is not None):
+        rc.control_set_frequency(args.freq, args.mode, args.ssrc)
+
+    statusRate = Ka9qStatusRateManager(rc, rs, args.status_active) if args.status_active else None
+    tracker = DopplerTracker(rc, args.ssrc, profile, args.tolerance, rs, statusRate=statusRate)
+    tracker.start()
+    try:
+        while tracker.running:
+            time.sleep(10)
+            if (tracker.running):
+                tracker.log.info(tracker.report())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tracker.stop()
+        if (statusRate):
+            statusRate.stop()
+        rs.stopHandler()
+        rc.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import argparse
+import logging
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from control import DEFAULT_RTP_PORT, DEFAULT_STAT_PORT
+from mcastsock import connect_mcast, listen_mcast
+from rtptime import unix_to_gps_ns
+from status import Encoding, StatusType, SAMPLE_STATUS_PACKET, encode_bytes, encode_eol, encode_status, parsePacket
+from typing import Any
+
+# Local stand-in for radiod, so the listener, control path and rigctld server can be driven (and
+# measured) without real hardware. Listens for control packets on a (loopback) multicast group,
+# keeps N simulated channels and multicasts their status periodically and in response to each
+# command (echoing COMMAND_TAG). Optionally sends RTP PCM (a tone) and answers polls of
+# 'spectrum' preset channels with BIN_DATA. A STATUS_INTERVAL command also sends the channel's status
+# every N frames to its data group (port 5006), as radiod does.
+#
+#   python fakeradiod.py 239.255.99.1 --channels 500 --status-rate 1 --rtp 4
+#   python hamlibserver.py 239.255.99.1 10000 ...
+
+DEFAULT_FAKE_MCAST_GROUP = '239.255.99.1'
+DEFAULT_FAKE_RTP_GROUP = '239.255.99.2'
+DEFAULT_BASE_SSRC = 10000
+DEFAULT_BASE_FREQ = 7074000.0
+DEFAULT_CHANNEL_SPACING = 5000.0
+DEFAULT_STATUS_RATE = 1.0            # Status packets / sec per channel
+DEFAULT_SPECTRUM_BIN_COUNT = 64
+
+POLL_ALL_SSRC = 0xFFFFFFFF           # Command to this SSRC returns the status of every channel
+RTP_PACKET_TIME = 0.020              # Seconds of audio per RTP packet
+TONE_HZ = 1000                       # Whole number of cycles per packet, so one payload is reused
+
+# Values the emulator updates itself, every other field is taken from the template / commands.
+DYNAMIC_FIELDS = (StatusType.COMMAND_TAG, StatusType.CMD_CNT, StatusType.GPS_TIME, StatusType.RTP_TIMESNAP,
+                  StatusType.OUTPUT_DATA_PACKETS, StatusType.OUTPUT_SAMPLES, StatusType.BASEBAND_POWER,
+                  StatusType.DOPPLER_FREQUENCY)
+
+# Filter edges (Hz) and demodulator applied with a PRESET command
+PRESET_DEFAULTS = {
+    'usb': {StatusType.LOW_EDGE: 50.0, StatusType.HIGH_EDGE: 3000.0, StatusType.DEMOD_TYPE: 0, StatusType.OUTPUT_CHANNELS: 1},
+    'lsb': {StatusType.LOW_EDGE: -3000.0, StatusType.HIGH_EDGE: -50.0, StatusType.DEMOD_TYPE: 0, StatusType.OUTPUT_CHANNELS: 1},
+    'cwu': {StatusType.LOW_EDGE: -200.0, StatusType.HIGH_EDGE: 200.0, StatusType.DEMOD_TYPE: 0, StatusType.OUTPUT_CHANNELS: 1},
+    'cwl': {StatusType.LOW_EDGE: -200.0, StatusType.HIGH_EDGE: 200.0, StatusType.DEMOD_TYPE: 0, StatusType.OUTPUT_CHANNELS: 1},
+    'am': {StatusType.LOW_EDGE: -5000.0, StatusType.HIGH_EDGE: 5000.0, StatusType.DEMOD_TYPE: 0, StatusType.OUTPUT_CHANNELS: 1},
+    'fm': {StatusType.LOW_EDGE: -8000.0, StatusType.HIGH_EDGE: 8000.0, StatusType.DEMOD_TYPE: 1, StatusType.OUTPUT_CHANNELS: 1},
+    'iq': {StatusType.LOW_EDGE: -5000.0, StatusType.HIGH_EDGE: 5000.0, StatusType.DEMOD_TYPE: 0, StatusType.OUTPUT_CHANNELS: 2},
+    'spectrum': {StatusType.DEMOD_TYPE: 3, StatusType.OUTPUT_CHANNELS: 1},
+}
+
+
+class FakeChannel():
+
+    ssrc: int
+    status: dict[StatusType, Any]
+    encoded: bytes | None        # Pre-encoded static fields, rebuilt after a command changes the channel
+    started: float               # monotonic time the channel's RTP stream (real or simulated) started
+    rtpBase: int
+    rtpSeq: int
+    cmdCnt: int
+    tag: int
+    dopplerTime: float           # monotonic time DOPPLER_FREQUENCY was last set, radiod integrates the rate from there
+    statusInterval: float        # Seconds between status sent to the data group (STATUS_INTERVAL command), 0 off
+    nextStatus: float
+
+    def __init__(self, ssrc: int, template: dict[StatusType, Any]):
+        self.ssrc = ssrc
+        self.status = dict(template)
+        self.status[StatusType.OUTPUT_SSRC] = ssrc
+        self.encoded = None
+        self.started = time.monotonic()
+        self.rtpBase = random.getrandbits(32)
+        self.rtpSeq = random.getrandbits(16)
+        self.cmdCnt = 0
+        self.tag = 0
+        self.dopplerTime = self.started
+        self.statusInterval = 0.0
+        self.nextStatus = 0.0
+
+    def samprate(self) -> int:
+        if (self.status.get(StatusType.OUTPUT_ENCODING) == Encoding.OPUS.value):
+            return 48000
+        return self.status.get(StatusType.OUTPUT_SAMPRATE) or 12000
+
+    def rtpTimestamp(self, now: float) -> int:
+        return (self.rtpBase + int((now - self.started) * self.samprate())) & 0xFFFFFFFF
+
+    def doppler(self, now: float) -> float:
+        return self.status.get(StatusType.DOPPLER_FREQUENCY, 0.0) + \
+               self.status.get(StatusType.DOPPLER_FREQUENCY_RATE, 0.0) * (now - self.dopplerTime)
+
+    def apply(self, cmd: dict[StatusType, Any]):
+        if (StatusType.DOPPLER_FREQUENCY in cmd) or (StatusType.DOPPLER_FREQUENCY_RATE in cmd):
+            now = time.monotonic()
+            self.status[StatusType.DOPPLER_FREQUENCY] = self.doppler(now)
+            self.dopplerTime = now
+
+        if (StatusType.STATUS_INTERVAL in cmd):
+            self.statusInterval = max(0, cmd[StatusType.STATUS_INTERVAL]) * RTP_PACKET_TIME
+            self.nextStatus = time.monotonic()
+
+        preset = cmd.get(StatusType.PRESET)
+        if (preset in PRESET_DEFAULTS):
+            self.status.update(PRESET_DEFAULTS[preset])
+            if (preset == 'spectrum'):
+                self.status.setdefault(StatusType.BIN_COUNT, DEFAULT_SPECTRUM_BIN_COUNT)
+                self.status.setdefault(StatusType.NONCOHERENT_BIN_BW, 100.0)
+
+        for t, v in cmd.items():
+            if (t in (StatusType.COMMAND_TAG, StatusType.OUTPUT_SSRC)):
+                continue
+            if (t == StatusType.OUTPUT_SAMPRATE) or (t == StatusType.OUTPUT_ENCODING):
+                # Keep RTP timestamps continuous across a rate change
+                now = time.monotonic()
+                self.rtpBase = self.rtpTimestamp(now)
+                self.started = now
+            self.status[t] = v
+
+        freq = self.status.get(StatusType.RADIO_FREQUENCY, 0.0)
+        self.status[StatusType.SECOND_LO_FREQUENCY] = -freq
+        self.cmdCnt += 1
+        self.tag = cmd.get(StatusType.COMMAND_TAG, 0)
+        self.encoded = None
+
+    def isSpectrum(self) -> bool:
+        return self.status.get(StatusType.PRESET) == 'spectrum'
+
+    def encodeStatus(self, now: float, withBinData: bool = False) -> bytes:
+        if (self.encoded is None):
+            buf = bytes()
+            for t, v in self.status.items():
+                if (t not in DYNAMIC_FIELDS):
+                    buf = encode_status(buf, t, v)
+            self.encoded = buf
+
+        # 00 - Status Update
+        buf = bytes([0]) + self.encoded
+        buf = encode_status(buf, StatusType.COMMAND_TAG, self.tag)
+        buf = encode_status(buf, StatusType.CMD_CNT, self.cmdCnt & 0xFF)
+        buf = encode_status(buf, StatusType.GPS_TIME, unix_to_gps_ns(time.time()))
+        buf = encode_status(buf, StatusType.RTP_TIMESNAP, self.rtpTimestamp(now))
+        buf = encode_status(buf, StatusType.OUTPUT_DATA_PACKETS, int((now - self.started) / RTP_PACKET_TIME))
+        buf = encode_status(buf, StatusType.OUTPUT_SAMPLES, int((now - self.started) * self.samprate()))
+        buf = encode_status(buf, StatusType.BASEBAND_POWER, random.gauss(-87.0, 0.5))
+        buf = encode_status(buf, StatusType.DOPPLER_FREQUENCY, self.doppler(now))
+        if (withBinData):
+            buf = encode_bytes(buf, StatusType.BIN_DATA, self.binData())
+        return encode_eol(buf)
+
+    def binData(self) -> bytes:
+        # Noise floor with a carrier, in FFT order (DC first) as radiod sends them
+        n = int(self.status.get(StatusType.BIN_COUNT) or DEFAULT_SPECTRUM_BIN_COUNT)
+        bins = np.random.exponential(1e-12, n).astype('>f4')
+        bins[n // 8] = 1e-9
+        return bins.tobytes()
+
+
+class FakeRadiod():
+
+    log: logging.Logger
+
+    mcast_group_ip: str
+    rtp_group_ip: str
+    statusRate: float
+    rtpChannels: int             # Number of channels (lowest SSRCs first) to generate RTP PCM for
+
+    channels: dict[int, FakeChannel]
+    template: dict[StatusType, Any]
+    lock: threading.Lock
+
+    s_in: socket.socket
+    s_out: socket.socket
+    payloads: dict[tuple[int, int, int], bytes]
+
+    # Counters
+    statusSent: int
+    commands: int
+    rtpSent: int
+
+    running: bool
+    threads: list[threading.Thread]
+
+    def __init__(self, mcast_group_ip: str = DEFAULT_FAKE_MCAST_GROUP, rtp_group_ip: str = DEFAULT_FAKE_RTP_GROUP,
+                 statusRate: float = DEFAULT_STATUS_RATE, rtpChannels: int = 0):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.mcast_group_ip = mcast_group_ip
+        self.rtp_group_ip = rtp_group_ip
+        self.statusRate = statusRate
+        self.rtpChannels = rtpChannels
+
+        self.channels = {}
+        self.lock = threading.Lock()
+        self.payloads = {}
+        self.statusSent = 0
+        self.commands = 0
+        self.rtpSent = 0
+        self.running = False
+        self.threads = []
+
+        # A real radiod channel status as the starting point, pointed at our own groups
+        self.template = parsePacket(SAMPLE_STATUS_PACKET)
+        self.template[StatusType.DESCRIPTION] = 'fakeradiod'
+        self.template[StatusType.STATUS_DEST_SOCKET] = {'addr': mcast_group_ip, 'port': DEFAULT_STAT_PORT}
+        self.template[StatusType.OUTPUT_DATA_DEST_SOCKET] = {'addr': rtp_group_ip, 'port': DEFAULT_RTP_PORT}
+        self.template[StatusType.OUTPUT_SAMPRATE] = 12000
+
+        self.s_in = listen_mcast(mcast_group_ip, DEFAULT_STAT_PORT, timeout=0.5)
+        self.s_out = connect_mcast(group_ip=mcast_group_ip)
+
+    def addChannel(self, ssrc: int, freq: float, preset: str = 'usb') -> FakeChannel:
+        chan = FakeChannel(ssrc, self.template)
+        chan.apply({StatusType.RADIO_FREQUENCY: freq, StatusType.PRESET: preset})
+        chan.cmdCnt = 0
+        with self.lock:
+            self.channels[ssrc] = chan
+        return chan
+
+    def sendStatus(self, chan: FakeChannel, withBinData: bool = False, group_ip: str | None = None):
+        with self.lock:
+            buf = chan.encodeStatus(time.monotonic(), withBinData)
+        self.s_out.sendto(buf, (group_ip or self.mcast_group_ip, DEFAULT_STAT_PORT))
+        self.statusSent += 1
+
+    def processCommand(self, data: bytes):
+        cmd = parsePacket(data[1:])
+        ssrc = cmd.get(StatusType.OUTPUT_SSRC)
+        if (ssrc is None):
+            return
+        self.commands += 1
+
+        if (ssrc == POLL_ALL_SSRC):
+            for chan in list(self.channels.values()):
+                chan.tag = cmd.get(StatusType.COMMAND_TAG, 0)
+                self.sendStatus(chan)
+            return
+
+        with self.lock:
+            chan = self.channels.get(ssrc)
+            if (chan is None):
+                # radiod creates channels on demand for an unknown SSRC
+                self.log.info(f"SSRC: [{ssrc}] Creating channel.")
+                chan = self.channels[ssrc] = FakeChannel(ssrc, self.template)
+            chan.apply(cmd)
+
+        self.sendStatus(chan, withBinData=chan.isSpectrum())
+
+    def controlHandler(self):
+        buf = bytearray(65536)
+        while self.running:
+            try:
+                n = self.s_in.recv_into(buf)
+                # Our own (and any other radiod's) status packets also arrive here, only commands are processed
+                if (n > 1) and (buf[0] == 1):
+                    self.processCommand(bytes(buf[:n]))
+            except socket.timeout:
+                pass
+            except Exception as e:
+                self.log.error(f"An error occurred processing command: {e}")
+
+    def statusHandler(self):
+        # Spread each round of status packets evenly over the interval, rather than bursting them
+        nextSend = time.monotonic()
+        while self.running:
+            chans = list(self.channels.values())
+            if (not chans) or (self.statusRate <= 0):
+                time.sleep(0.1)
+                nextSend = time.monotonic()
+                continue
+
+            gap = 1.0 / (self.statusRate * len(chans))
+            for chan in chans:
+                if (not self.running):
+                    break
+                self.sendStatus(chan)
+                nextSend += gap
+                delay = nextSend - time.monotonic()
+                if (delay > 0):
+                    time.sleep(delay)
+                elif (delay < -1.0):
+                    nextSend = time.monotonic()      # Fallen too far behind, don't try to catch up
+
+    def intervalHandler(self):
+        # Channels given a STATUS_INTERVAL also send their status to their data group every N frames
+        while self.running:
+            now = time.monotonic()
+            with self.lock:
+                due = [c for c in self.channels.values() if (c.statusInterval > 0) and (c.nextStatus <= now)]
+            for chan in due:
+                self.sendStatus(chan, group_ip=chan.status[StatusType.OUTPUT_DATA_DEST_SOCKET]['addr'])
+                chan.nextStatus += chan.statusInterval
+                if (chan.nextStatus < now):
+                    chan.nextStatus = now + chan.statusInterval
+            time.sleep(RTP_PACKET_TIME / 2)
+
+    def rtpPayload(self, samprate: int, channels: int, encoding: int) -> bytes:
+        key = (samprate, channels, encoding)
+        payload = self.payloads.get(key)
+        if (payload is None):
+            n = int(samprate * RTP_PACKET_TIME)
+            ph = 2 * np.pi * TONE_HZ * np.arange(n) / samprate
+            if (channels == 2):
+                x = np.column_stack((np.cos(ph), np.sin(ph))).ravel()
+            else:
+                x = np.sin(ph)
+            dtype = '<i2' if encoding == Encoding.S16LE.value else '>i2'
+            payload = self.payloads[key] = (x * 8192).astype(dtype).tobytes()
+        return payload
+
+    def rtpHandler(self):
+        nextSend = time.monotonic()
+        while self.running:
+            with self.lock:
+                chans = [c for c in sorted(self.channels.values(), key=lambda c: c.ssrc) if not c.isSpectrum()]
+            for chan in chans[:self.rtpChannels]:
+                s = chan.status
+                samprate = chan.samprate()
+                payload = self.rtpPayload(samprate, s.get(StatusType.OUTPUT_CHANNELS) or 1,
+                                          s.get(StatusType.OUTPUT_ENCODING, Encoding.S16BE.value))
+                ts = chan.rtpTimestamp(nextSend)
+                hdr = struct.pack('>BBHII', 0x80, s.get(StatusType.RTP_PT, 0) & 0x7F, chan.rtpSeq, ts, chan.ssrc)
+                chan.rtpSeq = (chan.rtpSeq + 1) & 0xFFFF
+                dest = s[StatusType.OUTPUT_DATA_DEST_SOCKET]
+                self.s_out.sendto(hdr + payload, (dest['addr'], dest['port']))
+                self.rtpSent += 1
+
+            nextSend += RTP_PACKET_TIME
+            delay = nextSend - time.monotonic()
+            if (delay > 0):
+                time.sleep(delay)
+            else:
+                nextSend = time.monotonic()
+
+    def start(self):
+        self.running = True
+        handlers = [self.controlHandler, self.statusHandler, self.intervalHandler]
+        if (self.rtpChannels > 0):
+            handlers.append(self.rtpHandler)
+        for h in handlers:
+            t = threading.Thread(target=h, daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        self.running = False
+        for t in self.threads:
+            t.join(2)
+        self.threads = []
+        self.s_in.close()
+        self.s_out.close()
+        self.log.info(f"Stopped. Channels: [{len(self.channels)}]  Commands: [{self.commands}]  "
+                      f"Status sent: [{self.statusSent}]  RTP sent: [{self.rtpSent}]")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Fake KA9Q Radio (radiod) emulator")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_FAKE_MCAST_GROUP, help="Multicast group ip for status / control.")
+    parser.add_argument("-n", "--channels", type=int, default=10, help="Number of channels to create at startup.")
+    parser.add_argument("--base-ssrc", type=int, default=DEFAULT_BASE_SSRC, help="SSRC of the first channel, others follow sequentially.")
+    parser.add_argument("--freq", type=float, default=DEFAULT_BASE_FREQ, help="Frequency (Hz) of the first channel.")
+    parser.add_argument("--spacing", type=float, default=DEFAULT_CHANNEL_SPACING, help="Frequency spacing (Hz) between channels.")
+    parser.add_argument("-sr", "--status-rate", type=float, default=DEFAULT_STATUS_RATE, help="Status packets / sec per channel.")
+    parser.add_argument("--rtp", type=int, default=0, help="Number of channels to send RTP PCM (a tone) for.")
+    parser.add_argument("--rtp-group", type=str, default=DEFAULT_FAKE_RTP_GROUP, help="Multicast group ip for RTP streams.")
+    parser.add_argument("--spectrum", type=int, default=0, help="Number of additional 'spectrum' preset channels.")
+    args = parser.parse_args()
+
+    radiod = FakeRadiod(args.mcast_group, args.rtp_group, args.status_rate, args.rtp)
+    for i in range(args.channels):
+        radiod.addChannel(args.base_ssrc + i, args.freq + i * args.spacing)
+    for i in range(args.spectrum):
+        radiod.addChannel(args.base_ssrc + args.channels + i, args.freq, preset='spectrum')
+
+    try:
+        radiod.start()
+        print(f"Fake radiod on {args.mcast_group}:{DEFAULT_STAT_PORT} with {len(radiod.channels)} channels, press Ctrl-C to exit...")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        radiod.stop()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
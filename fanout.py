@@ -0,0 +1,213 @@
+import collections
+import logging
+import os
+import socket
+import threading
+
+DEFAULT_MAX_QUEUE_BYTES = 4 * 1024 * 1024    # Per client backlog before the oldest data is dropped
+
+class FanoutClient():
+    """A connected client with a bounded send queue, serviced by its own sender thread.
+
+    When a client can not keep up the oldest queued data is dropped, so a slow client never
+    backs up the producer (or the other clients).
+    """
+
+    log: logging.Logger
+
+    server: 'FanoutServer'
+    sock: socket.socket | None
+    address: str
+
+    queue: collections.deque
+    queuedBytes: int
+    maxQueueBytes: int
+    dropped: int             # Chunks dropped due to a full queue
+    sent: int                # Bytes sent
+
+    cond: threading.Condition
+    running: bool
+    senderThread: threading.Thread
+    readerThread: threading.Thread
+
+    def __init__(self, server: 'FanoutServer', sock: socket.socket, address, maxQueueBytes: int):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.server = server
+        self.sock = sock
+        self.address = str(address)
+        self.queue = collections.deque()
+        self.queuedBytes = 0
+        self.maxQueueBytes = maxQueueBytes
+        self.dropped = 0
+        self.sent = 0
+        self.cond = threading.Condition()
+        self.running = True
+
+    def start(self):
+        self.senderThread = threading.Thread(target=self.senderHandler, daemon=True)
+        self.senderThread.start()
+        self.readerThread = threading.Thread(target=self.readerHandler, daemon=True)
+        self.readerThread.start()
+
+    def enqueue(self, data) -> bool:
+        n = len(data)
+        with self.cond:
+            if (not self.running):
+                return False
+            while self.queue and (self.queuedBytes + n > self.maxQueueBytes):
+                old = self.queue.popleft()
+                self.queuedBytes -= len(old)
+                self.dropped += 1
+            self.queue.append(data)
+            self.queuedBytes += n
+            self.cond.notify()
+        return True
+
+    def senderHandler(self):
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if (not self.running):
+                    return
+                data = self.queue.popleft()
+                self.queuedBytes -= len(data)
+            try:
+                self.sock.sendall(data)
+                self.sent += len(data)
+            except OSError:
+                self.close()
+                return
+
+    def readerHandler(self):
+        while self.running:
+            try:
+                data = self.sock.recv(4096)
+            except OSError:
+                data = b''
+            if (not data):
+                self.close()
+                return
+            try:
+                self.server.onClientData(self, data)
+            except Exception as e:
+                self.log.error(f"Client: [{self.address}] An error occurred processing data: {e}")
+
+    def close(self):
+        with self.cond:
+            if (not self.running):
+                return
+            self.running = False
+            self.queue.clear()
+            self.queuedBytes = 0
+            self.cond.notify_all()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.server.removeClient(self)
+
+
+class FanoutServer():
+    """Streams the same data to any number of local TCP (host, port) or Unix socket (path) clients."""
+
+    log: logging.Logger
+
+    address: tuple[str, int] | str
+    maxQueueBytes: int
+    server_socket: socket.socket | None
+    clients: list[FanoutClient]
+    clientsLock: threading.Lock
+
+    serverHandlerRunning: bool
+    serverHandlerThread: threading.Thread
+
+    def __init__(self, address: tuple[str, int] | str, maxQueueBytes: int = DEFAULT_MAX_QUEUE_BYTES):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.address = address
+        self.maxQueueBytes = maxQueueBytes
+        self.server_socket = None
+        self.clients = []
+        self.clientsLock = threading.Lock()
+        self.serverHandlerRunning = False
+
+    def bind(self):
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(self.address)
+        sock.listen(16)
+        sock.settimeout(0.5)
+        self.server_socket = sock
+
+    # Hooks for subclasses
+    def onClientConnected(self, client: FanoutClient):
+        pass
+
+    def onClientData(self, client: FanoutClient, data: bytes):
+        pass
+
+    def onClientDisconnected(self, client: FanoutClient):
+        pass
+
+    def serverHandler(self):
+        while self.serverHandlerRunning:
+            try:
+                conn, address = self.server_socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            if (conn.family != socket.AF_UNIX):
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = FanoutClient(self, conn, address or self.address, self.maxQueueBytes)
+            self.log.info(f"Connection from: {client.address}")
+            # The hook runs before the client is added, so anything it queues (ie a protocol header) is ahead of broadcasts
+            self.onClientConnected(client)
+            with self.clientsLock:
+                self.clients.append(client)
+            client.start()
+
+    def removeClient(self, client: FanoutClient):
+        with self.clientsLock:
+            if client not in self.clients:
+                return
+            self.clients.remove(client)
+        self.log.info(f"Removed Client: {client.address}  Sent: [{client.sent}] bytes  Dropped: [{client.dropped}] chunks")
+        self.onClientDisconnected(client)
+
+    def broadcast(self, data) -> int:
+        # Queue data (bytes or any buffer, shared between clients - not copied) for every client.
+        with self.clientsLock:
+            clients = list(self.clients)
+        for client in clients:
+            client.enqueue(data)
+        return len(clients)
+
+    def start(self):
+        self.bind()
+        self.serverHandlerRunning = True
+        self.serverHandlerThread = threading.Thread(target=self.serverHandler, daemon=True)
+        self.serverHandlerThread.start()
+
+    def stop(self):
+        self.serverHandlerRunning = False
+        if (self.server_socket):
+            self.serverHandlerThread.join(2)
+            self.server_socket.close()
+            self.server_socket = None
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.unlink(self.address)
+
+        with self.clientsLock:
+            clients = list(self.clients)
+        for client in clients:
+            client.close()
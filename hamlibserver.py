@@ -4,41 +4,104 @@
 # See http://www.opensource.org.
 # Note that there is NO WARRANTY AT ALL.  USE AT YOUR OWN RISK!!
 
+import argparse
+import dataclasses
 import logging
+import math
+import mcastsock
+import metrics
 import signal
 import socket
+import statusrate
 import string
 import sys
 import threading
 import time
+import tracing
 
+from concurrent.futures import ThreadPoolExecutor
+
+from bandhop import Ka9qBandHopScheduler, HopEntry, DEFAULT_LEAD, WSPR_SLOT_SECONDS, parseRotation, parseSlot
+from channelpool import Ka9qChannelPool, DEFAULT_POOL_SIZE, parsePoolSpec, unparkValues
 from enum import Enum
 from listener import Ka9qRadioStatusListener
 from control import Ka9qRadioControl
 from status  import StatusType
-from typing import Any
+from statusrate import Ka9qStatusRateManager, DEFAULT_IDLE_AFTER, DEFAULT_IDLE_INTERVAL
+from typing import Any, Callable
 
 DEFAULT_HAMLIB_HOST = 'localhost'
 DEFAULT_HAMLIB_PORT = 4575
 
 DEFAULT_SSRC_ID = 9999991
 DEFAULT_MODE = 'usb'
+STATUS_POLL_INTERVAL = 1.0      # Minimum seconds between polls for a channel with no cached status
+
+RIGCTLD_COMMANDS = metrics.Counter('ka9q_rigctld_commands_total', 'rigctld commands processed', ('command',))
+RIGCTLD_COMMAND_SECONDS = metrics.Histogram('ka9q_rigctld_command_seconds', 'rigctld command handling time', ('command',))
+RIGCTLD_CLIENTS = metrics.Gauge('ka9q_rigctld_clients', 'Connected rigctld clients')
+RIGCTLD_PUSHES = metrics.Counter('ka9q_rigctld_pushes_total', 'Transceive updates pushed to subscribed clients', ('kind',))
+
+# Transceive (push) updates sent to clients that have subscribed with "A ON" / "\set_trn ON":
+#   TRN freq <hz>
+#   TRN mode <mode> <passband>
+TRN_ON_VALUES = ('ON', 'RIG', '1')
+
+# Levels (get_level / set_level), answered from the latest status packet so meter polling never
+# generates network traffic. Bits are Hamlib's RIG_LEVEL_* values, advertised in dump_state.
+RIG_LEVEL_PREAMP = 1 << 0       # RF_GAIN (dB)
+RIG_LEVEL_ATT = 1 << 1          # RF_ATTEN (dB)
+RIG_LEVEL_AF = 1 << 3           # GAIN, 0.0 - 1.0 over 0 - AF_MAX_DB
+RIG_LEVEL_SQL = 1 << 5          # SQUELCH_OPEN, 0.0 - 1.0 over 0 - SQL_MAX_DB SNR
+RIG_LEVEL_AGC = 1 << 17         # AGC_ENABLE, 0 (off) or 6 (auto)
+RIG_LEVEL_RAWSTR = 1 << 26      # SNR (dB) from BASEBAND_POWER and NOISE_DENSITY over the filter bandwidth
+RIG_LEVEL_STRENGTH = 1 << 30    # BASEBAND_POWER (dBFS) + RF_LEVEL_CAL (dBm) relative to S9
+
+LEVELS = {
+    'PREAMP': RIG_LEVEL_PREAMP,
+    'ATT': RIG_LEVEL_ATT,
+    'AF': RIG_LEVEL_AF,
+    'SQL': RIG_LEVEL_SQL,
+    'AGC': RIG_LEVEL_AGC,
+    'RAWSTR': RIG_LEVEL_RAWSTR,
+    'STRENGTH': RIG_LEVEL_STRENGTH,
+}
+SET_LEVELS = ('PREAMP', 'ATT', 'AF', 'SQL', 'AGC')
+INT_LEVELS = ('PREAMP', 'ATT', 'AGC', 'RAWSTR', 'STRENGTH')
+
+S9_DBM = -73.0
+AF_MAX_DB = 100.0
+SQL_MAX_DB = 40.0
+SQL_HYSTERESIS_DB = 1.0         # Squelch closes this far below its opening threshold
+RIG_AGC_OFF = 0
+RIG_AGC_AUTO = 6
+
+# With a second SSRC (VFO B) each VFO is its own channel, switching VFO switches channel rather than retuning
+RIG_VFO_A = 1 << 0
+RIG_VFO_B = 1 << 1
+VFO_A = 'VFOA'
+VFO_B = 'VFOB'
+VFO_CURR = 'currVFO'
+
+VfoCallback = Callable[[str, int], None]      # (VFO name, SSRC) on switching VFO
 
 # This module creates a Hamlib TCP server that implements the rigctl protocol.  To start the server,
 # run "python hamlibserver.py" from a command line.  To exit the server, type control-C.  Connect a
 # client to the server using localhost and port 4575.  The TCP server will imitate a software defined
 # radio, and you can get and set the frequency, etc.
 
-# Only the commands dump_state, freq, mode, ptt and vfo are implemented.
+# Implemented: dump_state, chk_vfo, freq, mode, vfo, ptt, powerstat, lock_mode, trn (transceive pushes),
+# level (see LEVELS) and split (split_vfo, split_freq, split_mode).
 # This is not a real hardware server.  It is meant as sample code to show how to implement the protocol
 # in SDR control software.  You can test it with "rigctl -m 2 -r localhost:4575".
 
 # See "http://james.ahlstrom.name/hamlibserver.py" for further explanation of this
-# "dump_state"
-dump = """ 0
+# "dump_state", %s is the rx range's VFO mask. The lines after the announces list the PREAMP and ATT
+# steps (dB) offered to clients, set_level sends any value to radiod as RF_GAIN / RF_ATTEN.
+DUMP_STATE = """ 0
 2
 0
-50000.000000 30000000.000000 0x4 -1 -1 0x1 0x0
+50000.000000 30000000.000000 0x4 -1 -1 %s 0x0
 0 0 0 0 0 0 0
 0 0 0 0 0 0 0
 0x4 1
@@ -48,15 +111,16 @@ dump = """ 0
 0
 0
 0
-
-
-0x0
-0x0
+10 20 30
+6 12 18 24 30
 0x0
 0x0
+0x4402002b
+0x2002b
 0x0
 0x0
 """
+dump = DUMP_STATE % hex(RIG_VFO_A)
 
 
 class RigLockMode(Enum):
@@ -67,6 +131,16 @@ class RigLockMode(Enum):
     RIG_LOCK_MODE_MEM = 8     # Memory channels locked
     RIG_LOCK_MODE_PANEL = 16  # Front panel controls locked
 
+@dataclasses.dataclass
+class Vfo:
+    name: str
+    ssrc: int
+    freq: float
+    mode: str
+    bandwidth: int
+    active: int | None = None       # Pooled channel feeding this VFO, None - its own SSRC
+
+
 class HamlibHandler:
 
     log: logging.Logger
@@ -77,6 +151,11 @@ class HamlibHandler:
         'm': 'mode',
         't': 'ptt',
         'v': 'vfo',
+        'a': 'trn',
+        'l': 'level',
+        's': 'split_vfo',
+        'i': 'split_freq',
+        'x': 'split_mode',
     }
 
     def __init__(self, app, sock, address):
@@ -87,6 +166,8 @@ class HamlibHandler:
         sock.settimeout(0.0)
         self.address = address
         self.received = ''
+        self.sendLock = threading.Lock()    # Replies (server thread) and pushes (listener thread) share the socket
+        self.transceive = False
         h = self.Handlers = {}
         h[''] = self.ErrProtocol
         h['dump_state'] = self.DumpState
@@ -102,24 +183,43 @@ class HamlibHandler:
 
         h['chk_vfo'] = self.ChkVfo
         h['get_powerstat'] = self.GetPowerStatus
+        h['get_trn'] = self.GetTrn
+        h['set_trn'] = self.SetTrn
+        h['get_level'] = self.GetLevel
+        h['set_level'] = self.SetLevel
+        h['get_split_vfo'] = self.GetSplitVfo
+        h['set_split_vfo'] = self.SetSplitVfo
+        h['get_split_freq'] = self.GetSplitFreq
+        h['set_split_freq'] = self.SetSplitFreq
+        h['get_split_mode'] = self.GetSplitMode
+        h['set_split_mode'] = self.SetSplitMode
 
     def close(self):
-        if (self.sock):
-            try:
-                self.sock.close()
-            finally:
-                self.sock = None
+        with self.sendLock:
+            if (self.sock):
+                try:
+                    self.sock.close()
+                finally:
+                    self.sock = None
 
 
     def Send(self, text):
         """Send text back to the client. Convert string to bytes"""
+        enc_txt = text.encode()
+        self.log.debug("Send(): [%s]", enc_txt)
         try:
-            enc_txt = text.encode()
-            self.log.debug(f'Send(): [{enc_txt}]')
-            self.sock.sendall(enc_txt)
+            with self.sendLock:
+                if (not self.sock):
+                    return
+                self.sock.sendall(enc_txt)
         except socket.error:
             self.close()
 
+    def Push(self, text):
+        """Send an unsolicited transceive update, if this client has subscribed."""
+        if (self.transceive):
+            self.Send(text)
+
     def Reply(self, *args):  # args is name, value, name, value, ..., int
         """Create a string reply of name, value pairs, and an ending integer code."""
         if len(args) > 1:		# Use simple format
@@ -140,6 +240,7 @@ class HamlibHandler:
     def ErrProtocol(self):  # Protocol error
         self.Reply(-8)
 
+    @tracing.traced('rigctld.process')
     def Process(self):
         """This is the main processing loop, and is called frequently.  It reads and satisfies requests."""
         if not self.sock:
@@ -161,13 +262,12 @@ class HamlibHandler:
         # print('Get', cmd)
         if not cmd:			# ??? Indicates a closed connection?
             self.log.warning('empty command')
-            self.sock.close()
-            self.sock = None
+            self.close()
             return 0
         if cmd[0:1] == '\\':		# long form command starting with backslash
             args = cmd[1:].split()
             self.cmd = args[0]
-            self.params = args[1:]
+            self.params = ' '.join(args[1:])
             self.processCommand()
         else:						# single-letter command
             self.params = cmd[1:].strip()
@@ -186,14 +286,24 @@ class HamlibHandler:
                 self.processCommand()
         return 1
 
+    @tracing.traced('rigctld.command')
     def processCommand(self):
-        self.log.debug(f"CMD: [{self.cmd}] Params: [{self.params}]")
-        self.Handlers.get(self.cmd, self.UnImplemented)()
+        self.log.debug("CMD: [%s] Params: [%s]", self.cmd, self.params)
+        if (self.app.statusRate):
+            self.app.statusRate.touch(self.app.ssrc)
+        if (metrics.enabled):
+            t0 = time.perf_counter()
+            self.Handlers.get(self.cmd, self.UnImplemented)()
+            cmd = self.cmd if self.cmd in self.Handlers else 'unknown'
+            RIGCTLD_COMMANDS.labels(cmd).inc()
+            RIGCTLD_COMMAND_SECONDS.labels(cmd).observe(time.perf_counter() - t0)
+        else:
+            self.Handlers.get(self.cmd, self.UnImplemented)()
 
     # These are the handlers for each request
 
     def DumpState(self):
-        self.Send(dump)
+        self.Send(self.app.dumpState())
 
     def GetFreq(self):
         self.Reply('Frequency', self.app.getFreq(), 0)
@@ -232,13 +342,68 @@ class HamlibHandler:
         self.Reply('VFO', self.app.vfo, 0)
 
     def SetVfo(self):
+        x = self.params.strip()
+        if (not self.app.isVfo(x)):
+            self.ErrParam()
+            return
+        self.Reply(0)
+        self.app.setVfo(x)
+
+    def GetSplitVfo(self):
+        self.Reply('Split', self.app.split, 'TX VFO', self.app.txVfo, 0)
+
+    def SetSplitVfo(self):
         try:
-            x = self.params
+            split, vfo = self.params.split()
+            split = int(split)
+        except:
+            self.ErrParam()
+            return
+        if (not self.app.vfos):
+            self.Reply(-11)     # Needs a second SSRC
+        elif (vfo not in self.app.vfos) and (vfo != VFO_CURR):
+            self.ErrParam()
+        else:
+            self.Reply(0)
+            self.app.setSplitVfo(split, vfo)
+
+    def GetSplitFreq(self):
+        if (not self.app.vfos):
+            self.Reply(-11)
+            return
+        self.Reply('TX Frequency', self.app.getSplitFreq(), 0)
+
+    def SetSplitFreq(self):
+        if (not self.app.vfos):
+            self.Reply(-11)
+            return
+        try:
+            x = float(self.params)
             self.Reply(0)
         except:
             self.ErrParam()
         else:
-            self.app.vfo = x
+            self.app.setSplitFreq(x)
+
+    def GetSplitMode(self):
+        if (not self.app.vfos):
+            self.Reply(-11)
+            return
+        tx = self.app.getSplitVfo()
+        self.Reply('TX Mode', tx.mode.upper(), 'TX Passband', tx.bandwidth, 0)
+
+    def SetSplitMode(self):
+        if (not self.app.vfos):
+            self.Reply(-11)
+            return
+        try:
+            mode, bw = self.params.split()
+            bw = int(float(bw) + 0.5)
+            self.Reply(0)
+        except:
+            self.ErrParam()
+        else:
+            self.app.setSplitMode(mode, bw)
 
     def GetPtt(self):
         self.Reply('PTT', self.app.ptt, 0)
@@ -255,6 +420,56 @@ class HamlibHandler:
             else:
                 self.app.ptt = 0
 
+    def GetTrn(self):
+        self.Reply('Transceive', 'ON' if self.transceive else 'OFF', 0)
+
+    def SetTrn(self):
+        x = self.params.strip().upper()
+        if (x not in TRN_ON_VALUES) and (x not in ('OFF', '0')):
+            self.ErrParam()
+            return
+        self.transceive = (x in TRN_ON_VALUES)
+        self.Reply(0)
+        if (self.transceive):
+            # Start the subscriber off with the current state
+            self.app.pushState(self)
+
+    def GetLevel(self):
+        level = self.params.strip().upper()
+        if (level not in LEVELS):
+            self.ErrParam()
+            return
+        x = self.app.getLevel(level)
+        if (x is None):
+            self.Reply(-11)     # Not available (yet), ie no status received
+        elif (level in INT_LEVELS):
+            self.Reply('Level', int(x), 0)
+        else:
+            self.Reply('Level', f"{x:.6f}", 0)
+
+    def SetLevel(self):
+        try:
+            level, x = self.params.split()
+            level = level.upper()
+            x = float(x)
+        except:
+            self.ErrParam()
+            return
+        if (level not in SET_LEVELS):
+            self.ErrParam()
+            return
+        try:
+            self.app.setLevel(level, x)
+        except OSError as e:
+            self.log.error(f"SetLevel: [{level}] [{x}] Control send failed: {e}")
+            self.Reply(-6)      # RIG_EIO
+            return
+        except Exception as e:
+            self.log.warning(f"SetLevel: [{level}] [{x}] {e}")
+            self.ErrParam()
+            return
+        self.Reply(0)
+
     def GetLockMode(self):
         self.Reply(self.app.lockModeState)
         # self.Reply('lock mode', self.app.lockModeState, 0)
@@ -263,28 +478,50 @@ class HamlibServer:
 
     log: logging.Logger
 
-    ssrc: int 
+    ssrc: int                         # Channel feeding the rig (active VFO's own, or a pooled one)
+    homeSsrc: int                     # Active VFO's own channel, the one retuned
     ka9q_rc: Ka9qRadioControl
     ka9q_rs: Ka9qRadioStatusListener
+    channelPool: Ka9qChannelPool | None
+    hopScheduler: Ka9qBandHopScheduler | None
+    statusRate: Ka9qStatusRateManager | None    # Raises the channel's STATUS_INTERVAL while clients are polling it
+    levelAverage: float                         # Seconds STRENGTH / RAWSTR are averaged over, 0 the latest status
     
     host: str
     port: int
     hamlib_clients: list[HamlibHandler]
-    hamlib_socket: socket.socket
+    hamlib_socket: socket.socket | None
     serverHandlerRunning: bool
+    serverReady: threading.Event     # Set once rigctld is accepting connections
 
     # Radio State/Value
     freq: float
     mode: str
     bandwidth: int
     vfo: str          # Active VFO
+    vfos: dict[str, Vfo]              # VFO A / B channels, empty with a single SSRC
+    vfoCallbacks: list[VfoCallback]
+    split: int
+    txVfo: str
     ptt: int
     enableVfoMode: int
     powerStatus: int
     lockModeState: int
 
+    lastStatusPoll: float            # When the channel was last polled for missing status (monotonic)
+
+    # Last values pushed to transceive subscribers
+    pushedFreq: float | None
+    pushedMode: str | None
+
     def __init__(self, mcast_group:str, ssrc: int, freq_hz:int, mode:str, 
-                 host:str=DEFAULT_HAMLIB_HOST, port:int=DEFAULT_HAMLIB_PORT):
+                 host:str=DEFAULT_HAMLIB_HOST, port:int=DEFAULT_HAMLIB_PORT,
+                 ssrc_b:int|None=None, freq_b_hz:int|None=None,
+                 pool:list[tuple[int, str]]|None=None, pool_size:int=DEFAULT_POOL_SIZE, pool_ssrc:int|None=None,
+                 hop:list[HopEntry]|None=None, hop_slot:float=WSPR_SLOT_SECONDS, hop_lead:float=DEFAULT_LEAD,
+                 status_active:int|None=None, status_idle:int=DEFAULT_IDLE_INTERVAL, status_idle_after:float=DEFAULT_IDLE_AFTER,
+                 iface:str|None=None, source:str|None=None, history:str|None=None, level_average:float=0.0,
+                 status_api:str|None=None):
         self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
 
         self.host = host
@@ -292,12 +529,19 @@ class HamlibServer:
 
         self.registerSignalHandlers()
         self.serverHandlerRunning = False
+        self.serverReady = threading.Event()
+        self.hamlib_socket = None
 
         self.ssrc = ssrc
-        self.ka9q_rc = Ka9qRadioControl(mcast_group)
-        self.ka9q_rs = Ka9qRadioStatusListener(mcast_group, [ssrc])
-        self.ka9q_rs.startHandler()
-        self.log.info("KA9Q Radio Controller & Status Listener processes started.")
+        self.homeSsrc = ssrc
+        self.channelPool = None
+        self.hopScheduler = None
+        self.statusRate = None
+        self.levelAverage = level_average
+        self.hamlib_clients = []
+        self.pushedFreq = None
+        self.pushedMode = None
+        self.lastStatusPoll = 0.0
 
         # This is the init state of the "hardware", but should be quickly updated by by
         # direct values read from radio.
@@ -305,13 +549,75 @@ class HamlibServer:
         self.mode = mode
         self.bandwidth = 2400
         self.vfo = "VFO"
+        self.vfos = {}
+        self.vfoCallbacks = []
+        self.split = 0
+        self.txVfo = VFO_A
         self.ptt = 0
         self.enableVfoMode = 0
         self.powerStatus = 1    # TODO: always on for now, but possible monitor MCAST for data
         self.lockModeState = RigLockMode.RIG_LOCK_MODE_OFF.value
+
+        ssrcs = [ssrc]
+        if (ssrc_b is not None):
+            # Both channels exist up front so switching VFO never waits on radiod
+            self.vfo = VFO_A
+            self.txVfo = VFO_B
+            self.vfos[VFO_A] = Vfo(VFO_A, ssrc, freq_hz, mode, self.bandwidth)
+            self.vfos[VFO_B] = Vfo(VFO_B, ssrc_b, freq_b_hz or freq_hz, mode, self.bandwidth)
+            ssrcs.append(ssrc_b)
+
+        # Resolving the group (mDNS) is the slow part of startup, the control and status sockets are set up
+        # together (resolver.py resolves the name once for both) while rigctld's port is bound, so a port
+        # already in use fails before anything is sent to radiod.
+        with ThreadPoolExecutor(max_workers=2) as setup:
+            rc = setup.submit(Ka9qRadioControl, mcast_group, iface)
+            rs = setup.submit(Ka9qRadioStatusListener, mcast_group, ssrcs, iface=iface, source=source)
+            self.bind()
+            self.ka9q_rc = rc.result()
+            self.ka9q_rs = rs.result()
+        if (pool):
+            self.channelPool = Ka9qChannelPool(self.ka9q_rc, pool_ssrc if pool_ssrc is not None else ssrc + 1, self.ka9q_rs,
+                                               pool_size, reserved=ssrcs)
+            self.channelPool.preload(pool)
+        self.ka9q_rs.addStatusCallback(self.ka9q_rc.onStatus)
+        self.ka9q_rs.addStatusCallback(self.onStatus)
+        if (history):
+            self.ka9q_rs.startRecording(history)
+        if (level_average > 0):
+            self.ka9q_rs.startSeries()
+        if (status_api):
+            from statusdiff import parseAddress
+            self.ka9q_rs.startDiffServer(parseAddress(status_api))
+        if (status_active):
+            self.statusRate = Ka9qStatusRateManager(self.ka9q_rc, self.ka9q_rs, status_active, status_idle, status_idle_after)
+            self.statusRate.start()
+        self.ka9q_rs.startHandler()
+        self.log.info("KA9Q Radio Controller & Status Listener processes started.")
+
         
         # update the VFO with the specified initial Freq and Mode
         self.ka9q_rc.control_set_frequency(self.freq, self.mode, self.ssrc)
+        if (VFO_B in self.vfos):
+            b = self.vfos[VFO_B]
+            self.ka9q_rc.control_set_frequency(b.freq, b.mode, b.ssrc)
+
+        if (hop):
+            # The schedule drives VFO A's channel, rig state follows each confirmed retune
+            self.hopScheduler = Ka9qBandHopScheduler(self.ka9q_rc, self.ka9q_rs, ssrc, hop, hop_slot, hop_lead)
+            self.hopScheduler.addHopCallback(self.onHop)
+            self.hopScheduler.start()
+
+    def recreateChannels(self):
+        # radiod restarted (ie seen by discover.py), its dynamic channels are gone: create ours again as they were
+        self.ka9q_rc.control_set_frequency(self.freq, self.mode, self.homeSsrc)
+        for vfo in self.vfos.values():
+            if (vfo.name != self.vfo):
+                self.ka9q_rc.control_set_frequency(vfo.freq, vfo.mode, vfo.ssrc)
+        if (self.channelPool):
+            self.channelPool.recreate()
+            if (self.ssrc != self.homeSsrc):
+                self.channelPool.park(self.homeSsrc)
 
     def registerSignalHandlers(self):
         signal.signal(signal.SIGINT, self.handle_signal)
@@ -331,43 +637,280 @@ class HamlibServer:
         
         return None
 
+    def pollStatus(self) -> dict[StatusType, Any] | None:
+        # Cached status. If none has been seen yet (ie missed / channel just created) radiod is polled without
+        # waiting, the listener caches the reply for the next command and this one answers with the last known
+        # value. Never blocks the rigctld loop, and at most one poll per STATUS_POLL_INTERVAL while radiod is down.
+        s = self.getStatus()
+        if (s is None):
+            now = time.monotonic()
+            if (now - self.lastStatusPoll >= STATUS_POLL_INTERVAL):
+                self.lastStatusPoll = now
+                self.ka9q_rc.control_poll(self.ssrc)
+        return s
+
     def getFreq(self) -> float:
         # TODO: Do we move this to be updated using Events ?
-        # TODO: Need to handle if SSRC not available 
-        self.freq = self.ka9q_rs.status[self.ssrc][StatusType.RADIO_FREQUENCY]
-        self.log.debug(f"GetFreq(): [{self.freq}]")
+        s = self.pollStatus()
+        if (s) and (StatusType.RADIO_FREQUENCY in s):
+            self.freq = s[StatusType.RADIO_FREQUENCY]
+        self.log.debug("GetFreq(): [%s]", self.freq)
         return self.freq
 
     def setFreq(self, x: float):
         self.freq = x
 
-        self.ka9q_rc.control_set_frequency(self.freq, self.mode, self.ssrc)
-        self.log.debug(f"SetFreq: [{x}]")
+        self.tune()
+        self.log.debug("SetFreq: [%s]", x)
 
     def getMode(self) -> str:
         # TODO: Do we move this to be updated using Events ?
-        # TODO: Need to handle if SSRC not available 
-        self.mode = self.ka9q_rs.status[self.ssrc][StatusType.PRESET].upper()
-        self.log.debug(f"GetMode(): [{self.mode}]")
+        s = self.pollStatus()
+        if (s) and (StatusType.PRESET in s):
+            self.mode = s[StatusType.PRESET].upper()
+        self.log.debug("GetMode(): [%s]", self.mode)
         return self.mode
 
     def setMode(self, mode:str, bw: int):
         self.mode = mode
         self.bandwidth = bw
 
-        self.ka9q_rc.control_set_frequency(self.freq, self.mode, self.ssrc)
-        self.log.debug(f"SetMode: [{self.mode}]  Bw: [{self.bandwidth}]")
+        self.tune()
+        self.log.debug("SetMode: [%s]  Bw: [%s]", self.mode, self.bandwidth)
+
+    def tune(self):
+        # Applies freq / mode to the active VFO. A pooled channel already there takes over feeding the rig
+        # (no retune in radiod), otherwise the VFO's own channel is retuned.
+        pool = self.channelPool
+        if (pool is None):
+            self.ka9q_rc.control_set_frequency(self.freq, self.mode, self.ssrc)
+            return
+        if (pool.matches(self.ssrc, self.freq, self.mode)):
+            return
+
+        unpark = unparkValues(self.getStatus())
+        ch = pool.acquire(self.freq, self.mode, unpark)
+        if (ch is not None):
+            self.switchChannel(ch.ssrc)
+            return
+
+        self.ka9q_rc.control_set_frequency(self.freq, self.mode, self.homeSsrc)
+        if (self.ssrc != self.homeSsrc):
+            pool.unpark(self.homeSsrc, unpark)
+            self.switchChannel(self.homeSsrc)
+
+    def switchChannel(self, ssrc: int):
+        # Another channel feeds the rig, the one left is parked (returned to the pool if it came from there)
+        old = self.ssrc
+        self.ssrc = ssrc
+        self.log.info(f"SSRC: [{old}] -> [{ssrc}]  Freq: [{self.freq}]  Mode: [{self.mode}]")
+        self.notifyVfo()
+        if (self.channelPool.isPooled(old)):
+            self.channelPool.release(old)
+        else:
+            self.channelPool.park(old)
+
+    def dumpState(self) -> str:
+        return DUMP_STATE % hex(RIG_VFO_A | RIG_VFO_B) if self.vfos else dump
+
+    def addVfoCallback(self, cb: VfoCallback):
+        self.vfoCallbacks.append(cb)
+
+    def removeVfoCallback(self, cb: VfoCallback):
+        if cb in self.vfoCallbacks:
+            self.vfoCallbacks.remove(cb)
+
+    def isVfo(self, name: str) -> bool:
+        return (not self.vfos) or (name in self.vfos) or (name == VFO_CURR)
+
+    def setVfo(self, name: str):
+        if (not self.vfos):
+            self.vfo = name     # Single channel, the VFO is only remembered
+            return
+        if (name == VFO_CURR) or (name == self.vfo):
+            return
+
+        # Park the active VFO's state, then make the other channel active: no retune, only the audio follows
+        cur = self.vfos[self.vfo]
+        cur.freq, cur.mode, cur.bandwidth = self.freq, self.mode, self.bandwidth
+        cur.active = self.ssrc if (self.ssrc != cur.ssrc) else None
+        new = self.vfos[name]
+        ssrc = new.active or new.ssrc
+        s = self.ka9q_rs.status.get(ssrc)
+        if (s):
+            new.freq = s.get(StatusType.RADIO_FREQUENCY, new.freq)
+            new.mode = s.get(StatusType.PRESET, new.mode)
+
+        self.vfo = name
+        self.ssrc, self.homeSsrc = ssrc, new.ssrc
+        self.freq, self.mode, self.bandwidth = new.freq, new.mode, new.bandwidth
+        self.log.info(f"VFO: [{name}]  SSRC: [{ssrc}]  Freq: [{new.freq}]  Mode: [{new.mode}]")
+        self.notifyVfo()
+
+    def notifyVfo(self):
+        for cb in list(self.vfoCallbacks):
+            try:
+                cb(self.vfo, self.ssrc)
+            except Exception as e:
+                self.log.error(f"VFO: [{self.vfo}] An error occurred in a VFO callback: {e}")
+
+    def leavePool(self, vfo: Vfo):
+        # An inactive VFO on a pooled channel goes back to its own, so that can be retuned
+        if (vfo.active is not None):
+            self.channelPool.release(vfo.active)
+            self.channelPool.unpark(vfo.ssrc, unparkValues(self.ka9q_rs.status.get(vfo.active)))
+            vfo.active = None
+
+    def setSplitVfo(self, split: int, vfo: str):
+        self.split = 1 if split else 0
+        if (vfo != VFO_CURR):
+            self.txVfo = vfo
+
+    def getSplitVfo(self) -> Vfo:
+        tx = self.vfos[self.txVfo]
+        if (tx.name == self.vfo):
+            tx.freq, tx.mode, tx.bandwidth = self.freq, self.mode, self.bandwidth
+        return tx
+
+    def getSplitFreq(self) -> float:
+        tx = self.getSplitVfo()
+        s = self.ka9q_rs.status.get(tx.active or tx.ssrc)
+        if (s) and (StatusType.RADIO_FREQUENCY in s):
+            tx.freq = s[StatusType.RADIO_FREQUENCY]
+        return tx.freq
+
+    def setSplitFreq(self, x: float):
+        tx = self.getSplitVfo()
+        if (tx.name == self.vfo):
+            self.setFreq(x)
+            return
+        self.leavePool(tx)
+        tx.freq = x
+        self.ka9q_rc.control_set_frequency(tx.freq, tx.mode, tx.ssrc)
+        self.log.debug("SetSplitFreq: [%s] [%s]", tx.name, x)
+
+    def setSplitMode(self, mode: str, bw: int):
+        tx = self.getSplitVfo()
+        if (tx.name == self.vfo):
+            self.setMode(mode, bw)
+            return
+        self.leavePool(tx)
+        tx.mode = mode
+        tx.bandwidth = bw
+        self.ka9q_rc.control_set_frequency(tx.freq, tx.mode, tx.ssrc)
+        self.log.debug("SetSplitMode: [%s] [%s]  Bw: [%s]", tx.name, mode, bw)
+
+    def getLevel(self, level: str) -> float | None:
+        # Straight from the latest status packet, never queries radiod
+        s = self.getStatus()
+        if (s is None):
+            return None
+        match (level):
+            case 'STRENGTH':
+                # BASEBAND_POWER is dBFS, radiod's RF_LEVEL_CAL relates it to dBm at the antenna
+                p = self.levelValue(s, StatusType.BASEBAND_POWER)
+                return None if p is None else round(p + s.get(StatusType.RF_LEVEL_CAL, 0.0) - S9_DBM)
+            case 'RAWSTR':
+                p = self.levelValue(s, StatusType.BASEBAND_POWER)
+                n0 = self.levelValue(s, StatusType.NOISE_DENSITY)
+                if (p is None) or (n0 is None):
+                    return None
+                bw = abs(s.get(StatusType.HIGH_EDGE, 0.0) - s.get(StatusType.LOW_EDGE, 0.0)) or self.bandwidth
+                return min(255, max(0, round(p - (n0 + 10.0 * math.log10(bw)))))
+            case 'SQL':
+                x = s.get(StatusType.SQUELCH_OPEN)
+                return None if x is None else min(1.0, max(0.0, x / SQL_MAX_DB))
+            case 'AF':
+                x = s.get(StatusType.GAIN)
+                return None if x is None else min(1.0, max(0.0, x / AF_MAX_DB))
+            case 'AGC':
+                x = s.get(StatusType.AGC_ENABLE)
+                return None if x is None else (RIG_AGC_AUTO if x else RIG_AGC_OFF)
+            case 'PREAMP':
+                x = s.get(StatusType.RF_GAIN)
+                return None if x is None else round(x)
+            case 'ATT':
+                x = s.get(StatusType.RF_ATTEN)
+                return None if x is None else round(x)     # As set, see setLevel
+        return None
+
+    def levelValue(self, s: dict[StatusType, Any], field: StatusType) -> float | None:
+        # Mean (dB) over the last levelAverage seconds when averaging, else the latest status packet's
+        if (self.levelAverage > 0) and (self.ka9q_rs.series is not None):
+            x = self.ka9q_rs.series.mean(self.ssrc, field, self.levelAverage)
+            if (x is not None):
+                return x
+        return s.get(field)
+
+    def setLevel(self, level: str, x: float):
+        match (level):
+            case 'AF':
+                values = {StatusType.GAIN: x * AF_MAX_DB}
+            case 'SQL':
+                sq = x * SQL_MAX_DB
+                values = {StatusType.SQUELCH_OPEN: sq, StatusType.SQUELCH_CLOSE: max(0.0, sq - SQL_HYSTERESIS_DB)}
+            case 'AGC':
+                values = {StatusType.AGC_ENABLE: int(x) != RIG_AGC_OFF}
+            case 'PREAMP':
+                values = {StatusType.RF_GAIN: x}
+            case 'ATT':
+                values = {StatusType.RF_ATTEN: x}
+            case _:
+                raise Exception(f"Level: [{level}] can not be set.")
+        self.ka9q_rc.control_set(self.ssrc, values)
+        self.log.debug("SetLevel: [%s] [%s]", level, x)
+
+    def onHop(self, e: HopEntry):
+        # Listener thread: the band hop scheduler retuned its channel
+        if (self.homeSsrc != self.hopScheduler.ssrc):
+            vfo = self.vfos[VFO_A]
+            self.leavePool(vfo)
+            vfo.freq, vfo.mode = e.freq, e.mode
+            return
+        self.freq, self.mode = e.freq, e.mode
+        if (self.ssrc != self.homeSsrc):
+            self.channelPool.unpark(self.homeSsrc, unparkValues(self.getStatus()))
+            self.switchChannel(self.homeSsrc)
+
+    def onStatus(self, ssrc: int, stat: dict[StatusType, Any]):
+        # Listener thread: push freq / mode changes to subscribed clients, unchanged values produce no traffic
+        if (ssrc != self.ssrc):
+            return
+        freq = stat.get(StatusType.RADIO_FREQUENCY)
+        mode = stat.get(StatusType.PRESET)
+        mode = mode.upper() if mode else None
+
+        if (freq is not None) and (freq != self.pushedFreq):
+            self.pushedFreq = freq
+            self.push('freq', f"TRN freq {freq:.0f}\n")
+        if (mode is not None) and (mode != self.pushedMode):
+            self.pushedMode = mode
+            self.push('mode', f"TRN mode {mode} {self.bandwidth}\n")
+
+    def push(self, kind: str, text: str):
+        for client in list(self.hamlib_clients):
+            if (client.transceive):
+                client.Push(text)
+                if (metrics.enabled):
+                    RIGCTLD_PUSHES.labels(kind).inc()
+
+    def pushState(self, client: HamlibHandler):
+        if (self.pushedFreq is not None):
+            client.Push(f"TRN freq {self.pushedFreq:.0f}\n")
+        if (self.pushedMode is not None):
+            client.Push(f"TRN mode {self.pushedMode} {self.bandwidth}\n")
 
     def bind(self):
-        self.hamlib_clients = []
         self.hamlib_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.hamlib_socket.bind((self.host, self.port))
         self.hamlib_socket.settimeout(0.0)
         self.hamlib_socket.listen(0)
         
     def listen(self):
-        self.bind()
+        if (self.hamlib_socket is None):
+            self.bind()
         self.serverHandlerRunning = True
+        self.serverReady.set()
         try:
             while self.serverHandlerRunning:
                 time.sleep(0.1)
@@ -378,11 +921,15 @@ class HamlibServer:
                 else:
                     self.log.info(f"Connection from: {address}")
                     self.hamlib_clients.append(HamlibHandler(self, conn, address))
+                    if (metrics.enabled):
+                        RIGCTLD_CLIENTS.set(len(self.hamlib_clients))
                 for client in self.hamlib_clients:
                     ret = client.Process()
                     if not ret:		# False return indicates a closed connection; remove the server
                         self.hamlib_clients.remove(client)
                         self.log.info(f"Removed Client: {client.address}")
+                        if (metrics.enabled):
+                            RIGCTLD_CLIENTS.set(len(self.hamlib_clients))
                         break
         finally:
             self.log.info("Closing client connections and exiting...")
@@ -390,7 +937,15 @@ class HamlibServer:
             
     def close(self):
         # Stop our Radio Listener/Controller
+        if (self.hopScheduler):
+            self.hopScheduler.stop()
+        if (self.statusRate):
+            self.statusRate.stop()
         self.ka9q_rs.stopHandler()
+        self.ka9q_rs.stopRecording()
+        self.ka9q_rs.stopDiffServer()
+        if (self.channelPool):
+            self.channelPool.close()
         self.ka9q_rc.close()
 
         for client in self.hamlib_clients:
@@ -422,8 +977,51 @@ class HamlibServer:
 
 
 
-if __name__ == "__main__":
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio Hamlib Rigctld Server")
+    parser.add_argument("mcast_group", type=str, nargs='?', default='hf.local', help="Multicast group name/ip for VFO control.")
+    parser.add_argument("ssrc", type=int, nargs='?', default=DEFAULT_SSRC_ID, help="SSRC is to create / reuse for VFO control.")
+    parser.add_argument("freq_hz", type=int, nargs='?', default=7078000, help="Initial frequency (Hz) which vfo will be set to.")
+    parser.add_argument("mode", type=str, nargs='?', default=DEFAULT_MODE, help="Initial mode which vfo will be set to.")
+    parser.add_argument("--host", type=str, default=DEFAULT_HAMLIB_HOST, help="Host name/ip to bind Hamlib Rigctld to.")
+    parser.add_argument("--port", type=int, default=DEFAULT_HAMLIB_PORT, help="Port to bind use for Hamlib Rigctld.")
+    parser.add_argument("--ssrc-b", type=int, help="SSRC for VFO B, enables VFO A / B switching and split.")
+    parser.add_argument("--freq-b", type=int, help="Initial VFO B frequency (Hz), defaults to freq_hz.")
+    parser.add_argument("--pool", type=str, nargs='+', help="Hot standby channels: 'hz', 'hz:mode' or 'ft8' (all FT8 dial frequencies).")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="Maximum pooled channels (least recently used evicted).")
+    parser.add_argument("--pool-ssrc", type=int, help="First SSRC allocated to pooled channels (default ssrc + 1).")
+    parser.add_argument("--hop", type=str, nargs='+', help="Band hop rotation for VFO A: 'hz[:mode[:slots]]' entries.")
+    parser.add_argument("--hop-slot", type=str, default='wspr', help="Band hop slot length: 'wspr' (120s), 'ft8' (15s) or seconds.")
+    parser.add_argument("--hop-lead", type=float, default=DEFAULT_LEAD, help="Seconds before each slot boundary the retune is sent.")
+    parser.add_argument("--adaptive-status", action='store_true', help="Raise the channel's STATUS_INTERVAL while clients are polling it.")
+    statusrate.addArguments(parser)
+    mcastsock.addArguments(parser)
+    parser.add_argument("--history", type=str, help="Record the channels' status history (see statushistory.py) under this directory.")
+    parser.add_argument("--level-average", type=float, default=0.0, help="Seconds STRENGTH / RAWSTR are averaged over (0 the latest status).")
+    parser.add_argument("--status-api", type=str, help="Serve status snapshots / diffs (see statusdiff.py) on this Unix socket path, 'host:port' or 'port'.")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this (localhost) port.")
+    tracing.addArguments(parser)
+    args = parser.parse_args()
+
+    tracing.enableFromArgs(args)
+
+    if (args.metrics_port):
+        metrics.startServer(port=args.metrics_port)
+
     try:
-        HamlibServer(mcast_group='hf.local', ssrc=9999991, freq_hz=7078000, mode='usb', host='localhost',port=DEFAULT_HAMLIB_PORT).listen()
+        HamlibServer(mcast_group=args.mcast_group, ssrc=args.ssrc, freq_hz=args.freq_hz, mode=args.mode, host=args.host, port=args.port,
+                     ssrc_b=args.ssrc_b, freq_b_hz=args.freq_b,
+                     pool=parsePoolSpec(args.pool, args.mode) if args.pool else None, pool_size=args.pool_size,
+                     pool_ssrc=args.pool_ssrc,
+                     hop=parseRotation(args.hop, args.mode) if args.hop else None, hop_slot=parseSlot(args.hop_slot), hop_lead=args.hop_lead,
+                     status_active=args.status_active if args.adaptive_status else None, status_idle=args.status_idle,
+                     status_idle_after=args.status_idle_after, iface=args.iface, source=args.source,
+                     history=args.history, level_average=args.level_average, status_api=args.status_api).listen()
     except KeyboardInterrupt:
         sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,23 @@
 
+import time
+STARTED = time.perf_counter()      # Before the imports, so the startup timings include them
+
 import argparse
+import dataclasses
 import logging
-import os
-import psutil
-import pyaudio
+import mcastsock
+import metrics
 import signal
-import subprocess
 import sys
-import time
+import threading
+import tracing
 
+from audiostream import Ka9qRtpAudioStream
+from channelpool import DEFAULT_POOL_SIZE, parsePoolSpec
 from hamlibserver import HamlibServer, DEFAULT_HAMLIB_HOST, DEFAULT_HAMLIB_PORT
 from control import KA9Q_PRESETS
-from status import StatusType
+from status import Encoding, StatusType
+from supervisor import AudioPipelineSupervisor, AudioStageConfig, PcmRecordAudioStage
 
 # Configure basic logging to a file and the console
 logging.basicConfig(
@@ -27,104 +33,181 @@ logging.basicConfig(
 
 APPTitle = "KA9Q Radio VFO Streamer (with Hamlib Server)"
 
+STATUS_WAIT_TIMEOUT = 10.0      # Seconds to wait for the channel's RTP output socket in radiod's status
+STATUS_POLL_DELAY = 0.1         # Seconds between polls answered without the socket (no answer already waited)
+
 class Ka9qVfoStreamer():
 
     log: logging.Logger
 
     mcast_group: str
     ssrc: int
+    ssrc_b: int | None
     rtp_mcast_group_ip: str
+    rtp_mcast_port: int
     
     hls: HamlibServer
 
     audio_device: str
     audio_rate: int
-    audioProcess: subprocess.Popen
+    inprocAudio: bool
+    sinkLatencyMs: float
+    audioSupervisor: AudioPipelineSupervisor | None
+    encoding: Encoding | None
+    opusBitrate: int | None
+    registry: 'KA9QRadioServiceDiscovery | None'      # Only with --discover, zeroconf is imported then
+    ctlService: str | None          # Name of the radiod control service we're using
+    startup: tracing.PhaseTimer
 
     def __init__(self, mcast_group:str, ssrc: int, freq_hz:int, mode:str, 
                  audio_device:str, audio_rate:int, 
-                 host:str=DEFAULT_HAMLIB_HOST, port:int=DEFAULT_HAMLIB_PORT) -> None:
+                 host:str=DEFAULT_HAMLIB_HOST, port:int=DEFAULT_HAMLIB_PORT,
+                 inprocAudio:bool=False, sinkLatencyMs:float=0.0,
+                 encoding:Encoding|None=None, opusBitrate:int|None=None,
+                 ssrc_b:int|None=None, freq_b_hz:int|None=None,
+                 pool:list[tuple[int, str]]|None=None, pool_size:int=DEFAULT_POOL_SIZE, pool_ssrc:int|None=None,
+                 discover:bool=False, iface:str|None=None, source:str|None=None, history:str|None=None,
+                 level_average:float=0.0, status_api:str|None=None) -> None:
         
         self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))        
 
         self.mcast_group = mcast_group
         self.ssrc = ssrc
+        self.ssrc_b = ssrc_b
         self.audio_device = audio_device
         self.audio_rate = audio_rate
+        self.inprocAudio = inprocAudio
+        self.sinkLatencyMs = sinkLatencyMs
+        self.audioSupervisor = None
+        self.encoding = encoding
+        self.opusBitrate = opusBitrate
+        self.registry = None
+        self.ctlService = None
+        self.startup = tracing.PhaseTimer("Startup", STARTED)
+        self.startup.mark('imports')
 
         #1. Start the HamlibServer, this will sset the initial Frequency, Mode for the specifed SSRC to ensure it exists before trying to start Audio Stream
-        self.hls = HamlibServer(mcast_group=args.mcast_group, ssrc=args.ssrc, freq_hz=freq_hz, mode=mode, host=args.host, port=args.port)
+        self.hls = HamlibServer(mcast_group=mcast_group, ssrc=ssrc, freq_hz=freq_hz, mode=mode, host=host, port=port,
+                                ssrc_b=ssrc_b, freq_b_hz=freq_b_hz, pool=pool, pool_size=pool_size, pool_ssrc=pool_ssrc,
+                                iface=iface, source=source, history=history, level_average=level_average,
+                                status_api=status_api)
+        self.startup.mark('resolve / sockets')
         self.hls.start()
 
+        self.setEncoding()
+
+        if (discover):
+            # Browsing for radiod's services happens alongside the rest of startup
+            threading.Thread(target=self.startDiscovery, daemon=True).start()
+
         # Register our handlers
         self.registerSignalHandlers()
 
-        # allow a bit of time for thread to start
-        time.sleep(0.250)
-        if (not self.hls.serverHandlerRunning):
+        if (not self.hls.serverReady.wait(2.0)):
             raise Exception("Hamlib Server Failed to start.")
-
-        self.log.info("Waiting for VFO Status information...")
-        while (len(self.hls.ka9q_rs.status) < 1):
-            time.sleep(0.1)
+        self.startup.mark('rigctld')
+
+        self.log.info("Polling VFO Status information...")
+        deadline = time.monotonic() + STATUS_WAIT_TIMEOUT
+        while (not self.hls.getRtpMcastSocket()):
+            if (time.monotonic() > deadline):
+                raise Exception(f"SSRC: [{ssrc}] No RTP output socket in radiod's status after [{STATUS_WAIT_TIMEOUT}s].")
+            s = self.hls.ka9q_rs.poll(self.hls.ka9q_rc, ssrc)
+            if (s) and (not s.get(StatusType.OUTPUT_DATA_DEST_SOCKET)):
+                time.sleep(STATUS_POLL_DELAY)       # Answered without the socket, don't spin
+        self.startup.mark('first status')
 
         #2. Start the Audio Streaming form the RTP to select AudioDevice and sample rate
         sockinfo =  self.hls.getRtpMcastSocket()
         if (sockinfo):
             # self.rtp_mcast_group_ip = '239.206.102.211'
             self.rtp_mcast_group_ip = sockinfo['addr']
-            self.log.info(f"SSRC: [{ssrc}]  RTP Multicast Address: [{self.rtp_mcast_group_ip}].")
+            self.rtp_mcast_port = sockinfo['port']
+            self.log.info(f"SSRC: [{ssrc}]  RTP Multicast Address: [{self.rtp_mcast_group_ip}:{self.rtp_mcast_port}].")
             self.startAudioStream()
+            self.startup.mark('audio')
         else:
             self.log.error("Unable to determine audio streams RTP Address information.")
             sys.exit(-1)
 
 
+        self.log.info(self.startup.report())
         print("Ready....")
         self.hls.serverHandlerThread.join()  
 
-    def startAudioStream(self):
+    def startDiscovery(self):
+        # Follow radiod's services, so a radiod restart is recovered from without restarting us
+        from discover import KA9QRadioServiceDiscovery, DEFAULT_CACHE_PATH, KA9Q_RADIO_CTL_SVC
+
+        registry = KA9QRadioServiceDiscovery(cachePath=DEFAULT_CACHE_PATH)
+        ctl = [s for s in registry.findByAddress(self.hls.ka9q_rs.mcast_group_ip) if s.type == KA9Q_RADIO_CTL_SVC]
+        self.ctlService = ctl[0].name if ctl else None
+        registry.addChangeCallback(self.onServiceChange)
+        self.registry = registry
+        self.log.info(f"Following radiod services, control service: [{self.ctlService}].")
+
+    def setEncoding(self):
+        if (self.encoding):
+            for s in ([self.ssrc, self.ssrc_b] if self.ssrc_b is not None else [self.ssrc]):
+                self.log.info(f"SSRC: [{s}] Setting output encoding: [{self.encoding.name}]  Opus bitrate: [{self.opusBitrate}]")
+                self.hls.ka9q_rc.control_set_encoding(s, self.encoding, self.opusBitrate)
+
+    def onServiceChange(self, change: str, svc: 'KA9QService'):
+        # Registry thread: radiod restarted or moved, rejoin its groups, recreate our channels and restart the audio
+        from discover import KA9Q_RADIO_CTL_SVC, KA9Q_RADIO_RTP_SVC
+
+        rs = self.hls.ka9q_rs
+        if (svc.type == KA9Q_RADIO_CTL_SVC):
+            if (change == 'added') and (rs.mcast_group_ip in svc.addresses):
+                self.ctlService = svc.name
+            if (change not in ('restarted', 'updated')) or (svc.name != self.ctlService):
+                return
+            group = rs.mcast_group_ip if rs.mcast_group_ip in svc.addresses else next((a for a in svc.addresses if ':' not in a), None)
+            if (group is None):
+                return
+            self.log.warning(f"radiod control service: [{svc.name}] {change}, rejoining: [{group}] and recreating channels.")
+            rs.rejoin(group)
+            self.hls.ka9q_rc.mcast_group_ip = group
+            self.hls.recreateChannels()
+            self.setEncoding()
+            if (self.audioSupervisor):
+                self.audioSupervisor.restart(f"radiod {change}")
+        elif (svc.type == KA9Q_RADIO_RTP_SVC) and (change in ('restarted', 'updated')):
+            if (self.audioSupervisor) and (self.audioSupervisor.stageConfig) and (self.audioSupervisor.stageConfig.rtp_ip in svc.addresses):
+                self.audioSupervisor.restart(f"RTP service {change}")
+
+    def createAudioStage(self, cfg: AudioStageConfig):
+        if (not cfg.samprate):
+            cfg = dataclasses.replace(cfg, samprate=self.audio_rate)
+
+        rs = self.hls.ka9q_rs
+        if (self.inprocAudio) or (rs.source) or (cfg.encoding not in (Encoding.NO_ENCODING.value, Encoding.S16BE.value)):
+            # Receive the RTP stream ourselves (instead of pcmrecord) so end-to-end latency can be measured,
+            # pcmrecord | sox pipeline also expects raw S16 PCM, so decode anything else in process. pcmrecord
+            # can't join source specific either.
+            return Ka9qRtpAudioStream(cfg.rtp_ip, cfg.rtp_port, cfg.ssrc, self.audio_device, cfg.samprate,
+                                      ka9q_rs=rs, channels=cfg.channels, sinkLatencyMs=self.sinkLatencyMs,
+                                      iface=rs.iface, source=rs.source)
+
+        return PcmRecordAudioStage(cfg, self.audio_device)
 
-        # command = ["./pcmrecord_to_virtualcard.sh", 'hf-pcm.local', str(self.ssrc), str(self.audio_rate), "virtual_card_01"]
-        # command = ["./pcmrecord_to_virtualcard.sh", '239.206.102.211', str(self.ssrc), str(self.audio_rate), "virtual_card_01"]
-        command = ["./pcmrecord_to_virtualcard.sh", self.rtp_mcast_group_ip, str(self.ssrc), str(self.audio_rate), self.audio_device]
-
-        self.audioProcess = subprocess.Popen(command, preexec_fn=os.setsid)
-        # self.audioProcess = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, preexec_fn=os.setsid)
-
-        print(f"Audio streaming process started with PID: {self.audioProcess.pid}")
-        
+    def startAudioStream(self):
+        # The supervisor restarts the audio stage if it dies / stalls and rebuilds it when the
+        # channel's output rate, encoding or RTP destination changes.
+        self.audioSupervisor = AudioPipelineSupervisor(self.hls.ka9q_rs, self.hls.ssrc, self.createAudioStage)
+        self.audioSupervisor.start()
+        self.hls.addVfoCallback(self.onVfoChange)
+
+    def onVfoChange(self, vfo: str, ssrc: int):
+        # VFO A / B and pooled channels are separate SSRCs, the audio follows the one feeding the rig
+        self.ssrc = ssrc
+        if (self.audioSupervisor):
+            self.audioSupervisor.setSsrc(ssrc)
 
     def stopAudioStream(self):
-        self.log.info(f"Sending SIGKILL (signal 9) to audio stream process with PID: {self.audioProcess.pid}")
-        # self.audioProcess.kill()
-        # Currently running a shell script so need to whole kill process tree
-        self.killProcessTree(self.audioProcess.pid)
-
-    def killProcess(self, pid:int):
-        try:
-            os.kill(pid, 9)  # 9 is the signal number for SIGKILL
-            self.log.debug(f"SIGKILL sent to process with PID: {pid}.")
-        except ProcessLookupError:
-            self.log.error(f"Process with PID {pid} not found.")
-
-    def killProcessTree(self, pid:int, sig:int=9):
-        
-        try:
-            parent = psutil.Process(pid)
-        except psutil.NoSuchProcess:
-            return
-
-        children = parent.children(recursive=True)
-        for child in children:
-            try:
-                os.kill(child.pid, sig)
-            except OSError as e:
-                self.log.error(f"Error killing child process {child.pid}: {e}")
-        try:
-            os.kill(pid, sig)
-        except OSError as e:
-            self.log.error(f"Error killing parent process {pid}: {e}")
+        if (self.audioSupervisor):
+            self.audioSupervisor.stop()
+            self.audioSupervisor = None
 
     def registerSignalHandlers(self):
         signal.signal(signal.SIGINT, self.handle_signal)
@@ -135,11 +218,15 @@ class Ka9qVfoStreamer():
         self.log.info(f"Signal: [{signum}] received. Requesting shutdown...")
         self.hls.stop()
         self.stopAudioStream()
+        if (self.registry):
+            self.registry.close()
         time.sleep(2)
 
 # ================ Main routine ================================================
 
 def listAudioDevices():
+    import pyaudio      # Only needed to list devices, keeps it off the startup path
+
     PA = pyaudio.PyAudio()
     try:
         ndev = PA.get_device_count()
@@ -172,6 +259,22 @@ def processArgs(parser):
     parser.add_argument("-ar", "--audio-rate", type=int, default=12000, choices=[11025, 12000, 22050, 44100, 48000], help="Audio sampling rate.")
     parser.add_argument("--host", type=str, default=DEFAULT_HAMLIB_HOST, help="Host name/ip to bind Hamlib Rigctld to.")
     parser.add_argument("--port", type=int, default=DEFAULT_HAMLIB_PORT, help="Port to bind use for Hamlib Rigctld.")
+    parser.add_argument("-ia", "--inproc-audio", action='store_true', help="Receive RTP audio in process instead of pcmrecord (reports end-to-end latency).")
+    parser.add_argument("--encoding", type=str.upper, choices=[Encoding.S16BE.name, Encoding.OPUS.name], help="Set the channel's output encoding.")
+    parser.add_argument("--opus-bitrate", type=int, help="Opus bit rate (bits/sec) when --encoding OPUS.")
+    parser.add_argument("--sink-latency-ms", type=float, default=0.0, help="Known audio sink/device latency (ms) added to the reported end-to-end latency.")
+    parser.add_argument("--ssrc-b", type=int, help="SSRC for VFO B, enables VFO A / B switching and split.")
+    parser.add_argument("--freq-b", type=int, help="Initial VFO B frequency (Hz), defaults to freq_hz.")
+    parser.add_argument("--pool", type=str, nargs='+', help="Hot standby channels: 'hz', 'hz:mode' or 'ft8' (all FT8 dial frequencies).")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="Maximum pooled channels (least recently used evicted).")
+    parser.add_argument("--pool-ssrc", type=int, help="First SSRC allocated to pooled channels (default ssrc + 1).")
+    parser.add_argument("--discover", action='store_true', help="Follow radiod's zeroconf services, recovering automatically when it restarts.")
+    mcastsock.addArguments(parser)
+    parser.add_argument("--history", type=str, help="Record the channels' status history (see statushistory.py) under this directory.")
+    parser.add_argument("--level-average", type=float, default=0.0, help="Seconds STRENGTH / RAWSTR are averaged over (0 the latest status).")
+    parser.add_argument("--status-api", type=str, help="Serve status snapshots / diffs (see statusdiff.py) on this Unix socket path, 'host:port' or 'port'.")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this (localhost) port.")
+    tracing.addArguments(parser)
     
     args = parser.parse_args()
 
@@ -186,7 +289,16 @@ if __name__ == "__main__":
     if (args.list_audio_devices):
         listAudioDevices()
     else:
+        if (args.metrics_port):
+            metrics.startServer(port=args.metrics_port)
+        tracing.enableFromArgs(args)
         vfo = Ka9qVfoStreamer(mcast_group=args.mcast_group, ssrc=args.ssrc, freq_hz=args.freq_hz, mode=args.mode,
                             audio_device=args.audio_device, audio_rate=args.audio_rate,
-                            host=args.host, port=args.port)
+                            host=args.host, port=args.port,
+                            inprocAudio=args.inproc_audio, sinkLatencyMs=args.sink_latency_ms,
+                            encoding=Encoding[args.encoding] if args.encoding else None, opusBitrate=args.opus_bitrate,
+                            ssrc_b=args.ssrc_b, freq_b_hz=args.freq_b,
+                            pool=parsePoolSpec(args.pool, args.mode) if args.pool else None, pool_size=args.pool_size,
+                            pool_ssrc=args.pool_ssrc, discover=args.discover, iface=args.iface, source=args.source,
+                            history=args.history, level_average=args.level_average, status_api=args.status_api)
 
@@ -1,14 +1,48 @@
 
+import argparse
 import logging
+import mcastsock
+import metrics
+import random
 import socket
-import struct
 import threading
 import time
+import tracing
 
 from resolver import resolve_name
-from control import DEFAULT_MCAST_GROUP, DEFAULT_STAT_PORT
-from status import parsePacket, StatusType;
-from typing import Any
+from control import Ka9qRadioControl, DEFAULT_MCAST_GROUP, DEFAULT_STAT_PORT, POLL_ALL_SSRC
+from mcastsock import join_mcast, leave_mcast, listen_mcast
+from rtptime import RtpClockModel
+from status import parsePacket, Encoding, StatusType, OPUS_SAMPRATE;
+from typing import Any, Callable
+
+# Only looking for potnetial status packets (~300-375bytes) by default. Larger sizes are most likely
+# spectrum (BIN_DATA) / IQ data related packets 
+DEFAULT_MIN_STATUS_SIZE = 300
+DEFAULT_MAX_STATUS_SIZE = 500
+MAX_DATAGRAM_SIZE = 65536       # Size filter bounds that accept every status packet (ie inventory)
+
+DEFAULT_POLL_TIMEOUT = 0.5      # Seconds to wait for a poll's reply
+DEFAULT_POLL_SETTLE = 0.1       # Poll of all channels is complete once no reply arrives for this long
+
+StatusCallback = Callable[[int, dict[StatusType, Any]], None]
+
+
+class PollWaiter():
+
+    tag: int
+    replies: dict[int, dict[StatusType, Any]]  # Key: SSRC
+    event: threading.Event
+
+    def __init__(self, tag: int):
+        self.tag = tag
+        self.replies = {}
+        self.event = threading.Event()
+
+STATUS_RECEIVED = metrics.Counter('ka9q_status_datagrams_received_total', 'Datagrams received on the status group')
+STATUS_DECODED = metrics.Counter('ka9q_status_packets_decoded_total', 'Status packets decoded and accepted', ('ssrc',))
+STATUS_DROPPED = metrics.Counter('ka9q_status_packets_dropped_total', 'Status datagrams dropped', ('ssrc', 'reason'))
+PARSE_SECONDS = metrics.Histogram('ka9q_status_parse_seconds', 'parsePacket() duration')
 
 class Ka9qRadioStatusListener():
     
@@ -19,18 +53,45 @@ class Ka9qRadioStatusListener():
 
     mcast_group: str
     mcast_group_ip: str
+    iface: str | None       # Interface the groups are joined on, None the default
+    source: str | None      # radiod host address, only its multicast is accepted (source specific multicast)
 
     s_in: socket.socket     # Inbound / Listner mcast socket
 
     ssrcFilter: list[int]
+    minPacketSize: int
+    maxPacketSize: int
     status: dict[int, dict[StatusType, Any]]    # Key: SSRC - 
+    rtpClocks: dict[int, RtpClockModel]         # Key: SSRC - RTP timestamp to GPS time mapping
+    statusCallbacks: list[StatusCallback]       # Called (on the listener thread) for each accepted status packet
+    pollWaiters: dict[int, PollWaiter]          # Key: COMMAND_TAG of an outstanding poll
+    groups: set[str]                            # Additional groups joined (channel data groups)
+    packetLog: tracing.SampledLogger            # Per packet debug messages, rate limited
+    history: 'StatusHistory | None'             # Status history recorder (statushistory.py), None when not recording
+    series: 'StatusSeries | None'               # Recent per SSRC field history (statusseries.py), None until started
+    diffServer: 'StatusDiffServer | None'       # Incremental status for dashboards (statusdiff.py), None until started
 
-    def __init__(self, mcast_group:str=DEFAULT_MCAST_GROUP, ssrcFilter: list[int]=[]):
+    def __init__(self, mcast_group:str=DEFAULT_MCAST_GROUP, ssrcFilter: list[int]=[],
+                 minPacketSize:int=DEFAULT_MIN_STATUS_SIZE, maxPacketSize:int=DEFAULT_MAX_STATUS_SIZE,
+                 sock: socket.socket | None = None, iface: str | None = None, source: str | None = None):
         self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
 
         self.mcast_group = mcast_group
+        self.iface = iface
+        self.source = source
         self.ssrcFilter = ssrcFilter
+        self.minPacketSize = minPacketSize
+        self.maxPacketSize = maxPacketSize
         self.status = {}
+        self.rtpClocks = {}
+        self.statusCallbacks = []
+        self.pollWaiters = {}
+        self.groups = set()
+        self.packetLog = tracing.SampledLogger(self.log)
+        self.history = None
+        self.series = None
+        self.diffServer = None
+        self.statusListenerHandlerRunning = False
 
         names = resolve_name(mcast_group)
         if names and len(names) > 0:
@@ -38,64 +99,208 @@ class Ka9qRadioStatusListener():
         else:
             raise Exception(f"Failed to resolve multicast group name: [{mcast_group}].")
 
-        self.s_in = self.listen_mcast()
+        # An existing socket (ie capture.ReplaySocket) can be supplied instead of joining the group
+        self.s_in = sock if sock else self.listen_mcast()
 
     def listen_mcast(self) -> socket.socket:
-        
-        # Recv
-        server_address = ('', DEFAULT_STAT_PORT)
+        return listen_mcast(self.mcast_group_ip, DEFAULT_STAT_PORT, timeout=0.5, iface=self.iface, source=self.source)
 
-        # Create the socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    def joinGroup(self, group_ip: str):
+        # Also receive status sent to another group on the status port, ie a channel's STATUS_INTERVAL status
+        if (group_ip == self.mcast_group_ip) or (group_ip in self.groups):
+            return
+        join_mcast(self.s_in, group_ip, self.iface, self.source)
+        self.groups.add(group_ip)
+        self.log.info(f"Joined: [{group_ip}:{DEFAULT_STAT_PORT}]")
 
-         # Allow multiple processes to bind to the same address/port
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        # Optional: Enable SO_REUSEPORT for potentially better load balancing
+    def rejoin(self, group_ip: str | None = None):
+        # radiod restarted (ie seen by discover.py): renews the status group membership, or moves to its new address
+        new = group_ip or self.mcast_group_ip
         try:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-        except AttributeError:
-            self.log.info("SO_REUSEPORT not available on this system.")
-
-        # Bind to the server address
-        sock.bind(server_address)
-
-        # Tell the operating system to add the socket to the multicast group
-        # on all interfaces.
-        group = socket.inet_aton(self.mcast_group_ip)
-        mreq = struct.pack('4sL', group, socket.INADDR_ANY)
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-    
+            leave_mcast(self.s_in, self.mcast_group_ip, self.iface, self.source)
+        except OSError:
+            pass        # Membership already lost, or not a multicast socket (ie capture.ReplaySocket)
+        join_mcast(self.s_in, new, self.iface, self.source)
+        for g in self.groups:
+            try:
+                leave_mcast(self.s_in, g, self.iface, self.source)
+            except OSError:
+                pass
+            join_mcast(self.s_in, g, self.iface, self.source)
+        if (new != self.mcast_group_ip):
+            self.log.info(f"Status group moved: [{self.mcast_group_ip}] -> [{new}]")
+        self.mcast_group_ip = new
+
+    def startRecording(self, root: str, fields: list[StatusType] | None = None, segmentSeconds: float | None = None,
+                       retention: float | None = None) -> 'StatusHistory':
+        # Appends the channels' status fields to a columnar history under root, see statushistory.py
+        import statushistory
+
+        if (self.history is not None):
+            raise Exception(f"Already recording status history to: [{self.history.root}].")
+        self.history = statushistory.StatusHistory(root, fields or statushistory.DEFAULT_FIELDS,
+                                                   segmentSeconds or statushistory.DEFAULT_SEGMENT_SECONDS,
+                                                   retention or statushistory.DEFAULT_RETENTION)
+        self.history.start()
+        self.addStatusCallback(self.history.onStatus)
+        self.log.info(f"Recording status history to: [{root}]  Fields: [{', '.join(self.history.columns[1:])}]")
+        return self.history
+
+    def stopRecording(self):
+        if (self.history is not None):
+            self.removeStatusCallback(self.history.onStatus)
+            self.history.stop()
+            self.history = None
+
+    def startSeries(self, capacities: dict[StatusType, int] | None = None, maxChannels: int | None = None) -> 'StatusSeries':
+        # Keeps the recent values of numeric status fields per channel, see statusseries.py. Started once,
+        # later callers share it.
+        import statusseries
+
+        if (self.series is None):
+            self.series = statusseries.StatusSeries(capacities or statusseries.DEFAULT_CAPACITIES,
+                                                    maxChannels or statusseries.DEFAULT_MAX_CHANNELS)
+            self.addStatusCallback(self.series.onStatus)
+        return self.series
+
+    def startDiffServer(self, address: tuple[str, int] | str, interval: float | None = None) -> 'StatusDiffServer':
+        # Serves the channels' status as a snapshot then per field diffs to local clients, see statusdiff.py
+        import statusdiff
+
+        if (self.diffServer is not None):
+            raise Exception(f"Already serving status diffs on: [{self.diffServer.address}].")
+        self.diffServer = statusdiff.StatusDiffServer(address, interval or statusdiff.DEFAULT_INTERVAL)
+        self.diffServer.start()
+        self.addStatusCallback(self.diffServer.onStatus)
+        self.log.info(f"Serving status diffs on: [{address}]")
+        return self.diffServer
+
+    def stopDiffServer(self):
+        if (self.diffServer is not None):
+            self.removeStatusCallback(self.diffServer.onStatus)
+            self.diffServer.stop()
+            self.diffServer = None
+
+    def addStatusCallback(self, cb: StatusCallback):
+        self.statusCallbacks.append(cb)
 
-        return sock
+    def removeStatusCallback(self, cb: StatusCallback):
+        if cb in self.statusCallbacks:
+            self.statusCallbacks.remove(cb)
+
+    def updateRtpClock(self, ssrc: int, stat: dict[StatusType, Any]):
+        gps_ns = stat.get(StatusType.GPS_TIME)
+        rtp_ts = stat.get(StatusType.RTP_TIMESNAP)
+        samprate = stat.get(StatusType.OUTPUT_SAMPRATE, 0)
+        if (stat.get(StatusType.OUTPUT_ENCODING) == Encoding.OPUS.value):
+            samprate = OPUS_SAMPRATE
+        if (gps_ns is None) or (rtp_ts is None) or (not samprate):
+            return
+
+        clock = self.rtpClocks.get(ssrc)
+        if (clock is None):
+            clock = self.rtpClocks[ssrc] = RtpClockModel(samprate)
+        clock.update(gps_ns, rtp_ts, samprate)
 
     def statusListenerHandler(self):
+        buf = bytearray(MAX_DATAGRAM_SIZE)      # Large enough for any datagram, ie spectrum BIN_DATA
+        view = memoryview(buf)
+
         # Receive/respond loop
-        while True:
+        while self.statusListenerHandlerRunning:
             try:
-                data, address = self.s_in.recvfrom(1024)
-                
-                # Only looking for potnetial status packets (~300-375bytes). Larger sizes are most likely
-                # spectrum / IQ data related packets 
-                if (len(data) > 300) and (len(data) < 500):
-                    stat = parsePacket(data)
+                n = self.s_in.recv_into(buf)
+                t = tracing.start() if tracing.enabled else 0
+                if (metrics.enabled):
+                    STATUS_RECEIVED.inc()
 
-                    if (StatusType.OUTPUT_SSRC in stat):
-                        #self.log.debug(f"Packet: [{data.hex()}]")
+                if (n > 0) and (buf[0] != 0):
+                    # Not a status packet (0), ie a command (1) such as our own polls sent to the group
+                    if (metrics.enabled):
+                        STATUS_DROPPED.labels('', 'command').inc()
+
+                elif (n > self.minPacketSize) and (n < self.maxPacketSize):
+                    # One copy out of the reused buffer, parsed values (ie BIN_DATA) may reference it
+                    if (metrics.enabled):
+                        t0 = time.perf_counter()
+                        stat = parsePacket(bytes(view[:n]))
+                        PARSE_SECONDS.observe(time.perf_counter() - t0)
+                    else:
+                        stat = parsePacket(bytes(view[:n]))
 
+                    if (StatusType.OUTPUT_SSRC in stat):
                         ssrc = stat[StatusType.OUTPUT_SSRC]
 
+                        if (self.pollWaiters):
+                            # Poll replies are returned even for SSRCs outside the filter (inventory)
+                            waiter = self.pollWaiters.get(stat.get(StatusType.COMMAND_TAG))
+                            if (waiter is not None):
+                                waiter.replies[ssrc] = stat
+                                waiter.event.set()
+
                         if (len(self.ssrcFilter) == 0) or (ssrc and ssrc in self.ssrcFilter):
                             self.status[stat[StatusType.OUTPUT_SSRC]] = stat
-                            self.log.debug(f"SSRC: [{ssrc}] Stat: [{stat}]")
+                            self.updateRtpClock(ssrc, stat)
+                            if (metrics.enabled):
+                                STATUS_DECODED.labels(ssrc).inc()
+                            self.packetLog.debug("SSRC: [%s] Stat: [%s]", ssrc, stat)
+
+                            for cb in self.statusCallbacks:
+                                cb(ssrc, stat)
+
+                        elif (metrics.enabled):
+                            STATUS_DROPPED.labels(ssrc, 'filtered').inc()
 
                     else:
+                        if (metrics.enabled):
+                            STATUS_DROPPED.labels('', 'no_ssrc').inc()
                         self.log.warning(f"Status info did not contain a valid OUTPUT_SSRC value.")
 
+                elif (metrics.enabled):
+                    STATUS_DROPPED.labels('', 'size').inc()
+
+                if (t):
+                    tracing.finish('listener.packet', t)
+
             except socket.timeout as e:
                 pass
             except Exception as e:
+                if (metrics.enabled):
+                    STATUS_DROPPED.labels('', 'error').inc()
                 self.log.error(f"An error occurred: {e}")
 
+    def poll(self, ka9q_rc: Ka9qRadioControl, ssrc: int, timeout: float = DEFAULT_POLL_TIMEOUT) -> dict[StatusType, Any] | None:
+        # Fresh status for one channel in a single round trip, rather than waiting on radiod's periodic status
+        waiter = self.startPoll()
+        try:
+            ka9q_rc.control_poll(ssrc, waiter.tag)
+            waiter.event.wait(timeout)
+            return waiter.replies.get(ssrc)
+        finally:
+            self.pollWaiters.pop(waiter.tag, None)
+
+    def pollAll(self, ka9q_rc: Ka9qRadioControl, timeout: float = DEFAULT_POLL_TIMEOUT,
+                settle: float = DEFAULT_POLL_SETTLE) -> dict[int, dict[StatusType, Any]]:
+        # Inventory: the status of every channel radiod has, key SSRC
+        waiter = self.startPoll()
+        try:
+            ka9q_rc.control_poll(POLL_ALL_SSRC, waiter.tag)
+            deadline = time.monotonic() + timeout
+            wait = timeout
+            while (wait > 0) and waiter.event.wait(wait):
+                waiter.event.clear()
+                wait = min(settle, deadline - time.monotonic())
+            return dict(waiter.replies)
+        finally:
+            self.pollWaiters.pop(waiter.tag, None)
+
+    def startPoll(self) -> PollWaiter:
+        tag = random.getrandbits(32)
+        while (tag == 0) or (tag in self.pollWaiters):
+            tag = random.getrandbits(32)
+        waiter = self.pollWaiters[tag] = PollWaiter(tag)
+        return waiter
+
     def startHandler(self):
         self.statusListenerHandlerRunning = True
         self.statusListenerHandlerThread =  threading.Thread(target=self.statusListenerHandler, daemon=True)
@@ -106,16 +311,40 @@ class Ka9qRadioStatusListener():
         self.statusListenerHandlerThread.join(2)
 
 def main():
-    rs = Ka9qRadioStatusListener(mcast_group='hf.local', ssrcFilter=[9999991])
+    parser = argparse.ArgumentParser(description="KA9Q Radio status listener")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_MCAST_GROUP, help="Multicast group name/ip for status.")
+    parser.add_argument("ssrc", type=int, nargs='?', default=9999991, help="SSRC to show the status of.")
+    parser.add_argument("-i", "--inventory", action='store_true', help="Poll and list every channel radiod has, then exit.")
+    mcastsock.addArguments(parser)
+    args = parser.parse_args()
 
+    if (args.inventory):
+        # Every channel is listed, so don't drop status packets outside the usual size range
+        rs = Ka9qRadioStatusListener(mcast_group=args.mcast_group, ssrcFilter=[args.ssrc], iface=args.iface, source=args.source,
+                                     minPacketSize=0, maxPacketSize=MAX_DATAGRAM_SIZE + 1)
+    else:
+        rs = Ka9qRadioStatusListener(mcast_group=args.mcast_group, ssrcFilter=[args.ssrc], iface=args.iface, source=args.source)
     rs.startHandler()
-    
+
+    if (args.inventory):
+        rc = Ka9qRadioControl(args.mcast_group, args.iface)
+        try:
+            channels = rs.pollAll(rc)
+            print(f"{len(channels)} channels:")
+            for ssrc, stat in sorted(channels.items()):
+                print(f"  SSRC: [{ssrc}]  Freq: [{stat.get(StatusType.RADIO_FREQUENCY)}]  Mode: [{stat.get(StatusType.PRESET)}]  "
+                      f"Dest: [{stat.get(StatusType.OUTPUT_DATA_DEST_SOCKET)}]")
+        finally:
+            rs.stopHandler()
+            rc.close()
+        return
+
     print(f"Ka9qRadioStatusListener() - Handler has been started, sleeping...")
     try:
         while (True):
             time.sleep(0.5)
             if (len(rs.status) > 0):
-                print(rs.status[9999991])
+                print(rs.status[args.ssrc])
             else:
                 print("No Status Info....")
     finally:
@@ -0,0 +1,159 @@
+import logging
+import socket
+import struct
+import sys
+
+from ipaddress import ip_address
+
+log = logging.getLogger(__name__)
+
+# Shared helpers used to create the multicast sockets for status, control and RTP traffic.
+#
+# Memberships can be limited to one interface ('iface', a name such as 'eth1', an index or, for IPv4, the
+# interface's address) and to one sender ('source', source specific multicast), so on a multi-homed host or
+# with several radiod hosts sharing a group the kernel drops the traffic we don't want. Groups may be IPv4 or IPv6.
+
+# Linux values, not every Python exports them
+IP_ADD_SOURCE_MEMBERSHIP = getattr(socket, 'IP_ADD_SOURCE_MEMBERSHIP', 39)
+IP_DROP_SOURCE_MEMBERSHIP = getattr(socket, 'IP_DROP_SOURCE_MEMBERSHIP', 40)
+IP_MULTICAST_ALL = getattr(socket, 'IP_MULTICAST_ALL', 49)
+IPV6_MULTICAST_ALL = getattr(socket, 'IPV6_MULTICAST_ALL', 29)
+MCAST_JOIN_SOURCE_GROUP = getattr(socket, 'MCAST_JOIN_SOURCE_GROUP', 46)
+MCAST_LEAVE_SOURCE_GROUP = getattr(socket, 'MCAST_LEAVE_SOURCE_GROUP', 47)
+SIOCGIFADDR = 0x8915
+SOCKADDR_STORAGE_SIZE = 128
+
+
+def isIpv6(ip: str) -> bool:
+    return ':' in ip
+
+def familyOf(ip: str) -> int:
+    return socket.AF_INET6 if isIpv6(ip) else socket.AF_INET
+
+def interfaceIndex(iface: str | None) -> int:
+    # 0 lets the kernel choose
+    if (not iface):
+        return 0
+    return int(iface) if iface.isdigit() else socket.if_nametoindex(iface)
+
+def interfaceAddress(iface: str | None) -> str:
+    # IPv4 address of an interface (name or address), '0.0.0.0' lets the kernel choose
+    if (not iface):
+        return '0.0.0.0'
+    try:
+        return str(ip_address(iface))
+    except ValueError:
+        pass
+    import fcntl
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            res = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack('256s', iface.encode()[:15]))
+        except OSError as ex:
+            raise Exception(f"Interface: [{iface}] has no IPv4 address: {ex}")
+    return socket.inet_ntoa(res[20:24])
+
+def sockaddrStorage(ip: str) -> bytes:
+    # struct sockaddr_storage holding ip (port 0), as used by struct group_source_req
+    if (isIpv6(ip)):
+        sa = struct.pack('@H', socket.AF_INET6) + struct.pack('!HI', 0, 0) + socket.inet_pton(socket.AF_INET6, ip) + struct.pack('@I', 0)
+    else:
+        sa = struct.pack('@H', socket.AF_INET) + struct.pack('!H', 0) + socket.inet_aton(ip)
+    return sa.ljust(SOCKADDR_STORAGE_SIZE, b'\0')
+
+def membership(group_ip: str, iface: str | None, source: str | None, join: bool) -> tuple[int, int, bytes]:
+    # (level, option, value) to join / leave the group
+    if (isIpv6(group_ip)):
+        if (source):
+            # No IPv6 specific option, struct group_source_req (its sockaddrs aligned as a long)
+            req = struct.pack('@I0L', interfaceIndex(iface)) + sockaddrStorage(group_ip) + sockaddrStorage(source)
+            return socket.IPPROTO_IPV6, MCAST_JOIN_SOURCE_GROUP if join else MCAST_LEAVE_SOURCE_GROUP, req
+        mreq = socket.inet_pton(socket.AF_INET6, group_ip) + struct.pack('@I', interfaceIndex(iface))
+        return socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP if join else socket.IPV6_LEAVE_GROUP, mreq
+
+    group = socket.inet_aton(group_ip)
+    ifaddr = socket.inet_aton(interfaceAddress(iface))
+    if (source):
+        # struct ip_mreq_source, the BSDs order the source before the interface
+        src = socket.inet_aton(source)
+        mreq = group + ifaddr + src if sys.platform.startswith('linux') else group + src + ifaddr
+        return socket.IPPROTO_IP, IP_ADD_SOURCE_MEMBERSHIP if join else IP_DROP_SOURCE_MEMBERSHIP, mreq
+    return socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP if join else socket.IP_DROP_MEMBERSHIP, group + ifaddr
+
+
+def listen_mcast(group_ip: str, port: int, timeout: float | None = None, bind_group: bool = False,
+                 iface: str | None = None, source: str | None = None) -> socket.socket:
+
+    # Recv - binding to the group address (rather than any) only delivers that group's datagrams,
+    # needed when several groups share a port and must be told apart (ie capture.py)
+    server_address = (group_ip if bind_group else '', port)
+
+    # Create the socket
+    sock = socket.socket(familyOf(group_ip), socket.SOCK_DGRAM)
+
+    # Allow multiple processes to bind to the same address/port
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Optional: Enable SO_REUSEPORT for potentially better load balancing
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    except AttributeError:
+        log.info("SO_REUSEPORT not available on this system.")
+
+    # Only deliver the groups (and sources) this socket joined, by default Linux also delivers those
+    # joined by any other socket on the host sharing the port
+    try:
+        if (isIpv6(group_ip)):
+            sock.setsockopt(socket.IPPROTO_IPV6, IPV6_MULTICAST_ALL, 0)
+        else:
+            sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+    except OSError:
+        pass        # Not Linux
+
+    # Bind to the server address
+    sock.bind(server_address)
+
+    # Tell the operating system to add the socket to the multicast group, on the given
+    # (else the default) interface, from the given (else any) source.
+    join_mcast(sock, group_ip, iface, source)
+
+    if (timeout is not None):
+        sock.settimeout(timeout)
+
+    return sock
+
+
+def join_mcast(sock: socket.socket, group_ip: str, iface: str | None = None, source: str | None = None):
+    # Also used to add another group to a socket from listen_mcast (bound to any), ie a channel's data group
+    # whose port 5006 carries its STATUS_INTERVAL status
+    sock.setsockopt(*membership(group_ip, iface, source, True))
+
+
+def leave_mcast(sock: socket.socket, group_ip: str, iface: str | None = None, source: str | None = None):
+    sock.setsockopt(*membership(group_ip, iface, source, False))
+
+
+def connect_mcast(ttl: int = 1, timeout: float = 0.2, group_ip: str = '', iface: str | None = None) -> socket.socket:
+
+    # Create the socket, IPv6 when sending to an IPv6 group
+    sock = socket.socket(familyOf(group_ip), socket.SOCK_DGRAM)
+
+    # Set a timeout so the socket does not block indefinitely when trying
+    # to receive data.
+    sock.settimeout(timeout)
+
+    # Set the time-to-live for messages to 1 so they do not go past the
+    # local network segment.
+    if (isIpv6(group_ip)):
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, ttl)
+        if (iface):
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, interfaceIndex(iface))
+    else:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, struct.pack('b', ttl))
+        if (iface):
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interfaceAddress(iface)))
+
+    return sock
+
+
+def addArguments(parser):
+    parser.add_argument("--iface", type=str, help="Interface (name, index or IPv4 address) to join the multicast groups on.")
+    parser.add_argument("--source", type=str, help="Only accept multicast from this radiod host address (source specific multicast).")
@@ -0,0 +1,248 @@
+import bisect
+import logging
+import math
+import threading
+
+# Minimal metrics registry (counters, gauges, histograms) exposed over HTTP in the Prometheus text format.
+#
+# Instrumentation sits on per packet paths, so call sites check the module level 'enabled' flag first:
+#
+#     if (metrics.enabled):
+#         STATUS_DECODED.labels(ssrc).inc()
+#
+# which costs a single attribute lookup while metrics are off (the default). Updates are not locked,
+# under load an occasional increment may be lost, which is fine for monitoring.
+
+log = logging.getLogger(__name__)
+
+enabled = False
+
+DEFAULT_METRICS_HOST = 'localhost'
+DEFAULT_METRICS_PORT = 9575
+
+# Seconds, from tens of microseconds (packet decode) to seconds (command acks)
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class CounterChild():
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, n: float = 1.0):
+        self.value += n
+
+
+class GaugeChild():
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, v: float):
+        self.value = v
+
+    def inc(self, n: float = 1.0):
+        self.value += n
+
+    def dec(self, n: float = 1.0):
+        self.value -= n
+
+
+class HistogramChild():
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # Last is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        self.counts[bisect.bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+
+class Metric():
+
+    kind: str
+    name: str
+    help: str
+    labelnames: tuple[str, ...]
+    children: dict[tuple, object]
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), registry: 'Registry | None' = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def newChild(self):
+        raise NotImplementedError()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if (child is None):
+            child = self.children[values] = self.newChild()
+        return child
+
+    def samples(self):
+        # (suffix, labels dict, value) for the exposition format
+        for values, child in list(self.children.items()):
+            yield '', dict(zip(self.labelnames, values)), child.value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def newChild(self):
+        return CounterChild()
+
+    def inc(self, n: float = 1.0):
+        self.labels().inc(n)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def newChild(self):
+        return GaugeChild()
+
+    def set(self, v: float):
+        self.labels().set(v)
+
+    def inc(self, n: float = 1.0):
+        self.labels().inc(n)
+
+    def dec(self, n: float = 1.0):
+        self.labels().dec(n)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    buckets: tuple[float, ...]
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+                 registry: 'Registry | None' = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def newChild(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, v: float):
+        self.labels().observe(v)
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            labels = dict(zip(self.labelnames, values))
+            cumulative = 0
+            for le, n in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += n
+                yield '_bucket', dict(labels, le='+Inf' if le == math.inf else repr(le)), cumulative
+            yield '_sum', labels, child.sum
+            yield '_count', labels, child.count
+
+
+class Registry():
+
+    metrics: dict[str, Metric]
+    lock: threading.Lock
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise Exception(f"Metric: [{metric.name}] is already registered.")
+            self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for suffix, labels, value in m.samples():
+                if (labels):
+                    lbl = ','.join(f'{k}="{escapeLabel(str(v))}"' for k, v in labels.items())
+                    lines.append(f"{m.name}{suffix}{{{lbl}}} {formatValue(value)}")
+                else:
+                    lines.append(f"{m.name}{suffix} {formatValue(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def escapeLabel(s: str) -> str:
+    return s.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def formatValue(v: float) -> str:
+    if (isinstance(v, int)) or (isinstance(v, float) and v.is_integer()):
+        return str(int(v))
+    return repr(v)
+
+
+REGISTRY = Registry()
+
+
+def metricsRequestHandler():
+    # http.server is a noticeable part of startup, so it's only imported (and the handler built) when serving
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass    # Scrapes are not worth a log line each
+
+    return MetricsRequestHandler
+
+
+def enable():
+    global enabled
+    enabled = True
+
+def startServer(host: str = DEFAULT_METRICS_HOST, port: int = DEFAULT_METRICS_PORT) -> 'ThreadingHTTPServer':
+    # Enables collection and serves http://host:port/metrics
+    from http.server import ThreadingHTTPServer
+
+    enable()
+    server = ThreadingHTTPServer((host, port), metricsRequestHandler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info(f"Metrics available at http://{host}:{port}/metrics")
+    return server
+
+
+def main():
+    import time
+    logging.basicConfig(level=logging.INFO)
+
+    requests = Counter('demo_requests_total', 'Demo requests', ('kind',))
+    latency = Histogram('demo_latency_seconds', 'Demo latency')
+    startServer()
+    while True:
+        requests.labels('get').inc()
+        latency.observe(0.003)
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,47 @@ from __future__ import annotations
 
 import logging
 import sys
+import threading
 
-from zeroconf import Zeroconf, AddressResolver, IPVersion
-from ipaddress import IPv4Address, IPv6Address
+from ipaddress import IPv4Address, IPv6Address, ip_address
+
+# Names resolved this run, control and status resolve the same group so only the first pays for mDNS
+resolved: dict[str, list] = {}
+resolvedLock = threading.Lock()
 
 
 def resolve_name(name: str) -> list[ZeroconfIPv4Address] | list[ZeroconfIPv6Address] | None:
-    
+
+    # Literal addresses (ie a loopback fakeradiod group) need no mDNS lookup
+    try:
+        return [ip_address(name)]
+    except ValueError:
+        pass
+
+    # Concurrent lookups of the same name wait on the first rather than querying again
+    with resolvedLock:
+        res = resolved.get(name)
+        if (res is None):
+            res = mdns_resolve(name)
+            if (res):
+                resolved[name] = res
+    return res
+
+def mdns_resolve(name: str) -> list[ZeroconfIPv4Address] | list[ZeroconfIPv6Address] | None:
+    # zeroconf is only imported when there's a name to resolve
+    from zeroconf import Zeroconf, AddressResolver, IPVersion
+
     if not name.endswith("."):
         name += "."
 
     zc = Zeroconf()
-    resolver = AddressResolver(name)
-    if resolver.request(zc, 3000):
-        res = resolver.ip_addresses_by_version(IPVersion.All)       
-        return res
-    else:
+    try:
+        resolver = AddressResolver(name)
+        if resolver.request(zc, 3000):
+            return resolver.ip_addresses_by_version(IPVersion.All)
         return None
+    finally:
+        zc.close()
         
 
 def main():
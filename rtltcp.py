@@ -0,0 +1,192 @@
+import argparse
+import logging
+import struct
+import sys
+import time
+
+import numpy as np
+
+from control import Ka9qRadioControl, DEFAULT_MCAST_GROUP
+from fanout import FanoutServer, FanoutClient, DEFAULT_MAX_QUEUE_BYTES
+from listener import Ka9qRadioStatusListener
+from rtp import RtpHeader, RtpReceiver
+from status import Encoding, StatusType
+
+# Serves a ka9q-radio 'iq' preset channel using the rtl_tcp wire protocol so GNU Radio, SDR++,
+# dump1090 style decoders etc can use radiod channels as if they were an RTL-SDR dongle.
+#
+# Protocol (see librtlsdr -> rtl_tcp.c):
+#  - On connect the server sends a 12 byte header: "RTL0", tuner type (u32 BE), gain count (u32 BE)
+#  - Followed by a continuous stream of interleaved unsigned 8 bit I/Q samples
+#  - Clients send 5 byte commands: command (u8), parameter (u32 BE)
+
+DEFAULT_RTLTCP_HOST = 'localhost'
+DEFAULT_RTLTCP_PORT = 1234
+DEFAULT_IQ_SSRC = 9999981
+DEFAULT_IQ_SAMPRATE = 48000
+
+RTLSDR_TUNER_R820T = 5
+R820T_GAIN_COUNT = 29
+
+RTLTCP_SET_FREQ = 0x01
+RTLTCP_SET_SAMPLE_RATE = 0x02
+RTLTCP_SET_GAIN_MODE = 0x03
+RTLTCP_SET_GAIN = 0x04
+
+IQ_DTYPES = {
+    Encoding.S16BE: np.dtype('>i2'),
+    Encoding.S16LE: np.dtype('<i2'),
+    Encoding.F32LE: np.dtype('<f4'),
+}
+
+def iq_to_u8(payload, dtype: np.dtype) -> np.ndarray:
+    # Vectorised conversion of radiod I/Q samples to rtl_tcp's offset binary 8 bit samples.
+    a = np.frombuffer(payload, dtype=dtype)       # zero copy view of the RTP payload
+    if (dtype.kind == 'f'):
+        return np.clip(a * 127.5 + 127.5, 0, 255).astype(np.uint8)
+    return ((a >> 8) + 128).astype(np.uint8)
+
+
+class RtlTcpServer(FanoutServer):
+
+    ssrc: int
+    freq: float
+    samprate: int
+    encoding: Encoding
+
+    ka9q_rc: Ka9qRadioControl
+    ka9q_rs: Ka9qRadioStatusListener
+    iqReceiver: 'IqRtpReceiver | None'
+
+    cmdBuffers: dict[FanoutClient, bytes]
+
+    def __init__(self, mcast_group: str, ssrc: int, freq_hz: float, samprate: int = DEFAULT_IQ_SAMPRATE,
+                 host: str = DEFAULT_RTLTCP_HOST, port: int = DEFAULT_RTLTCP_PORT, maxQueueBytes: int = DEFAULT_MAX_QUEUE_BYTES):
+        super().__init__((host, port), maxQueueBytes)
+
+        self.ssrc = ssrc
+        self.freq = freq_hz
+        self.samprate = samprate
+        self.encoding = Encoding.S16BE
+        self.iqReceiver = None
+        self.cmdBuffers = {}
+
+        self.ka9q_rc = Ka9qRadioControl(mcast_group)
+        self.ka9q_rs = Ka9qRadioStatusListener(mcast_group, [ssrc])
+        self.ka9q_rs.startHandler()
+
+    def createChannel(self, timeout: float = 5.0):
+        # Create (or reuse) the SSRC in 'iq' preset at the requested sample rate
+        self.ka9q_rc.control_set(self.ssrc, {StatusType.RADIO_FREQUENCY: self.freq,
+                                             StatusType.PRESET: 'iq',
+                                             StatusType.OUTPUT_SAMPRATE: self.samprate})
+
+        self.log.info(f"SSRC: [{self.ssrc}] Waiting for IQ channel status information...")
+        deadline = time.monotonic() + timeout
+        while (self.ssrc not in self.ka9q_rs.status):
+            if (time.monotonic() > deadline):
+                raise Exception(f"SSRC: [{self.ssrc}] No status received for IQ channel.")
+            time.sleep(0.05)
+
+        s = self.ka9q_rs.status[self.ssrc]
+        enc = s.get(StatusType.OUTPUT_ENCODING, Encoding.S16BE.value)
+        self.encoding = Encoding.S16BE if enc == Encoding.NO_ENCODING.value else Encoding(enc)
+        if (self.encoding not in IQ_DTYPES):
+            raise Exception(f"SSRC: [{self.ssrc}] Output encoding: [{self.encoding.name}] is not supported for IQ.")
+
+        sockinfo = s.get(StatusType.OUTPUT_DATA_DEST_SOCKET)
+        if (not sockinfo):
+            raise Exception(f"SSRC: [{self.ssrc}] Unable to determine IQ streams RTP Address information.")
+
+        self.log.info(f"SSRC: [{self.ssrc}] IQ RTP Multicast Address: [{sockinfo['addr']}:{sockinfo['port']}]  "
+                      f"Encoding: [{self.encoding.name}]  Rate: [{s.get(StatusType.OUTPUT_SAMPRATE)}]")
+        self.iqReceiver = IqRtpReceiver(self, sockinfo['addr'], sockinfo['port'])
+        self.iqReceiver.startReceiver()
+
+    def onClientConnected(self, client: FanoutClient):
+        self.cmdBuffers[client] = b''
+        client.enqueue(b'RTL0' + struct.pack('>II', RTLSDR_TUNER_R820T, R820T_GAIN_COUNT))
+
+    def onClientDisconnected(self, client: FanoutClient):
+        self.cmdBuffers.pop(client, None)
+
+    def onClientData(self, client: FanoutClient, data: bytes):
+        buf = self.cmdBuffers.get(client, b'') + data
+        while len(buf) >= 5:
+            cmd, param = struct.unpack('>BI', buf[:5])
+            buf = buf[5:]
+            self.processCommand(cmd, param)
+        self.cmdBuffers[client] = buf
+
+    def processCommand(self, cmd: int, param: int):
+        if (cmd == RTLTCP_SET_FREQ):
+            self.log.info(f"SSRC: [{self.ssrc}] Set frequency: [{param}]")
+            self.freq = float(param)
+            self.ka9q_rc.control_set(self.ssrc, {StatusType.RADIO_FREQUENCY: self.freq})
+        elif (cmd == RTLTCP_SET_SAMPLE_RATE):
+            self.log.info(f"SSRC: [{self.ssrc}] Set sample rate: [{param}]")
+            self.samprate = param
+            self.ka9q_rc.control_set(self.ssrc, {StatusType.OUTPUT_SAMPRATE: self.samprate})
+        elif (cmd == RTLTCP_SET_GAIN_MODE):     # 0: auto, 1: manual
+            self.ka9q_rc.control_set(self.ssrc, {StatusType.AGC_ENABLE: param == 0})
+        elif (cmd == RTLTCP_SET_GAIN):          # tenths of a dB
+            gain = struct.unpack('>i', struct.pack('>I', param))[0] / 10.0
+            self.ka9q_rc.control_set(self.ssrc, {StatusType.GAIN: gain})
+        else:
+            self.log.debug(f"SSRC: [{self.ssrc}] Ignoring rtl_tcp command: [{cmd:#04x}] param: [{param}]")
+
+    def close(self):
+        if (self.iqReceiver):
+            self.iqReceiver.close()
+            self.iqReceiver = None
+        self.stop()
+        self.ka9q_rs.stopHandler()
+        self.ka9q_rc.close()
+
+
+class IqRtpReceiver(RtpReceiver):
+
+    server: RtlTcpServer
+    dtype: np.dtype
+
+    def __init__(self, server: RtlTcpServer, group_ip: str, port: int):
+        super().__init__(group_ip, port, [server.ssrc])
+        self.server = server
+        self.dtype = IQ_DTYPES[server.encoding]
+
+    def onRtpPacket(self, hdr: RtpHeader, payload: memoryview, arrival: float):
+        if (not self.server.clients):
+            return
+        # One conversion per packet, the resulting buffer is shared by all clients' queues
+        self.server.broadcast(memoryview(iq_to_u8(payload, self.dtype)))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio rtl_tcp IQ Server")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_MCAST_GROUP, help="Multicast group name/ip for channel control.")
+    parser.add_argument("ssrc", type=int, nargs='?', default=DEFAULT_IQ_SSRC, help="SSRC is to create / reuse for the IQ channel.")
+    parser.add_argument("freq_hz", type=int, nargs='?', default=7074000, help="Initial frequency (Hz).")
+    parser.add_argument("-sr", "--samprate", type=int, default=DEFAULT_IQ_SAMPRATE, help="IQ sample rate.")
+    parser.add_argument("--host", type=str, default=DEFAULT_RTLTCP_HOST, help="Host name/ip to bind rtl_tcp server to.")
+    parser.add_argument("--port", type=int, default=DEFAULT_RTLTCP_PORT, help="Port to bind rtl_tcp server to.")
+    parser.add_argument("--max-queue-kb", type=int, default=DEFAULT_MAX_QUEUE_BYTES // 1024, help="Per client buffer (KB) before samples are dropped.")
+    args = parser.parse_args()
+
+    server = RtlTcpServer(args.mcast_group, args.ssrc, args.freq_hz, args.samprate, args.host, args.port, args.max_queue_kb * 1024)
+    try:
+        server.createChannel()
+        server.start()
+        print(f"rtl_tcp server listening on {args.host}:{args.port}, press Ctrl-C to exit...")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
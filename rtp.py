@@ -0,0 +1,153 @@
+import logging
+import metrics
+import socket
+import struct
+import threading
+import time
+
+from dataclasses import dataclass
+from mcastsock import listen_mcast
+
+RTP_VERSION = 2
+RTP_HEADER_LEN = 12
+
+RTP_PACKETS = metrics.Counter('ka9q_rtp_packets_received_total', 'RTP packets received', ('ssrc',))
+RTP_LOST = metrics.Counter('ka9q_rtp_packets_lost_total', 'RTP packets lost (sequence gaps)', ('ssrc',))
+
+@dataclass(slots=True)
+class RtpHeader:
+    version: int
+    padding: bool
+    extension: bool
+    marker: bool
+    payload_type: int
+    seq: int
+    timestamp: int
+    ssrc: int
+
+
+def parseRtpHeader(data: bytes | memoryview) -> tuple[RtpHeader, memoryview] | None:
+    # Returns the decoded header and a (zero copy) view of the payload, or None if not an RTP packet.
+    if (len(data) < RTP_HEADER_LEN):
+        return None
+
+    b0, b1, seq, ts, ssrc = struct.unpack_from('>BBHII', data, 0)
+    version = b0 >> 6
+    if (version != RTP_VERSION):
+        return None
+
+    hdr = RtpHeader(version=version, padding=bool(b0 & 0x20), extension=bool(b0 & 0x10),
+                    marker=bool(b1 & 0x80), payload_type=b1 & 0x7F, seq=seq, timestamp=ts, ssrc=ssrc)
+
+    offset = RTP_HEADER_LEN + (4 * (b0 & 0x0F))     # Skip any CSRCs
+    if (hdr.extension):
+        if (len(data) < offset + 4):
+            return None
+        ext_len = struct.unpack_from('>H', data, offset + 2)[0]
+        offset += 4 + (4 * ext_len)
+
+    end = len(data)
+    if (hdr.padding and end > offset):
+        end -= data[end - 1]
+
+    if (offset > end):
+        return None
+
+    return hdr, memoryview(data)[offset:end]
+
+
+class RtpReceiver():
+    """Joins an RTP multicast group and hands each packet for the wanted SSRC(s) to onRtpPacket()."""
+
+    log: logging.Logger
+
+    group_ip: str
+    port: int
+    ssrcFilter: set[int]
+
+    sock: socket.socket
+    receiverRunning: bool
+    receiverThread: threading.Thread | None
+
+    packets: int
+    lost: int
+    lastSeq: dict[int, int]
+    lastArrival: float
+
+    def __init__(self, group_ip: str, port: int, ssrcFilter: list[int] = [], sock: socket.socket | None = None,
+                 iface: str | None = None, source: str | None = None):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.group_ip = group_ip
+        self.port = port
+        self.ssrcFilter = set(ssrcFilter)
+
+        # iface / source: see mcastsock, usually the status listener's so audio comes from the same radiod
+        self.sock = sock if sock else listen_mcast(group_ip, port, timeout=0.2, iface=iface, source=source)
+        self.receiverRunning = False
+        self.receiverThread = None
+
+        self.packets = 0
+        self.lost = 0
+        self.lastSeq = {}
+        self.lastArrival = 0.0
+
+    def onRtpPacket(self, hdr: RtpHeader, payload: memoryview, arrival: float):
+        # NOTE: payload references the receive buffer and is only valid for the duration of the call.
+        pass
+
+    def receiverHandler(self):
+        buf = bytearray(65536)
+        while self.receiverRunning:
+            try:
+                n = self.sock.recv_into(buf)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self.receiverRunning:
+                    self.log.error(f"RTP receive failed: {e}")
+                break
+
+            arrival = time.time()
+            res = parseRtpHeader(memoryview(buf)[:n])
+            if (res is None):
+                continue
+
+            hdr, payload = res
+            if (self.ssrcFilter) and (hdr.ssrc not in self.ssrcFilter):
+                continue
+
+            last = self.lastSeq.get(hdr.ssrc)
+            if (last is not None):
+                gap = (hdr.seq - last) & 0xFFFF
+                if (1 < gap < 0x8000):
+                    self.lost += gap - 1
+                    if (metrics.enabled):
+                        RTP_LOST.labels(hdr.ssrc).inc(gap - 1)
+            self.lastSeq[hdr.ssrc] = hdr.seq
+            self.packets += 1
+            if (metrics.enabled):
+                RTP_PACKETS.labels(hdr.ssrc).inc()
+            self.lastArrival = arrival
+
+            try:
+                self.onRtpPacket(hdr, payload, arrival)
+            except Exception as e:
+                self.log.error(f"An error occurred processing RTP packet: {e}")
+
+    def startReceiver(self):
+        self.receiverRunning = True
+        self.receiverThread = threading.Thread(target=self.receiverHandler, daemon=True)
+        self.receiverThread.start()
+
+    def stopReceiver(self):
+        self.receiverRunning = False
+        if (self.receiverThread):
+            self.receiverThread.join(2)
+            self.receiverThread = None
+
+    def close(self):
+        self.stopReceiver()
+        if (self.sock):
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,203 @@
+import bisect
+import collections
+import logging
+import time
+
+# Maps RTP timestamps onto GPS / UTC time using the GPS_TIME and RTP_TIMESNAP pair
+# radiod includes in each channel's status packet, see ka9q-radio -> radio_status.c
+
+GPS_EPOCH_UNIX = 315964800        # 1980-01-06 00:00:00 UTC as unix seconds
+GPS_UTC_OFFSET = 18               # Leap seconds between GPS and UTC (remember to update!)
+
+NS_PER_SEC = 1_000_000_000
+
+# Baselines shorter than this are not used for drift estimation as
+# the timestamp quantisation would dominate the result.
+MIN_DRIFT_INTERVAL_NS = NS_PER_SEC
+
+# Checkpoints kept per drift window, the reference slides to one of them so the baseline stays
+# between half and a whole window long.
+DRIFT_CHECKPOINTS = 8
+
+DEFAULT_LATENCY_BUCKETS_MS = [5, 10, 20, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 5000]
+
+
+def gps_ns_to_unix(gps_ns: int) -> float:
+    return (gps_ns / NS_PER_SEC) + GPS_EPOCH_UNIX - GPS_UTC_OFFSET
+
+def unix_to_gps_ns(t: float) -> int:
+    return int((t - GPS_EPOCH_UNIX + GPS_UTC_OFFSET) * NS_PER_SEC)
+
+def rtp_delta(a: int, b: int) -> int:
+    # Signed difference a - b of two 32bit RTP timestamps, handling wrap around.
+    d = (a - b) & 0xFFFFFFFF
+    if (d >= 0x80000000):
+        d -= 0x100000000
+    return d
+
+
+class RtpClockModel():
+    """Linear model mapping a single SSRC's RTP timestamps to GPS time, with drift estimation."""
+
+    samprate: int
+    gps_ns: int | None           # GPS time of the last snapshot
+    rtp_ts: int | None           # RTP timestamp of the last snapshot
+    drift_ppm: float             # RTP clock drift relative to the nominal samprate
+    drift_window_ns: int
+    snapshots: int
+    updated: float               # Local unix time the model was last updated
+
+    # Drift is measured over a long baseline (from a reference snapshot) as a single sample of
+    # RTP timestamp quantisation is already ~80ppm over 1 second at 12kHz.
+    samples: int                 # Unwrapped RTP samples elapsed since the first snapshot
+    ref_gps_ns: int | None
+    ref_samples: int             # samples at the reference snapshot
+    checkpoints: collections.deque      # (gps_ns, samples) the reference can slide forward to
+
+    def __init__(self, samprate: int, drift_window: float = 600.0):
+        self.samprate = samprate
+        self.drift_window_ns = int(drift_window * NS_PER_SEC)
+        self.reset()
+
+    def reset(self):
+        self.gps_ns = None
+        self.rtp_ts = None
+        self.samples = 0
+        self.ref_gps_ns = None
+        self.ref_samples = 0
+        self.checkpoints = collections.deque()
+        self.drift_ppm = 0.0
+        self.snapshots = 0
+        self.updated = 0.0
+
+    def isValid(self) -> bool:
+        return (self.gps_ns is not None) and (self.samprate > 0)
+
+    def update(self, gps_ns: int, rtp_ts: int, samprate: int | None = None):
+        if (samprate and samprate != self.samprate):
+            # Sample rate changed, RTP timeline restarts so does our drift estimate.
+            self.samprate = samprate
+            self.reset()
+
+        if (self.gps_ns is None) or (gps_ns <= self.gps_ns):
+            # First snapshot (or GPS time went backwards) - (re)start the baseline here
+            self.ref_gps_ns = gps_ns
+            self.ref_samples = self.samples
+            self.checkpoints.clear()
+        else:
+            self.samples += rtp_delta(rtp_ts, self.rtp_ts)
+            if (gps_ns - self.ref_gps_ns > self.drift_window_ns):
+                # Slide the reference forward so changes in drift (temperature etc) are followed, to the newest
+                # checkpoint at least half a window old so the estimate keeps a long baseline
+                oldest = gps_ns - self.drift_window_ns // 2
+                while self.checkpoints and (self.checkpoints[0][0] <= oldest):
+                    self.ref_gps_ns, self.ref_samples = self.checkpoints.popleft()
+
+            baseline_ns = gps_ns - self.ref_gps_ns
+            if (baseline_ns >= MIN_DRIFT_INTERVAL_NS) and (self.samprate > 0):
+                measured = (self.samples - self.ref_samples) * NS_PER_SEC / baseline_ns
+                self.drift_ppm = ((measured / self.samprate) - 1.0) * 1e6
+
+            if (not self.checkpoints) or (gps_ns - self.checkpoints[-1][0] >= self.drift_window_ns // DRIFT_CHECKPOINTS):
+                self.checkpoints.append((gps_ns, self.samples))
+
+        self.gps_ns = gps_ns
+        self.rtp_ts = rtp_ts
+        self.snapshots += 1
+        self.updated = time.time()
+
+    def rtpToGpsNs(self, rtp_ts: int) -> int | None:
+        if (not self.isValid()):
+            return None
+
+        rate = self.samprate * (1.0 + self.drift_ppm / 1e6)
+        return self.gps_ns + int(rtp_delta(rtp_ts, self.rtp_ts) * NS_PER_SEC / rate)
+
+    def rtpToUnix(self, rtp_ts: int) -> float | None:
+        gps_ns = self.rtpToGpsNs(rtp_ts)
+        if (gps_ns is None):
+            return None
+        return gps_ns_to_unix(gps_ns)
+
+
+class LatencyHistogram():
+    """Fixed bucket latency histogram (milliseconds) with a live value and approximate quantiles."""
+
+    bounds: list[float]
+    counts: list[int]
+    count: int
+    total: float
+    min: float
+    max: float
+    last: float
+
+    def __init__(self, bounds: list[float] = DEFAULT_LATENCY_BUCKETS_MS):
+        self.bounds = list(bounds)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)    # Last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.last = float('nan')
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.last = ms
+        if (ms < self.min):
+            self.min = ms
+        if (ms > self.max):
+            self.max = ms
+
+    def mean(self) -> float:
+        return (self.total / self.count) if self.count else float('nan')
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket containing the q'th quantile
+        if (self.count == 0):
+            return float('nan')
+        target = q * self.count
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if (acc >= target):
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self) -> str:
+        if (self.count == 0):
+            return "no samples"
+        return (f"last: {self.last:.1f}ms  mean: {self.mean():.1f}ms  min: {self.min:.1f}ms  max: {self.max:.1f}ms  "
+                f"p50<={self.quantile(0.5):.0f}ms  p99<={self.quantile(0.99):.0f}ms  n: {self.count}")
+
+    def buckets(self) -> list[tuple[float, int]]:
+        # Cumulative (upper bound, count) pairs, Prometheus style
+        res = []
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            res.append((self.bounds[i] if i < len(self.bounds) else float('inf'), acc))
+        return res
+
+
+def main():
+    logging.basicConfig(level=logging.DEBUG)
+
+    # Simulate a 12kHz channel whose clock runs 20ppm fast, snapshots every 2 seconds
+    m = RtpClockModel(12000)
+    gps0 = unix_to_gps_ns(time.time())
+    rtp0 = 0xFFFF0000
+    for i in range(10):
+        dt = 2 * i
+        m.update(gps0 + dt * NS_PER_SEC, (rtp0 + int(dt * 12000 * 1.00002)) & 0xFFFFFFFF)
+
+    print(f"Drift: [{m.drift_ppm:.2f}ppm]  Snapshots: [{m.snapshots}]")
+    print(f"RTP +1s -> UTC: [{m.rtpToUnix((rtp0 + 12000) & 0xFFFFFFFF)}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import argparse
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+from channelpool import EVICT_FREQUENCY
+from control import Ka9qRadioControl, DEFAULT_MCAST_GROUP
+from dataclasses import dataclass
+from listener import Ka9qRadioStatusListener
+from status import StatusType
+from statusrate import Ka9qStatusRateManager
+from typing import Any
+
+# Frequency scanner. Steps one or more channels through a list of frequencies, each step waits for the status
+# packet echoing its COMMAND_TAG (so the measurement is known to be from the new frequency) and records
+# BASEBAND_POWER, NOISE_DENSITY and the SNR over the channel's filter bandwidth into a NumPy array.
+#
+# Each scan channel is driven from the status listener: its acknowledgement immediately sends its next step,
+# so several channels pipeline through the list in parallel without a thread each. With a dwell time each step
+# is measured by a poll (a command carrying only the SSRC) once the dwell has elapsed instead of by the
+# tuning command's own reply.
+
+DEFAULT_SCAN_SSRC = 9999961
+DEFAULT_SCAN_CHANNELS = 4
+DEFAULT_STEP_TIMEOUT = 0.5      # Seconds to wait for a step's acknowledgement before resending
+DEFAULT_STEP_RETRIES = 2        # Resends before the step is given up (recorded as NaN)
+DRIVER_INTERVAL = 0.005
+
+SCAN_DTYPE = np.dtype([
+    ('freq', 'f8'),             # Hz
+    ('power', 'f4'),            # BASEBAND_POWER (dB)
+    ('noise', 'f4'),            # NOISE_DENSITY (dB/Hz)
+    ('snr', 'f4'),              # dB, power over the noise in the filter bandwidth
+    ('time', 'f8'),             # Unix time measured
+    ('ssrc', 'u4'),             # Scan channel measuring it
+])
+
+STEP_IDLE = 0
+STEP_TUNE = 1                   # Awaiting the tuning command's acknowledgement
+STEP_DWELL = 2                  # Tuned, waiting out the dwell before polling
+STEP_MEASURE = 3                # Awaiting the poll's acknowledgement
+
+
+@dataclass
+class ScanChannel:
+    ssrc: int
+    state: int = STEP_IDLE
+    index: int = -1
+    tag: int = 0
+    sent: float = 0.0
+    retries: int = 0
+    measureAt: float = 0.0
+
+
+def snrDb(stat: dict[StatusType, Any], defaultBw: float = 3000.0) -> float:
+    p = stat.get(StatusType.BASEBAND_POWER)
+    n0 = stat.get(StatusType.NOISE_DENSITY)
+    if (p is None) or (n0 is None):
+        return math.nan
+    bw = abs(stat.get(StatusType.HIGH_EDGE, 0.0) - stat.get(StatusType.LOW_EDGE, 0.0)) or defaultBw
+    return p - (n0 + 10.0 * math.log10(bw))
+
+
+class Ka9qScanner():
+
+    log: logging.Logger
+
+    ka9q_rc: Ka9qRadioControl
+    ka9q_rs: Ka9qRadioStatusListener
+    ownListener: bool
+    statusRate: Ka9qStatusRateManager | None     # Scan channels are held at the active status rate while scanning
+
+    mode: str
+    dwell: float
+    timeout: float
+    retries: int
+    channels: dict[int, ScanChannel]
+
+    lock: threading.Lock
+    finished: threading.Event
+    results: np.ndarray | None
+    nextIndex: int
+    completed: int
+    timeouts: int
+    stopSnr: float | None
+    stopPower: float | None
+    stopIndex: int | None           # Result index which met a stop threshold
+    elapsed: float
+
+    def __init__(self, mcast_group: str = DEFAULT_MCAST_GROUP, baseSsrc: int = DEFAULT_SCAN_SSRC,
+                 channels: int = DEFAULT_SCAN_CHANNELS, mode: str = 'usb', dwell: float = 0.0,
+                 timeout: float = DEFAULT_STEP_TIMEOUT, retries: int = DEFAULT_STEP_RETRIES,
+                 ka9q_rc: Ka9qRadioControl | None = None, ka9q_rs: Ka9qRadioStatusListener | None = None,
+                 statusRate: Ka9qStatusRateManager | None = None):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.mode = mode
+        self.dwell = dwell
+        self.timeout = timeout
+        self.retries = retries
+        self.channels = {s: ScanChannel(s) for s in range(baseSsrc, baseSsrc + channels)}
+        self.statusRate = statusRate
+
+        self.ka9q_rc = ka9q_rc if ka9q_rc else Ka9qRadioControl(mcast_group)
+        self.ownListener = ka9q_rs is None
+        if (self.ownListener):
+            self.ka9q_rs = Ka9qRadioStatusListener(mcast_group, list(self.channels))
+        else:
+            self.ka9q_rs = ka9q_rs
+            self.ka9q_rs.ssrcFilter.extend(s for s in self.channels if s not in ka9q_rs.ssrcFilter)
+        self.ka9q_rs.addStatusCallback(self.onStatus)
+        if (self.ownListener):
+            self.ka9q_rs.startHandler()
+
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.results = None
+        self.nextIndex = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.stopSnr = None
+        self.stopPower = None
+        self.stopIndex = None
+        self.elapsed = 0.0
+
+    def scan(self, freqs: np.ndarray | list[float], stopSnr: float | None = None, stopPower: float | None = None) -> np.ndarray:
+        # Blocks until every frequency has been measured (or given up), or a stop threshold is met
+        res = np.zeros(len(freqs), dtype=SCAN_DTYPE)
+        for f in ('power', 'noise', 'snr', 'time'):
+            res[f] = np.nan
+        res['freq'] = freqs
+
+        if (self.statusRate):
+            # Before the first steps, so these commands' replies can't overtake a step's acknowledgement
+            for ssrc in self.channels:
+                self.statusRate.hold(ssrc, 'scan')
+
+        with self.lock:
+            self.results = res
+            self.nextIndex = 0
+            self.completed = 0
+            self.timeouts = 0
+            self.stopSnr = stopSnr
+            self.stopPower = stopPower
+            self.stopIndex = None
+            self.finished.clear()
+            t0 = time.monotonic()
+            for ch in self.channels.values():
+                self.step(ch, t0)
+
+        try:
+            while not self.finished.wait(DRIVER_INTERVAL):
+                self.drive(time.monotonic())
+        finally:
+            if (self.statusRate):
+                for ssrc in self.channels:
+                    self.statusRate.release(ssrc, 'scan')
+
+        self.elapsed = time.monotonic() - t0
+        self.log.info(f"Scanned [{self.completed}] of [{len(res)}] steps in [{self.elapsed:.2f}s]  "
+                      f"[{self.stepsPerSecond():.1f}] steps/sec  Channels: [{len(self.channels)}]  Timeouts: [{self.timeouts}]")
+        return res
+
+    def stepsPerSecond(self) -> float:
+        return self.completed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def step(self, ch: ScanChannel, now: float):
+        # Lock held. Tunes the channel to the next frequency, or idles it once there are none left
+        if (self.stopIndex is None) and (self.nextIndex < len(self.results)):
+            ch.index = self.nextIndex
+            self.nextIndex += 1
+            ch.retries = 0
+            self.send(ch, STEP_TUNE, now)
+        else:
+            ch.state = STEP_IDLE
+            ch.index = -1
+            if all(c.state == STEP_IDLE for c in self.channels.values()):
+                self.finished.set()
+
+    def send(self, ch: ScanChannel, state: int, now: float):
+        # Lock held, so the acknowledgement can't be processed before the tag is known
+        ch.state = state
+        ch.sent = now
+        if (state == STEP_TUNE):
+            ch.tag = self.ka9q_rc.control_set(ch.ssrc, {StatusType.RADIO_FREQUENCY: float(self.results['freq'][ch.index]),
+                                                        StatusType.PRESET: self.mode})
+        else:
+            ch.tag = self.ka9q_rc.control_poll(ch.ssrc)
+
+    def onStatus(self, ssrc: int, stat: dict[StatusType, Any]):
+        ch = self.channels.get(ssrc)
+        if (ch is None) or (ch.state in (STEP_IDLE, STEP_DWELL)):
+            return
+        if (stat.get(StatusType.COMMAND_TAG) != ch.tag):
+            return
+        with self.lock:
+            if (ch.state == STEP_IDLE) or (stat.get(StatusType.COMMAND_TAG) != ch.tag):
+                return
+            now = time.monotonic()
+            if (ch.state == STEP_TUNE) and (self.dwell > 0):
+                ch.state = STEP_DWELL
+                ch.measureAt = now + self.dwell
+                return
+            self.record(ch, stat)
+            self.step(ch, now)
+
+    def record(self, ch: ScanChannel, stat: dict[StatusType, Any]):
+        r = self.results[ch.index]
+        r['power'] = stat.get(StatusType.BASEBAND_POWER, math.nan)
+        r['noise'] = stat.get(StatusType.NOISE_DENSITY, math.nan)
+        r['snr'] = snrDb(stat)
+        r['time'] = time.time()
+        r['ssrc'] = ch.ssrc
+        self.completed += 1
+
+        if ((self.stopSnr is not None) and (r['snr'] >= self.stopSnr)) or \
+           ((self.stopPower is not None) and (r['power'] >= self.stopPower)):
+            self.stopIndex = ch.index
+            self.log.info(f"Signal at [{r['freq']:.0f}Hz]  Power: [{r['power']:.1f}dB]  SNR: [{r['snr']:.1f}dB], stopping.")
+
+    def drive(self, now: float):
+        # Polls channels whose dwell is over and resends steps that were not acknowledged in time
+        with self.lock:
+            for ch in self.channels.values():
+                if (ch.state == STEP_DWELL):
+                    if (now >= ch.measureAt):
+                        ch.retries = 0
+                        self.send(ch, STEP_MEASURE, now)
+                elif (ch.state != STEP_IDLE) and (now - ch.sent > self.timeout):
+                    self.timeouts += 1
+                    if (ch.retries < self.retries):
+                        ch.retries += 1
+                        self.send(ch, ch.state, now)
+                    else:
+                        self.log.warning(f"SSRC: [{ch.ssrc}] No acknowledgement for [{self.results['freq'][ch.index]:.0f}Hz], skipping.")
+                        self.step(ch, now)
+
+    def close(self, removeChannels: bool = True):
+        self.ka9q_rs.removeStatusCallback(self.onStatus)
+        if (removeChannels):
+            for ssrc in self.channels:
+                self.ka9q_rc.control_set(ssrc, {StatusType.RADIO_FREQUENCY: EVICT_FREQUENCY})
+        if (self.ownListener):
+            self.ka9q_rs.stopHandler()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio frequency scanner")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_MCAST_GROUP, help="Multicast group name/ip for control / status.")
+    parser.add_argument("freqs", type=float, nargs='*', help="Frequencies (Hz) to scan.")
+    parser.add_argument("-r", "--range", type=float, nargs=3, metavar=('START', 'STOP', 'STEP'), help="Scan START to STOP (Hz, inclusive) in STEP increments.")
+    parser.add_argument("-c", "--channels", type=int, default=DEFAULT_SCAN_CHANNELS, help="Scan channels run in parallel.")
+    parser.add_argument("--ssrc", type=int, default=DEFAULT_SCAN_SSRC, help="First scan channel SSRC.")
+    parser.add_argument("-m", "--mode", type=str, default='usb', help="Scan channel mode (preset).")
+    parser.add_argument("--dwell", type=float, default=0.0, help="Seconds to dwell on each step before measuring.")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_STEP_TIMEOUT, help="Seconds to wait for each step's acknowledgement.")
+    parser.add_argument("--stop-snr", type=float, help="Stop at the first step with at least this SNR (dB).")
+    parser.add_argument("--stop-power", type=float, help="Stop at the first step with at least this power (dB).")
+    parser.add_argument("-p", "--passes", type=int, default=1, help="Number of passes over the list.")
+    parser.add_argument("--top", type=int, default=10, help="Print the strongest N steps.")
+    parser.add_argument("-o", "--output", type=str, help="Save the (last pass) results to this .npy file.")
+    args = parser.parse_args()
+
+    if (args.range):
+        start, stop, step = args.range
+        freqs = np.arange(start, stop + step / 2, step)
+    elif (args.freqs):
+        freqs = np.array(args.freqs)
+    else:
+        parser.error("Frequencies or --range are required.")
+
+    scanner = Ka9qScanner(args.mcast_group, args.ssrc, args.channels, args.mode, args.dwell, args.timeout)
+    try:
+        for n in range(args.passes):
+            res = scanner.scan(freqs, args.stop_snr, args.stop_power)
+            print(f"Pass {n + 1}: {scanner.completed} steps in {scanner.elapsed:.2f}s, {scanner.stepsPerSecond():.1f} steps/sec, "
+                  f"{scanner.timeouts} timeouts")
+            if (scanner.stopIndex is not None):
+                r = res[scanner.stopIndex]
+                print(f"Stopped on signal: {r['freq']:.0f}Hz  power {r['power']:.1f}dB  SNR {r['snr']:.1f}dB")
+                break
+
+        done = res[~np.isnan(res['snr'])]
+        for r in np.sort(done, order='snr')[::-1][:args.top]:
+            print(f"{r['freq']:>14.0f}Hz  power {r['power']:>7.1f}dB  noise {r['noise']:>7.1f}dB/Hz  SNR {r['snr']:>6.1f}dB")
+        if (args.output):
+            np.save(args.output, res)
+            print(f"Results saved to {args.output}")
+    finally:
+        scanner.close()
+        scanner.ka9q_rc.close()
+
+
+if __name__ == "__main__":
+    main()
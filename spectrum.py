@@ -0,0 +1,217 @@
+import argparse
+import logging
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from control import Ka9qRadioControl, DEFAULT_MCAST_GROUP
+from fanout import FanoutServer
+from listener import Ka9qRadioStatusListener
+from status import StatusType
+from typing import Any
+
+# Spectrum / panadapter feed. Creates a 'spectrum' preset channel, polls it for BIN_DATA (radiod only
+# sends spectrum data in response to a poll), and streams the averaged / decimated dB frames to
+# local clients over TCP or a Unix socket.
+#
+# Frame format (little endian):
+#  - Header: magic "KSPC" (4s), sequence (u32), timestamp - unix secs (f64), center frequency Hz (f64),
+#            bin bandwidth Hz (f64), bin count (u32)
+#  - Followed by bin count float32 values in dB, lowest frequency first.
+
+DEFAULT_SPECTRUM_SSRC = 9999971
+DEFAULT_BIN_COUNT = 1024
+DEFAULT_BIN_BW = 100.0               # Hz
+DEFAULT_POLL_RATE = 10.0             # Frames / sec requested from radiod
+DEFAULT_SPECTRUM_HOST = 'localhost'
+DEFAULT_SPECTRUM_PORT = 4580
+
+# Spectrum status packets carry BIN_DATA, 4 bytes per bin
+SPECTRUM_MAX_PACKET_SIZE = 65536
+
+FRAME_MAGIC = b'KSPC'
+FRAME_HEADER = struct.Struct('<4sIdddI')
+
+# Vectorised versions of the status.py conversions
+def dB2powerVec(x: np.ndarray) -> np.ndarray:
+    return np.power(10.0, x / 10.0)
+
+def power2dBVec(x: np.ndarray) -> np.ndarray:
+    return 10.0 * np.log10(np.maximum(x, np.finfo(np.float32).tiny))
+
+def dB2voltageVec(x: np.ndarray) -> np.ndarray:
+    return np.power(10.0, x / 20.0)
+
+def voltage2dBVec(x: np.ndarray) -> np.ndarray:
+    return 20.0 * np.log10(np.maximum(x, np.finfo(np.float32).tiny))
+
+def decodeBinData(vb: bytes) -> np.ndarray:
+    # BIN_DATA is a vector of big endian float32 bin powers, viewed without copying
+    return np.frombuffer(vb, dtype='>f4', count=len(vb) // 4)
+
+
+class SpectrumProcessor():
+    """Averages (exponentially, in the power domain), decimates and converts spectrum frames to dB."""
+
+    average: int          # Frames averaged, 1 = none
+    decimate: int         # Bins combined (by max) into each output bin, 1 = none
+    frameDecimate: int    # Only every Nth frame is emitted, 1 = all
+    fftShift: bool        # radiod sends bins in FFT order (DC first)
+
+    avg: np.ndarray | None
+    frames: int
+
+    def __init__(self, average: int = 1, decimate: int = 1, frameDecimate: int = 1, fftShift: bool = True):
+        self.average = max(1, average)
+        self.decimate = max(1, decimate)
+        self.frameDecimate = max(1, frameDecimate)
+        self.fftShift = fftShift
+        self.avg = None
+        self.frames = 0
+
+    def process(self, bins: np.ndarray) -> np.ndarray | None:
+        p = bins.astype(np.float32)
+        if (self.fftShift):
+            p = np.fft.fftshift(p)
+
+        if (self.avg is None) or (self.avg.shape != p.shape):
+            self.avg = p
+        else:
+            self.avg += (p - self.avg) * (1.0 / self.average)
+
+        self.frames += 1
+        if (self.frames % self.frameDecimate) != 0:
+            return None
+
+        out = self.avg
+        if (self.decimate > 1):
+            n = (len(out) // self.decimate) * self.decimate
+            out = out[:n].reshape(-1, self.decimate).max(axis=1)
+
+        return power2dBVec(out).astype('<f4')
+
+
+class Ka9qSpectrumSubscriber(FanoutServer):
+
+    ssrc: int
+    freq: float
+    binCount: int
+    binBw: float
+    pollRate: float
+
+    ka9q_rc: Ka9qRadioControl
+    ka9q_rs: Ka9qRadioStatusListener
+    processor: SpectrumProcessor
+
+    seq: int
+    pollerRunning: bool
+    pollerThread: threading.Thread
+
+    def __init__(self, mcast_group: str, ssrc: int, freq_hz: float, address: tuple[str, int] | str,
+                 binCount: int = DEFAULT_BIN_COUNT, binBw: float = DEFAULT_BIN_BW, pollRate: float = DEFAULT_POLL_RATE,
+                 processor: SpectrumProcessor | None = None):
+        super().__init__(address)
+
+        self.ssrc = ssrc
+        self.freq = freq_hz
+        self.binCount = binCount
+        self.binBw = binBw
+        self.pollRate = pollRate
+        self.processor = processor if processor else SpectrumProcessor()
+        self.seq = 0
+        self.pollerRunning = False
+
+        self.ka9q_rc = Ka9qRadioControl(mcast_group)
+        self.ka9q_rs = Ka9qRadioStatusListener(mcast_group, [ssrc], maxPacketSize=SPECTRUM_MAX_PACKET_SIZE)
+        self.ka9q_rs.addStatusCallback(self.onStatus)
+
+    def createChannel(self):
+        self.ka9q_rc.control_set(self.ssrc, {StatusType.RADIO_FREQUENCY: self.freq,
+                                             StatusType.PRESET: 'spectrum',
+                                             StatusType.BIN_COUNT: self.binCount,
+                                             StatusType.NONCOHERENT_BIN_BW: self.binBw})
+
+    def onStatus(self, ssrc: int, stat: dict[StatusType, Any]):
+        vb = stat.get(StatusType.BIN_DATA)
+        if (not vb):
+            return
+
+        out = self.processor.process(decodeBinData(vb))
+        if (out is None) or (not self.clients):
+            return
+
+        self.seq += 1
+        hdr = FRAME_HEADER.pack(FRAME_MAGIC, self.seq & 0xFFFFFFFF, time.time(),
+                                stat.get(StatusType.RADIO_FREQUENCY, self.freq),
+                                stat.get(StatusType.NONCOHERENT_BIN_BW, self.binBw) * self.processor.decimate,
+                                len(out))
+        self.broadcast(hdr + out.tobytes())
+
+    def pollerHandler(self):
+        # Spectrum data is only sent by radiod in response to a command for the channel
+        interval = 1.0 / self.pollRate
+        nextPoll = time.monotonic()
+        while self.pollerRunning:
+            self.ka9q_rc.control_poll(self.ssrc)
+            nextPoll += interval
+            delay = nextPoll - time.monotonic()
+            if (delay > 0):
+                time.sleep(delay)
+            else:
+                nextPoll = time.monotonic()
+
+    def start(self):
+        super().start()
+        self.ka9q_rs.startHandler()
+        self.createChannel()
+        self.pollerRunning = True
+        self.pollerThread = threading.Thread(target=self.pollerHandler, daemon=True)
+        self.pollerThread.start()
+
+    def close(self):
+        self.pollerRunning = False
+        self.pollerThread.join(2)
+        self.stop()
+        self.ka9q_rs.stopHandler()
+        self.ka9q_rc.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio Spectrum Feed")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_MCAST_GROUP, help="Multicast group name/ip for channel control.")
+    parser.add_argument("ssrc", type=int, nargs='?', default=DEFAULT_SPECTRUM_SSRC, help="SSRC is to create / reuse for the spectrum channel.")
+    parser.add_argument("freq_hz", type=int, nargs='?', default=7100000, help="Center frequency (Hz).")
+    parser.add_argument("-b", "--bins", type=int, default=DEFAULT_BIN_COUNT, help="Number of spectrum bins.")
+    parser.add_argument("-bw", "--bin-bw", type=float, default=DEFAULT_BIN_BW, help="Bin bandwidth (Hz).")
+    parser.add_argument("-r", "--rate", type=float, default=DEFAULT_POLL_RATE, help="Frames per second to request from radiod.")
+    parser.add_argument("-a", "--average", type=int, default=1, help="Number of frames to average.")
+    parser.add_argument("-d", "--decimate", type=int, default=1, help="Number of bins combined into each output bin.")
+    parser.add_argument("-fd", "--frame-decimate", type=int, default=1, help="Only send every Nth frame to clients.")
+    parser.add_argument("--unix", type=str, help="Unix socket path to serve frames on (instead of TCP).")
+    parser.add_argument("--host", type=str, default=DEFAULT_SPECTRUM_HOST, help="Host name/ip to bind to.")
+    parser.add_argument("--port", type=int, default=DEFAULT_SPECTRUM_PORT, help="Port to bind to.")
+    args = parser.parse_args()
+
+    address = args.unix if args.unix else (args.host, args.port)
+    sp = SpectrumProcessor(average=args.average, decimate=args.decimate, frameDecimate=args.frame_decimate)
+    sub = Ka9qSpectrumSubscriber(args.mcast_group, args.ssrc, args.freq_hz, address,
+                                 binCount=args.bins, binBw=args.bin_bw, pollRate=args.rate, processor=sp)
+    try:
+        sub.start()
+        print(f"Spectrum feed serving on {address}, press Ctrl-C to exit...")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sub.close()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+import argparse
+import logging
+import socket
+import struct
+import threading
+import time
+
+from control import DEFAULT_MCAST_GROUP
+from dataclasses import dataclass
+from fanout import FanoutServer, FanoutClient
+from status import StatusType, encode_status, parsePacket
+from typing import Any
+
+# Incremental channel status for dashboards. Rather than every client receiving every decoded status packet,
+# the server keeps each channel's current field values, and once per interval sends each client only the
+# fields that changed (encoded with radiod's own TLV status encoding), so bandwidth and CPU follow the rate of
+# change rather than the number of channels. Every change is stamped with a version, a client gets a full
+# snapshot on connect (or after its queue overflowed) then the diffs after it, and can resume with 'since'.
+#
+# Client commands (text lines):
+#  - 'fields NAME[,NAME...]' or 'fields *'   Only send these fields (StatusType names), then a new snapshot
+#  - 'ssrcs SSRC [SSRC...]' or 'ssrcs *'     Only send these channels, then a new snapshot
+#  - 'since VERSION'                         Send every change after VERSION (0 a full snapshot)
+#
+# Frame format (little endian):
+#  - Header: magic "KSDF" (4s), kind (u8: 1 snapshot, 2 diff), from version (u64), to version (u64),
+#            timestamp - unix secs (f64), channel record count (u32)
+#  - Followed by the channel records: SSRC (u32), length (u32), then length bytes of status TLVs (see
+#    status.parsePacket). A 0 length record is a channel that has gone (no status for expireAfter seconds).
+#  - A snapshot replaces the client's state, a diff updates it. A diff's from version is the previous
+#    frame's to version, anything else is a gap and the client should send 'since' with its last version.
+
+DEFAULT_STATUSDIFF_HOST = 'localhost'
+DEFAULT_STATUSDIFF_PORT = 4590
+DEFAULT_INTERVAL = 1.0               # Seconds between diffs
+DEFAULT_EXPIRE_AFTER = 30.0          # Seconds without status before a channel is removed
+DEFAULT_EXCLUDE = (StatusType.COMMAND_TAG, StatusType.BIN_DATA)     # Per request / bulk data, never diffed
+
+FRAME_MAGIC = b'KSDF'
+FRAME_HEADER = struct.Struct('<4sBQQdI')
+RECORD_HEADER = struct.Struct('<II')
+
+FRAME_SNAPSHOT = 1
+FRAME_DIFF = 2
+
+MISSING = object()
+
+
+@dataclass
+class Subscription:
+    fields: frozenset[StatusType] | None = None     # None all
+    ssrcs: frozenset[int] | None = None
+    since: int | None = 0                           # Resync due from this version, None up to date
+    dropped: int = 0                                # Client's dropped chunks when last checked
+    buffer: bytes = b''                             # Partial command line
+
+    def key(self) -> tuple:
+        return (self.fields, self.ssrcs)
+
+
+class StatusDiffServer(FanoutServer):
+
+    interval: float
+    expireAfter: float
+    exclude: frozenset[StatusType]
+
+    version: int
+    values: dict[int, dict[StatusType, Any]]        # Key: SSRC, current decoded values
+    dirty: dict[int, set[StatusType]]               # Key: SSRC, fields changed since the last diff
+    seen: dict[int, float]                          # Key: SSRC, last status (monotonic)
+    lock: threading.Lock                            # values, dirty & seen, shared with the listener thread
+
+    encoded: dict[int, dict[StatusType, bytes]]     # Key: SSRC, encoded TLV per field (publisher thread only)
+    versions: dict[int, dict[StatusType, int]]      # Key: SSRC, version each field last changed
+    removed: dict[int, int]                         # Key: SSRC, version the channel was removed
+    subscriptions: dict[FanoutClient, Subscription]
+
+    publishRunning: bool
+    publishThread: threading.Thread | None
+
+    def __init__(self, address: tuple[str, int] | str, interval: float = DEFAULT_INTERVAL,
+                 expireAfter: float = DEFAULT_EXPIRE_AFTER, exclude: tuple[StatusType, ...] = DEFAULT_EXCLUDE):
+        super().__init__(address)
+
+        self.interval = interval
+        self.expireAfter = expireAfter
+        self.exclude = frozenset(exclude)
+        self.version = 0
+        self.values = {}
+        self.dirty = {}
+        self.seen = {}
+        self.lock = threading.Lock()
+        self.encoded = {}
+        self.versions = {}
+        self.removed = {}
+        self.subscriptions = {}
+        self.publishRunning = False
+        self.publishThread = None
+
+    def onStatus(self, ssrc: int, stat: dict[StatusType, Any]):
+        # Listener thread, only compares values (one lookup per unchanged field, StatusType hashing isn't cheap),
+        # excluded fields and encoding are left to the publisher for the fields that changed
+        with self.lock:
+            values = self.values.get(ssrc)
+            if (values is None):
+                values = self.values[ssrc] = {}
+            self.seen[ssrc] = time.monotonic()
+            changed = self.dirty.get(ssrc)
+            for f, v in stat.items():
+                if (values.get(f, MISSING) != v) and (v == v):     # NaN is never encoded
+                    values[f] = v
+                    if (changed is None):
+                        changed = self.dirty[ssrc] = set()
+                    changed.add(f)
+
+    def onClientConnected(self, client: FanoutClient):
+        # Snapshot sent with the next diff, giving the client the interval to set its filters first
+        self.subscriptions[client] = Subscription()
+
+    def onClientDisconnected(self, client: FanoutClient):
+        self.subscriptions.pop(client, None)
+
+    def onClientData(self, client: FanoutClient, data: bytes):
+        sub = self.subscriptions.get(client)
+        if (sub is None):
+            return
+        buf = sub.buffer + data
+        *lines, sub.buffer = buf.split(b'\n')
+        for line in lines:
+            self.processCommand(client, sub, line.decode('utf-8', 'replace').split())
+
+    def processCommand(self, client: FanoutClient, sub: Subscription, cmd: list[str]):
+        if (not cmd):
+            return
+        args = [a for arg in cmd[1:] for a in arg.split(',') if a]
+        try:
+            match (cmd[0].lower()):
+                case 'fields':
+                    sub.fields = None if args in ([], ['*']) else frozenset(StatusType[a.upper()] for a in args)
+                    sub.since = 0
+                case 'ssrcs':
+                    sub.ssrcs = None if args in ([], ['*']) else frozenset(int(a) for a in args)
+                    sub.since = 0
+                case 'since':
+                    sub.since = int(args[0]) if args else 0
+                case _:
+                    self.log.debug(f"Client: [{client.address}] Ignoring command: [{' '.join(cmd)}]")
+        except (KeyError, ValueError) as e:
+            self.log.warning(f"Client: [{client.address}] Invalid command: [{' '.join(cmd)}] {e}")
+
+    def update(self, now: float) -> tuple[dict[int, set[StatusType]], list[int]]:
+        # Takes the changes since the last update as a new version, returns the changed fields and removed channels
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            gone = [ssrc for ssrc, t in self.seen.items() if now - t > self.expireAfter]
+            for ssrc in gone:
+                del self.seen[ssrc]
+                self.values.pop(ssrc, None)
+                dirty.pop(ssrc, None)
+            current = {}
+            for ssrc, fields in list(dirty.items()):
+                fields -= self.exclude
+                if (fields):
+                    current[ssrc] = {f: self.values[ssrc][f] for f in fields}
+                else:
+                    del dirty[ssrc]
+
+        if (not current) and (not gone):
+            return {}, []
+
+        self.version += 1
+        for ssrc, values in current.items():
+            encoded = self.encoded.setdefault(ssrc, {})
+            versions = self.versions.setdefault(ssrc, {})
+            self.removed.pop(ssrc, None)
+            for f, v in values.items():
+                try:
+                    encoded[f] = encode_status(b'', f, v)
+                except Exception as e:
+                    self.log.debug(f"SSRC: [{ssrc}] Unable to encode: [{f.name}] {e}")
+                    continue
+                versions[f] = self.version
+        for ssrc in gone:
+            self.encoded.pop(ssrc, None)
+            self.versions.pop(ssrc, None)
+            self.removed[ssrc] = self.version
+        return dirty, gone
+
+    def frame(self, kind: int, fromVersion: int, records: list[bytes]) -> bytes:
+        return FRAME_HEADER.pack(FRAME_MAGIC, kind, fromVersion, self.version, time.time(), len(records)) + b''.join(records)
+
+    def record(self, ssrc: int, fields, sub: Subscription) -> bytes | None:
+        encoded = self.encoded.get(ssrc)
+        if (not encoded):
+            return None
+        body = b''.join(encoded[f] for f in fields if f in encoded and (sub.fields is None or f in sub.fields))
+        return RECORD_HEADER.pack(ssrc, len(body)) + body if body else None
+
+    def snapshotFrame(self, sub: Subscription, since: int) -> bytes:
+        # Every field changed after 'since' (all of them for 0), O(channels) so only on connect / resync
+        if (since > self.version):
+            since = 0                               # Version from before a restart
+        records = []
+        for ssrc, versions in self.versions.items():
+            if (sub.ssrcs is None) or (ssrc in sub.ssrcs):
+                r = self.record(ssrc, [f for f, v in versions.items() if v > since], sub)
+                if (r):
+                    records.append(r)
+        if (since):
+            records += [RECORD_HEADER.pack(ssrc, 0) for ssrc, v in self.removed.items()
+                        if v > since and (sub.ssrcs is None or ssrc in sub.ssrcs)]
+        return self.frame(FRAME_SNAPSHOT if since == 0 else FRAME_DIFF, since, records)
+
+    def diffFrame(self, sub: Subscription, dirty: dict[int, set[StatusType]], gone: list[int]) -> bytes:
+        records = []
+        for ssrc, fields in dirty.items():
+            if (sub.ssrcs is None) or (ssrc in sub.ssrcs):
+                r = self.record(ssrc, fields, sub)
+                if (r):
+                    records.append(r)
+        records += [RECORD_HEADER.pack(ssrc, 0) for ssrc in gone if sub.ssrcs is None or ssrc in sub.ssrcs]
+        return self.frame(FRAME_DIFF, self.version - 1, records)
+
+    def publish(self, now: float):
+        fromVersion = self.version
+        dirty, gone = self.update(now)
+
+        # Clients with the same filters share the encoded diff
+        frames: dict[tuple, bytes] = {}
+        for client, sub in list(self.subscriptions.items()):
+            if (client.dropped != sub.dropped):
+                sub.dropped = client.dropped        # Diffs were lost, start again
+                sub.since = 0
+            since = sub.since
+            if (since is not None):
+                sub.since = None
+                client.enqueue(self.snapshotFrame(sub, since))
+            elif (self.version != fromVersion):
+                key = sub.key()
+                if (key not in frames):
+                    # Empty when nothing of interest changed, still sent to keep the client's version chain unbroken
+                    frames[key] = self.diffFrame(sub, dirty, gone)
+                client.enqueue(frames[key])
+
+    def publishHandler(self):
+        nextPublish = time.monotonic()
+        while self.publishRunning:
+            nextPublish += self.interval
+            delay = nextPublish - time.monotonic()
+            if (delay > 0):
+                time.sleep(delay)
+            else:
+                nextPublish = time.monotonic()
+            try:
+                self.publish(time.monotonic())
+            except Exception as e:
+                self.log.error(f"An error occurred publishing status diffs: {e}")
+
+    def start(self):
+        super().start()
+        self.publishRunning = True
+        self.publishThread = threading.Thread(target=self.publishHandler, daemon=True)
+        self.publishThread.start()
+
+    def stop(self):
+        self.publishRunning = False
+        if (self.publishThread):
+            self.publishThread.join(2)
+            self.publishThread = None
+        super().stop()
+
+
+class StatusDiffClient():
+    """Keeps a copy of the server's channel status by applying its snapshot / diff frames."""
+
+    log: logging.Logger
+
+    sock: socket.socket
+    buffer: bytes
+    version: int
+    resync: int | None                          # Version a resync was requested from
+    status: dict[int, dict[StatusType, Any]]    # Key: SSRC
+
+    def __init__(self, address: tuple[str, int] | str, timeout: float = 10.0):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(address)
+        else:
+            self.sock = socket.create_connection(address, timeout)
+        self.sock.settimeout(None)          # Frames only arrive when something changed
+        self.buffer = b''
+        self.version = 0
+        self.resync = None
+        self.status = {}
+
+    def send(self, cmd: str):
+        self.sock.sendall(cmd.encode() + b'\n')
+
+    def subscribe(self, fields: list[StatusType] | None = None, ssrcs: list[int] | None = None):
+        if (fields):
+            self.send('fields ' + ','.join(f.name for f in fields))
+        if (ssrcs):
+            self.send('ssrcs ' + ' '.join(str(s) for s in ssrcs))
+
+    def resume(self, version: int, status: dict[int, dict[StatusType, Any]]):
+        # Continue from a previous connection's state, only the changes after version are sent
+        self.status = status
+        self.version = version
+        self.resync = version
+        self.send(f"since {version}")
+
+    def recvExact(self, n: int) -> bytes:
+        while len(self.buffer) < n:
+            data = self.sock.recv(65536)
+            if (not data):
+                raise Exception("Status diff server closed the connection.")
+            self.buffer += data
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        return data
+
+    def receive(self) -> tuple[int, dict[int, dict[StatusType, Any] | None]]:
+        # Next frame applied to status, returns its kind and changes (None for a removed channel)
+        magic, kind, fromVersion, toVersion, t, count = FRAME_HEADER.unpack(self.recvExact(FRAME_HEADER.size))
+        if (magic != FRAME_MAGIC):
+            raise Exception(f"Invalid status diff frame: [{magic}]")
+
+        changes = {}
+        for _ in range(count):
+            ssrc, n = RECORD_HEADER.unpack(self.recvExact(RECORD_HEADER.size))
+            changes[ssrc] = parsePacket(self.recvExact(n)) if n else None
+
+        if (kind == FRAME_SNAPSHOT):
+            self.status = {}
+            self.resync = None
+        elif (fromVersion == self.resync):
+            self.resync = None
+        elif (fromVersion != self.version) and (self.resync is None):
+            self.log.warning(f"Missed status diffs: [{self.version}] -> [{fromVersion}], resyncing.")
+            self.send(f"since {self.version}")
+            self.resync = self.version
+        for ssrc, stat in changes.items():
+            if (stat is None):
+                self.status.pop(ssrc, None)
+            else:
+                self.status.setdefault(ssrc, {}).update(stat)
+        self.version = toVersion
+        return kind, changes
+
+    def close(self):
+        self.sock.close()
+
+
+def parseAddress(s: str) -> tuple[str, int] | str:
+    # Unix socket path, 'host:port' or 'port'
+    if ('/' in s):
+        return s
+    host, _, port = s.rpartition(':')
+    return (host or DEFAULT_STATUSDIFF_HOST, int(port))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio incremental status server")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_MCAST_GROUP, help="Multicast group name/ip for status.")
+    parser.add_argument("--address", type=str, default=f"{DEFAULT_STATUSDIFF_HOST}:{DEFAULT_STATUSDIFF_PORT}",
+                        help="Unix socket path, 'host:port' or 'port' to serve (or --connect to).")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="Seconds between diffs.")
+    parser.add_argument("--connect", action='store_true', help="Connect to a server and print the changes it sends.")
+    parser.add_argument("--fields", type=str, nargs='+', help="Fields (StatusType names) the client subscribes to.")
+    parser.add_argument("--ssrc", type=int, nargs='+', help="SSRCs the client subscribes to.")
+    args = parser.parse_args()
+
+    address = parseAddress(args.address)
+    if (args.connect):
+        client = StatusDiffClient(address)
+        client.subscribe([StatusType[n.upper()] for f in args.fields for n in f.split(',') if n] if args.fields else None, args.ssrc)
+        try:
+            while True:
+                kind, changes = client.receive()
+                print(f"{'Snapshot' if kind == FRAME_SNAPSHOT else 'Diff'}: [{client.version}]  Channels: [{len(changes)}]  Tracking: [{len(client.status)}]")
+                for ssrc, stat in changes.items():
+                    print(f"  SSRC: [{ssrc}] " + ('removed' if stat is None else ', '.join(f"{f.name}: {v}" for f, v in stat.items())))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            client.close()
+        return
+
+    from listener import Ka9qRadioStatusListener, MAX_DATAGRAM_SIZE
+
+    # Serves every channel, so don't drop status packets outside the usual size range
+    rs = Ka9qRadioStatusListener(args.mcast_group, minPacketSize=0, maxPacketSize=MAX_DATAGRAM_SIZE + 1)
+    server = rs.startDiffServer(address, args.interval)
+    rs.startHandler()
+    print(f"Status diffs serving on {server.address}, press Ctrl-C to exit...")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rs.stopDiffServer()
+        rs.stopHandler()
+
+
+if __name__ == "__main__":
+    main()
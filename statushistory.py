@@ -0,0 +1,316 @@
+import argparse
+import logging
+import numpy as np
+import os
+import shutil
+import threading
+import time
+
+from control import DEFAULT_MCAST_GROUP
+from status import StatusType, StatusTypeEncoding
+from typing import Any
+
+# Append only, columnar history of selected status fields per channel.
+#
+# Layout: <root>/<ssrc>/<segment start (unix secs)>/<field>.col, one file per field plus 't.col' (arrival time).
+# Every column is little endian float64, row N of each file is the same status packet (NaN where the packet
+# didn't carry the field), so a column is read with a single memory map and time ranges found by a binary
+# search of 't'. A new segment is started every 'segmentSeconds' and whole segments older than 'retention'
+# are deleted.
+#
+# The listener thread only appends a row to a per SSRC list, a flush thread writes each SSRC's rows every
+# 'flushInterval' seconds as one write per column.
+#
+#     history = rs.startRecording('/var/lib/ka9q/history')
+#     cols = history.query(ssrc, t0, t1, [StatusType.IF_POWER])    # {'t': ..., 'IF_POWER': ...}
+
+DEFAULT_FIELDS = [StatusType.RADIO_FREQUENCY, StatusType.IF_POWER, StatusType.BASEBAND_POWER,
+                  StatusType.NOISE_DENSITY, StatusType.AD_OVER, StatusType.FILTER_DROPS]
+DEFAULT_SEGMENT_SECONDS = 3600.0
+DEFAULT_RETENTION = 7 * 86400.0
+DEFAULT_FLUSH_INTERVAL = 5.0
+RETENTION_CHECK_INTERVAL = 60.0
+
+COLUMN_DTYPE = np.dtype('<f8')
+TIME_COLUMN = 't'
+COLUMN_SUFFIX = '.col'
+
+
+class Segment():
+    # One SSRC's current segment. Column files are only opened while appending, a file per column per
+    # channel held open would soon run out of descriptors with hundreds of channels.
+
+    path: str
+    start: float
+    end: float
+
+    def __init__(self, path: str, start: float, seconds: float, columns: list[str]):
+        self.path = path
+        self.start = start
+        self.end = start + seconds
+        os.makedirs(path, exist_ok=True)
+
+        # Reopening a segment (ie after a restart, maybe with other fields), every column is first brought
+        # to the time column's length so rows stay aligned
+        size = columnRows(self.columnPath(TIME_COLUMN)) * COLUMN_DTYPE.itemsize
+        for name in columns[1:]:
+            with open(self.columnPath(name), 'ab') as f:
+                if (f.tell() > size):
+                    f.truncate(size)
+                elif (f.tell() < size):
+                    f.write(np.full((size - f.tell()) // COLUMN_DTYPE.itemsize, np.nan, COLUMN_DTYPE).tobytes())
+
+    def columnPath(self, name: str) -> str:
+        return os.path.join(self.path, name + COLUMN_SUFFIX)
+
+    def append(self, block: np.ndarray, columns: list[str]):
+        # block: rows x columns, the time column first and so written last: a partial write never has
+        # 't' ahead of the other columns
+        data = block.T.astype(COLUMN_DTYPE, order='C')
+        for i in reversed(range(len(columns))):
+            fd = os.open(self.columnPath(columns[i]), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data[i].tobytes())
+            finally:
+                os.close(fd)
+
+
+def columnRows(path: str) -> int:
+    try:
+        return os.path.getsize(path) // COLUMN_DTYPE.itemsize
+    except OSError:
+        return 0
+
+def readColumn(path: str, rows: int) -> np.ndarray:
+    if (rows <= 0):
+        return np.empty(0, COLUMN_DTYPE)
+    return np.memmap(path, dtype=COLUMN_DTYPE, mode='r', shape=(rows,))
+
+
+class StatusHistory():
+
+    log: logging.Logger
+
+    root: str
+    fields: list[StatusType]
+    columns: list[str]                      # Time column then each field's name
+    segmentSeconds: float
+    retention: float
+    flushInterval: float
+
+    pending: dict[int, list[tuple]]         # Key: SSRC, rows not yet written
+    segments: dict[int, Segment]            # Key: SSRC, current segment
+    lock: threading.Lock
+    lastRetentionCheck: float
+    rowsWritten: int
+
+    running: bool
+    flushThread: threading.Thread | None
+
+    def __init__(self, root: str, fields: list[StatusType] = DEFAULT_FIELDS, segmentSeconds: float = DEFAULT_SEGMENT_SECONDS,
+                 retention: float = DEFAULT_RETENTION, flushInterval: float = DEFAULT_FLUSH_INTERVAL):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.root = root
+        self.fields = list(fields)
+        for f in self.fields:
+            if (StatusTypeEncoding[f.value][2] not in ('d', 'f', 'i', 'B')):
+                raise Exception(f"Status field: [{f.name}] is not numeric, it can't be recorded.")
+        self.columns = [TIME_COLUMN] + [f.name for f in self.fields]
+        self.segmentSeconds = segmentSeconds
+        self.retention = retention
+        self.flushInterval = flushInterval
+
+        self.pending = {}
+        self.segments = {}
+        self.lock = threading.Lock()
+        self.lastRetentionCheck = 0.0
+        self.rowsWritten = 0
+        self.running = False
+        self.flushThread = None
+
+        os.makedirs(root, exist_ok=True)
+
+    def onStatus(self, ssrc: int, stat: dict[StatusType, Any]):
+        # Listener thread, kept to building a tuple
+        row = (time.time(),) + tuple(stat.get(f, np.nan) for f in self.fields)
+        rows = self.pending.get(ssrc)
+        if (rows is None):
+            with self.lock:
+                rows = self.pending.setdefault(ssrc, [])
+        rows.append(row)
+
+    def segmentFor(self, ssrc: int, t: float) -> Segment:
+        seg = self.segments.get(ssrc)
+        if (seg is None) or (t >= seg.end) or (t < seg.start):
+            start = (t // self.segmentSeconds) * self.segmentSeconds
+            seg = Segment(os.path.join(self.root, str(ssrc), str(int(start))), start, self.segmentSeconds, self.columns)
+            self.segments[ssrc] = seg
+        return seg
+
+    def takePending(self, ssrc: int) -> list[tuple]:
+        # Removes the rows so far, rows appended meanwhile (listener thread) stay for the next flush.
+        # Slicing and deleting a list are each atomic, so no lock is needed on the append path.
+        rows = self.pending[ssrc]
+        n = len(rows)
+        taken = rows[:n]
+        del rows[:n]
+        return taken
+
+    def flush(self):
+        for ssrc in list(self.pending):
+            rows = self.takePending(ssrc)
+            if (not rows):
+                continue
+            block = np.array(rows, dtype=COLUMN_DTYPE)
+            # Rows crossing a segment boundary are split between the segments
+            while (len(block)):
+                seg = self.segmentFor(ssrc, block[0, 0])
+                n = int(np.searchsorted(block[:, 0], seg.end))
+                seg.append(block[:n], self.columns)
+                block = block[n:]
+            self.rowsWritten += len(rows)
+
+        now = time.time()
+        if (now - self.lastRetentionCheck > RETENTION_CHECK_INTERVAL):
+            self.lastRetentionCheck = now
+            self.expire(now)
+
+    def expire(self, now: float):
+        for ssrc, start, path in self.listSegments():
+            if (start + self.segmentSeconds < now - self.retention):
+                seg = self.segments.get(ssrc)
+                if (seg is not None) and (seg.path == path):
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                self.log.info(f"SSRC: [{ssrc}] Segment: [{start:.0f}] past retention, removed.")
+
+    def listSegments(self, ssrc: int | None = None) -> list[tuple[int, float, str]]:
+        # (ssrc, start, path) oldest first
+        res = []
+        for s in ([str(ssrc)] if ssrc is not None else os.listdir(self.root)):
+            d = os.path.join(self.root, s)
+            if (not s.isdigit()) or (not os.path.isdir(d)):
+                continue
+            for seg in os.listdir(d):
+                if (seg.isdigit()):
+                    res.append((int(s), float(seg), os.path.join(d, seg)))
+        return sorted(res, key=lambda r: r[1])
+
+    def ssrcs(self) -> list[int]:
+        return sorted(set(s for s, _, _ in self.listSegments()) | set(self.pending))
+
+    def query(self, ssrc: int, t0: float, t1: float, fields: list[StatusType] | None = None) -> dict[str, np.ndarray]:
+        # Rows with t0 <= t < t1, key: 't' and each field's name. Rows not yet flushed are included.
+        names = [TIME_COLUMN] + [f.name for f in (fields if fields is not None else self.fields)]
+        parts: dict[str, list[np.ndarray]] = {n: [] for n in names}
+
+        for _, start, path in self.listSegments(ssrc):
+            if (start >= t1) or (start + self.segmentSeconds <= t0):
+                continue
+            # Columns may be a partial write ahead of the time column, never use more rows than 't' has
+            rows = columnRows(os.path.join(path, TIME_COLUMN + COLUMN_SUFFIX))
+            t = readColumn(os.path.join(path, TIME_COLUMN + COLUMN_SUFFIX), rows)
+            lo, hi = int(np.searchsorted(t, t0)), int(np.searchsorted(t, t1))
+            if (hi <= lo):
+                continue
+            for n in names:
+                p = os.path.join(path, n + COLUMN_SUFFIX)
+                col = readColumn(p, min(rows, columnRows(p)))
+                if (len(col) >= hi):
+                    parts[n].append(np.array(col[lo:hi]))
+                else:
+                    # Field not recorded in this segment
+                    part = np.full(hi - lo, np.nan, COLUMN_DTYPE)
+                    part[:max(0, len(col) - lo)] = col[lo:]
+                    parts[n].append(part)
+
+        rows = list(self.pending.get(ssrc, []))
+        if (rows):
+            block = np.array(rows, dtype=COLUMN_DTYPE)
+            block = block[(block[:, 0] >= t0) & (block[:, 0] < t1)]
+            for n in names:
+                parts[n].append(block[:, self.columns.index(n)] if n in self.columns else np.full(len(block), np.nan, COLUMN_DTYPE))
+
+        return {n: np.concatenate(p) if p else np.empty(0, COLUMN_DTYPE) for n, p in parts.items()}
+
+    def flushHandler(self):
+        while self.running:
+            time.sleep(self.flushInterval)
+            try:
+                self.flush()
+            except Exception as ex:
+                self.log.error(f"Failed to write status history: {ex}")
+
+    def start(self):
+        self.running = True
+        self.flushThread = threading.Thread(target=self.flushHandler, daemon=True)
+        self.flushThread.start()
+
+    def stop(self):
+        self.running = False
+        if (self.flushThread):
+            self.flushThread.join(self.flushInterval + 1.0)
+            self.flushThread = None
+        self.flush()
+        self.segments = {}
+
+
+def parseFields(names: list[str] | None) -> list[StatusType]:
+    if (not names):
+        return DEFAULT_FIELDS
+    try:
+        return [StatusType[n.upper()] for part in names for n in part.split(',') if n]
+    except KeyError as ex:
+        raise Exception(f"Unknown status field: {ex}")
+
+def parseTime(s: str) -> float:
+    # Unix time, or negative seconds before now
+    t = float(s)
+    return time.time() + t if t <= 0 else t
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio channel status history")
+    parser.add_argument("dir", type=str, help="History directory.")
+    parser.add_argument("--record", type=str, nargs='?', const=DEFAULT_MCAST_GROUP, help="Record the multicast group's status (name/ip).")
+    parser.add_argument("--ssrc", type=int, nargs='+', help="SSRCs recorded / queried, default all.")
+    parser.add_argument("--fields", type=str, nargs='+', help="Status fields, ie IF_POWER,BASEBAND_POWER (default frequency, powers, A/D overs and filter drops).")
+    parser.add_argument("--segment", type=float, default=DEFAULT_SEGMENT_SECONDS, help="Seconds per segment.")
+    parser.add_argument("--retention", type=float, default=DEFAULT_RETENTION, help="Seconds segments are kept.")
+    parser.add_argument("--from", dest='t0', type=parseTime, default='-60', help="Query from, unix time or negative seconds before now.")
+    parser.add_argument("--to", dest='t1', type=parseTime, default='0', help="Query to, unix time or negative seconds before now.")
+    args = parser.parse_args()
+
+    fields = parseFields(args.fields)
+
+    if (args.record):
+        from listener import Ka9qRadioStatusListener
+
+        rs = Ka9qRadioStatusListener(args.record, args.ssrc or [])
+        history = rs.startRecording(args.dir, fields, args.segment, args.retention)
+        rs.startHandler()
+        try:
+            while True:
+                time.sleep(10)
+                history.log.info(f"Rows written: [{history.rowsWritten}]  Channels: [{len(history.segments)}]")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            rs.stopHandler()
+            rs.stopRecording()
+        return
+
+    history = StatusHistory(args.dir, fields, args.segment, args.retention)
+    for ssrc in (args.ssrc or history.ssrcs()):
+        cols = history.query(ssrc, args.t0, args.t1)
+        print(f"SSRC: [{ssrc}]  Rows: [{len(cols[TIME_COLUMN])}]")
+        for i in range(len(cols[TIME_COLUMN])):
+            print("  " + time.strftime('%H:%M:%S', time.localtime(cols[TIME_COLUMN][i])) +
+                  "".join(f"  {f.name}: [{cols[f.name][i]:.10g}]" for f in fields))
+
+
+if __name__ == "__main__":
+    main()
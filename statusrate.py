@@ -0,0 +1,221 @@
+import argparse
+import logging
+import metrics
+import threading
+import time
+
+from control import Ka9qRadioControl, DEFAULT_MCAST_GROUP
+from dataclasses import dataclass, field
+from listener import Ka9qRadioStatusListener
+from status import StatusType
+from typing import Any
+
+# Demand driven status rate. radiod sends a channel's status to its data group every STATUS_INTERVAL frames
+# (20ms each, 0 off). Rather than leaving that fixed for every channel, a channel is raised to the active
+# interval while it's in demand (rigctld clients polling it, a scan / Doppler job holding it) and dropped back
+# to the idle interval once nothing has asked for it for a while. The listener joins each raised channel's
+# data group so the extra status arrives with the rest.
+#
+#     rate = Ka9qStatusRateManager(rc, rs)
+#     rate.touch(ssrc)            # Per request, cheap when already active
+#     rate.hold(ssrc, 'scan')     # Active until released
+#     rate.release(ssrc, 'scan')
+
+DEFAULT_ACTIVE_INTERVAL = 5         # Frames, 10 status / sec
+DEFAULT_IDLE_INTERVAL = 0           # Off, only radiod's own status
+DEFAULT_IDLE_AFTER = 10.0           # Seconds without demand before a channel is dropped to idle
+DEFAULT_CHECK_INTERVAL = 1.0
+
+STATUS_RATE = metrics.Gauge('ka9q_status_packets_per_second', 'Status packets received per second', ('ssrc',))
+STATUS_INTERVAL_CHANGES = metrics.Counter('ka9q_status_interval_changes_total', 'STATUS_INTERVAL commands sent', ('level',))
+
+
+@dataclass
+class ChannelDemand:
+    ssrc: int
+    interval: int | None = None         # Last STATUS_INTERVAL sent, None never set
+    lastDemand: float = 0.0
+    holds: set[str] = field(default_factory=set)
+    joined: bool = False                # Listening on the channel's data group
+    packets: int = 0                    # Status packets since the last rate update
+    rate: float = 0.0                   # Status packets / sec
+
+
+class Ka9qStatusRateManager():
+
+    log: logging.Logger
+
+    ka9q_rc: Ka9qRadioControl
+    ka9q_rs: Ka9qRadioStatusListener
+
+    activeInterval: int
+    idleInterval: int
+    idleAfter: float
+
+    channels: dict[int, ChannelDemand]      # Key: SSRC
+    lock: threading.Lock
+    lastRateTime: float
+
+    running: bool
+    checkThread: threading.Thread | None
+
+    def __init__(self, ka9q_rc: Ka9qRadioControl, ka9q_rs: Ka9qRadioStatusListener,
+                 activeInterval: int = DEFAULT_ACTIVE_INTERVAL, idleInterval: int = DEFAULT_IDLE_INTERVAL,
+                 idleAfter: float = DEFAULT_IDLE_AFTER):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.ka9q_rc = ka9q_rc
+        self.ka9q_rs = ka9q_rs
+        self.activeInterval = activeInterval
+        self.idleInterval = idleInterval
+        self.idleAfter = idleAfter
+
+        self.channels = {}
+        self.lock = threading.Lock()
+        self.lastRateTime = time.monotonic()
+        self.running = False
+        self.checkThread = None
+
+        self.ka9q_rs.addStatusCallback(self.onStatus)
+
+    def channel(self, ssrc: int) -> ChannelDemand:
+        ch = self.channels.get(ssrc)
+        if (ch is None):
+            with self.lock:
+                ch = self.channels.setdefault(ssrc, ChannelDemand(ssrc))
+        return ch
+
+    def touch(self, ssrc: int):
+        # Demand for the channel now, ie a rigctld command for it
+        ch = self.channel(ssrc)
+        ch.lastDemand = time.monotonic()
+        if (ch.interval != self.activeInterval):
+            self.setInterval(ch, self.activeInterval)
+
+    def hold(self, ssrc: int, owner: str):
+        ch = self.channel(ssrc)
+        ch.holds.add(owner)
+        self.touch(ssrc)
+
+    def release(self, ssrc: int, owner: str):
+        ch = self.channels.get(ssrc)
+        if (ch is not None):
+            ch.holds.discard(owner)
+            ch.lastDemand = time.monotonic()
+
+    def setInterval(self, ch: ChannelDemand, interval: int):
+        if (interval > 0) and (not ch.joined):
+            self.joinDataGroup(ch, self.ka9q_rs.status.get(ch.ssrc))
+        ch.interval = interval
+        self.ka9q_rc.control_set(ch.ssrc, {StatusType.STATUS_INTERVAL: interval})
+        if (metrics.enabled):
+            STATUS_INTERVAL_CHANGES.labels('active' if interval == self.activeInterval else 'idle').inc()
+        self.log.debug("SSRC: [%s] STATUS_INTERVAL: [%s] frames", ch.ssrc, interval)
+
+    def joinDataGroup(self, ch: ChannelDemand, stat: dict[StatusType, Any] | None):
+        # Interval status is sent to the channel's data group
+        dest = stat.get(StatusType.OUTPUT_DATA_DEST_SOCKET) if stat else None
+        if (dest) and (dest.get('addr')):
+            self.ka9q_rs.joinGroup(dest['addr'])
+            ch.joined = True
+
+    def onStatus(self, ssrc: int, stat: dict[StatusType, Any]):
+        ch = self.channels.get(ssrc)
+        if (ch is not None):
+            ch.packets += 1
+            if (ch.interval) and (not ch.joined):
+                self.joinDataGroup(ch, stat)
+
+    def check(self, now: float):
+        # Drops channels nothing has asked for lately to idle, and updates the per SSRC status rates
+        for ch in list(self.channels.values()):
+            if (ch.interval == self.activeInterval) and (not ch.holds) and (now - ch.lastDemand > self.idleAfter):
+                self.setInterval(ch, self.idleInterval)
+
+        elapsed = now - self.lastRateTime
+        if (elapsed > 0):
+            for ch in list(self.channels.values()):
+                ch.rate = ch.packets / elapsed
+                ch.packets = 0
+                if (metrics.enabled):
+                    STATUS_RATE.labels(ch.ssrc).set(ch.rate)
+            self.lastRateTime = now
+
+    def rates(self) -> dict[int, float]:
+        return {ch.ssrc: ch.rate for ch in list(self.channels.values())}
+
+    def isActive(self, ssrc: int) -> bool:
+        ch = self.channels.get(ssrc)
+        return (ch is not None) and (ch.interval == self.activeInterval)
+
+    def report(self) -> str:
+        return ', '.join(f"[{ch.ssrc}] {'active' if ch.interval == self.activeInterval else 'idle'} {ch.rate:.1f}/s"
+                         for ch in sorted(list(self.channels.values()), key=lambda c: c.ssrc))
+
+    def checkHandler(self):
+        while self.running:
+            time.sleep(DEFAULT_CHECK_INTERVAL)
+            self.check(time.monotonic())
+
+    def start(self):
+        self.running = True
+        self.checkThread = threading.Thread(target=self.checkHandler, daemon=True)
+        self.checkThread.start()
+
+    def stop(self, restore: bool = True):
+        self.running = False
+        if (self.checkThread):
+            self.checkThread.join(2)
+            self.checkThread = None
+        self.ka9q_rs.removeStatusCallback(self.onStatus)
+        if (restore):
+            for ch in list(self.channels.values()):
+                if (ch.interval not in (None, self.idleInterval)):
+                    self.setInterval(ch, self.idleInterval)
+
+
+def addArguments(parser):
+    parser.add_argument("--status-active", type=int, default=DEFAULT_ACTIVE_INTERVAL, help="STATUS_INTERVAL (frames) while a channel is in demand.")
+    parser.add_argument("--status-idle", type=int, default=DEFAULT_IDLE_INTERVAL, help="STATUS_INTERVAL (frames) once a channel is idle.")
+    parser.add_argument("--status-idle-after", type=float, default=DEFAULT_IDLE_AFTER, help="Seconds without demand before a channel is idle.")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio demand driven status rate")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_MCAST_GROUP, help="Multicast group name/ip for control / status.")
+    parser.add_argument("ssrcs", type=int, nargs='+', help="SSRCs to raise the status rate of (for --seconds), then left to go idle.")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Seconds the channels are held active.")
+    addArguments(parser)
+    args = parser.parse_args()
+
+    rc = Ka9qRadioControl(args.mcast_group)
+    rs = Ka9qRadioStatusListener(args.mcast_group, list(args.ssrcs))
+    rs.startHandler()
+    for ssrc in args.ssrcs:
+        rs.poll(rc, ssrc)
+
+    rate = Ka9qStatusRateManager(rc, rs, args.status_active, args.status_idle, args.status_idle_after)
+    rate.start()
+    for ssrc in args.ssrcs:
+        rate.hold(ssrc, 'cli')
+    held = time.monotonic()
+    try:
+        while True:
+            time.sleep(2)
+            if (held) and (time.monotonic() - held > args.seconds):
+                for ssrc in args.ssrcs:
+                    rate.release(ssrc, 'cli')
+                held = 0
+            rate.log.info(rate.report())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rate.stop()
+        rs.stopHandler()
+        rc.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import logging
+import numpy as np
+import threading
+import time
+
+from control import DEFAULT_MCAST_GROUP
+from dataclasses import dataclass
+from status import StatusType
+from typing import Any
+
+# Recent history of numeric status fields per channel, in fixed size ring buffers, so meters and health
+# checks can ask for the last N seconds without keeping or scanning old status dicts.
+#
+# Each (SSRC, field) has a ring of (monotonic time, value) of the field's configured capacity, so memory is
+# bounded by channels x sum(capacities) x 16 bytes. The least recently updated channel is dropped once
+# 'maxChannels' are tracked. Statistics over a time window are computed with NumPy over the ring.
+#
+#     series = rs.startSeries()
+#     series.stats(ssrc, StatusType.BASEBAND_POWER, 60.0)        # count / min / max / mean / percentiles
+#     series.lastChange(ssrc, StatusType.RADIO_FREQUENCY)        # Retuned when (monotonic)
+
+DEFAULT_CAPACITIES = {
+    StatusType.RADIO_FREQUENCY: 600,
+    StatusType.IF_POWER: 1200,
+    StatusType.BASEBAND_POWER: 1200,        # 2 minutes at 10 status / sec
+    StatusType.NOISE_DENSITY: 1200,
+    StatusType.AD_OVER: 600,
+    StatusType.FILTER_DROPS: 600,
+}
+DEFAULT_MAX_CHANNELS = 256
+DEFAULT_PERCENTILES = (50.0, 90.0)
+DEFAULT_HEALTH_WINDOW = 10.0
+
+
+@dataclass
+class WindowStats:
+    count: int
+    min: float
+    max: float
+    mean: float
+    percentiles: dict[float, float]
+    first: float                # Oldest sample's time in the window (monotonic)
+    last: float                 # Newest
+
+
+class Ring():
+    # (time, value) ring. Written by the listener thread only, readers may see a slot mid overwrite,
+    # the value is written before its time so that slot is at worst briefly out of its window.
+
+    __slots__ = ('t', 'v', 'n', 'pos', 'lastValue', 'lastChange')
+
+    def __init__(self, capacity: int):
+        self.t = np.full(capacity, -np.inf)
+        self.v = np.zeros(capacity)
+        self.n = 0                  # Samples ever written
+        self.pos = 0
+        self.lastValue = None
+        self.lastChange = None      # Time the value last differed from the one before
+
+    def append(self, t: float, v: float):
+        if (v != self.lastValue):
+            if (self.lastValue is not None):
+                self.lastChange = t
+            self.lastValue = v
+        i = self.pos
+        self.v[i] = v
+        self.t[i] = t
+        self.pos = i + 1 if i + 1 < len(self.t) else 0
+        self.n += 1
+
+    def window(self, t0: float) -> tuple[np.ndarray, np.ndarray]:
+        # Samples with time >= t0, oldest first
+        order = np.roll(np.arange(len(self.t)), -self.pos)
+        t = self.t[order]
+        sel = t >= t0
+        return t[sel], self.v[order][sel]
+
+
+class StatusSeries():
+
+    log: logging.Logger
+
+    capacities: dict[StatusType, int]
+    maxChannels: int
+    channels: dict[int, dict[StatusType, Ring]]     # Key: SSRC
+    updated: dict[int, float]                       # Key: SSRC, last status time
+    lock: threading.Lock
+
+    def __init__(self, capacities: dict[StatusType, int] = DEFAULT_CAPACITIES, maxChannels: int = DEFAULT_MAX_CHANNELS):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.capacities = dict(capacities)
+        self.maxChannels = maxChannels
+        self.channels = {}
+        self.updated = {}
+        self.lock = threading.Lock()
+
+    def memoryBytes(self) -> int:
+        # Upper bound once maxChannels are tracked
+        return self.maxChannels * sum(self.capacities.values()) * 16
+
+    def addChannel(self, ssrc: int) -> dict[StatusType, Ring]:
+        with self.lock:
+            if (len(self.channels) >= self.maxChannels):
+                oldest = min(self.updated, key=self.updated.get)
+                self.channels.pop(oldest, None)
+                self.updated.pop(oldest, None)
+                self.log.debug("SSRC: [%s] Dropped, tracking the maximum [%s] channels.", oldest, self.maxChannels)
+            rings = self.channels[ssrc] = {f: Ring(n) for f, n in self.capacities.items()}
+        return rings
+
+    def onStatus(self, ssrc: int, stat: dict[StatusType, Any]):
+        # Listener thread
+        rings = self.channels.get(ssrc)
+        if (rings is None):
+            rings = self.addChannel(ssrc)
+        t = time.monotonic()
+        self.updated[ssrc] = t
+        for f, ring in rings.items():
+            v = stat.get(f)
+            if (v is not None):
+                ring.append(t, v)
+
+    def ring(self, ssrc: int, field: StatusType) -> Ring | None:
+        rings = self.channels.get(ssrc)
+        return rings.get(field) if rings else None
+
+    def values(self, ssrc: int, field: StatusType, window: float, now: float | None = None) -> tuple[np.ndarray, np.ndarray]:
+        # (times, values) over the last 'window' seconds, oldest first
+        ring = self.ring(ssrc, field)
+        if (ring is None):
+            return np.empty(0), np.empty(0)
+        return ring.window((now if now is not None else time.monotonic()) - window)
+
+    def stats(self, ssrc: int, field: StatusType, window: float, percentiles: tuple[float, ...] = DEFAULT_PERCENTILES,
+              now: float | None = None) -> WindowStats | None:
+        t, v = self.values(ssrc, field, window, now)
+        if (len(v) == 0):
+            return None
+        pv = np.percentile(v, percentiles) if percentiles else []
+        return WindowStats(len(v), float(v.min()), float(v.max()), float(v.mean()),
+                           {p: float(x) for p, x in zip(percentiles, pv)}, float(t[0]), float(t[-1]))
+
+    def mean(self, ssrc: int, field: StatusType, window: float) -> float | None:
+        _, v = self.values(ssrc, field, window)
+        return float(v.mean()) if len(v) else None
+
+    def increase(self, ssrc: int, field: StatusType, window: float) -> float | None:
+        # Counter increase over the window (ie AD_OVER, FILTER_DROPS), None without two samples
+        _, v = self.values(ssrc, field, window)
+        return float(v[-1] - v[0]) if len(v) > 1 else None
+
+    def lastChange(self, ssrc: int, field: StatusType) -> float | None:
+        # Time (monotonic) the field's value last changed, ie a retune for RADIO_FREQUENCY
+        ring = self.ring(ssrc, field)
+        return ring.lastChange if ring else None
+
+    def changedWithin(self, ssrc: int, field: StatusType, window: float) -> bool:
+        t = self.lastChange(ssrc, field)
+        return (t is not None) and (time.monotonic() - t <= window)
+
+    def health(self, ssrc: int, window: float = DEFAULT_HEALTH_WINDOW) -> dict[str, Any] | None:
+        # Summary for health checks: status rate and age, A/D overs, filter drops, recent retune
+        updated = self.updated.get(ssrc)
+        if (updated is None):
+            return None
+        now = time.monotonic()
+        t, _ = self.values(ssrc, next(iter(self.capacities)), window, now) if self.capacities else (np.empty(0), None)
+        return {
+            'age': now - updated,
+            'rate': len(t) / window,
+            'ad_overs': self.increase(ssrc, StatusType.AD_OVER, window),
+            'filter_drops': self.increase(ssrc, StatusType.FILTER_DROPS, window),
+            'retuned': self.changedWithin(ssrc, StatusType.RADIO_FREQUENCY, window),
+        }
+
+    def ssrcs(self) -> list[int]:
+        return sorted(self.channels)
+
+    def remove(self, ssrc: int):
+        with self.lock:
+            self.channels.pop(ssrc, None)
+            self.updated.pop(ssrc, None)
+
+
+def parseCapacities(specs: list[str] | None, default: int | None = None) -> dict[StatusType, int]:
+    # 'FIELD' (default capacity) or 'FIELD:samples' entries
+    if (not specs):
+        return DEFAULT_CAPACITIES
+    res = {}
+    for spec in specs:
+        for part in spec.split(','):
+            if (not part):
+                continue
+            name, _, n = part.partition(':')
+            try:
+                f = StatusType[name.upper()]
+            except KeyError:
+                raise Exception(f"Unknown status field: [{name}]")
+            res[f] = int(n) if n else (default or DEFAULT_CAPACITIES.get(f, 600))
+    return res
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="KA9Q Radio recent status statistics")
+    parser.add_argument("mcast_group", type=str, nargs='?', default=DEFAULT_MCAST_GROUP, help="Multicast group name/ip for status.")
+    parser.add_argument("ssrcs", type=int, nargs='*', help="SSRCs to track, default all.")
+    parser.add_argument("--fields", type=str, nargs='+', help="'FIELD[:samples]' entries (default frequency, powers, A/D overs, filter drops).")
+    parser.add_argument("--window", type=float, default=DEFAULT_HEALTH_WINDOW, help="Seconds the statistics are over.")
+    args = parser.parse_args()
+
+    from listener import Ka9qRadioStatusListener
+
+    rs = Ka9qRadioStatusListener(args.mcast_group, args.ssrcs)
+    series = rs.startSeries(parseCapacities(args.fields))
+    rs.startHandler()
+    series.log.info(f"Memory bound: [{series.memoryBytes() / 1e6:.1f}MB]")
+    try:
+        while True:
+            time.sleep(args.window)
+            for ssrc in series.ssrcs():
+                h = series.health(ssrc, args.window)
+                if (h is None):
+                    continue    # Evicted / removed since ssrcs()
+                line = f"SSRC: [{ssrc}] rate: [{h['rate']:.1f}/s] retuned: [{h['retuned']}] A/D overs: [{h['ad_overs']}]"
+                for f in series.capacities:
+                    s = series.stats(ssrc, f, args.window)
+                    if (s):
+                        line += f"  {f.name}: [{s.mean:.10g} ({s.min:.10g} - {s.max:.10g})]"
+                print(line)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rs.stopHandler()
+
+
+if __name__ == "__main__":
+    main()
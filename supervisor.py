@@ -0,0 +1,368 @@
+import dataclasses
+import logging
+import metrics
+import os
+import subprocess
+import threading
+import time
+
+from dataclasses import dataclass
+from listener import Ka9qRadioStatusListener
+from status import Encoding, StatusType
+from typing import Any, Callable
+
+DEFAULT_CHECK_INTERVAL = 0.1     # Seconds between health checks
+DEFAULT_STALL_TIMEOUT = 0.5      # No output for this long, while radiod is sending, is a dropout
+DEFAULT_BACKOFF_INITIAL = 0.1    # First restart is immediate, subsequent ones back off from here
+DEFAULT_BACKOFF_MAX = 5.0
+DEFAULT_STABLE_TIME = 10.0       # Healthy for this long resets the backoff
+
+MAX_RECOVERY_HISTORY = 100
+
+AUDIO_UNDERRUNS = metrics.Counter('ka9q_audio_underruns_total', 'Audio dropouts (stage died or stalled while radiod was sending)', ('ssrc',))
+AUDIO_RESTARTS = metrics.Counter('ka9q_audio_restarts_total', 'Audio stage restarts', ('ssrc',))
+
+@dataclass(frozen=True)
+class AudioStageConfig:
+    # Everything from the channel's status the audio stage is built from, a change requires a rebuild.
+    ssrc: int
+    rtp_ip: str
+    rtp_port: int
+    samprate: int
+    encoding: int
+    channels: int
+
+
+class PcmRecordAudioStage():
+    """pcmrecord -> sox pipeline, with pcmrecord's output pumped through this process so throughput can be watched."""
+
+    log: logging.Logger
+
+    config: AudioStageConfig
+    audio_device: str
+
+    sourceProcess: subprocess.Popen | None
+    sinkProcess: subprocess.Popen | None
+    pumpThread: threading.Thread | None
+    bytesOut: int
+    packets: int | None      # RTP packets are not visible to us, pcmrecord receives them
+
+    def __init__(self, config: AudioStageConfig, audio_device: str):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.config = config
+        self.audio_device = audio_device
+        self.sourceProcess = None
+        self.sinkProcess = None
+        self.pumpThread = None
+        self.bytesOut = 0
+        self.packets = None
+
+    def start(self):
+        cfg = self.config
+        sink = ["sox", "-t", "raw", "-c", str(cfg.channels), "-r", str(cfg.samprate), "-b", "16", "-e", "signed", "-",
+                "-t", "pulseaudio", self.audio_device]
+        source = ["pcmrecord", "-c", "-r", "-S", str(cfg.ssrc), cfg.rtp_ip]
+
+        self.sinkProcess = subprocess.Popen(sink, stdin=subprocess.PIPE, preexec_fn=os.setsid)
+        self.sourceProcess = subprocess.Popen(source, stdout=subprocess.PIPE, preexec_fn=os.setsid)
+        self.log.info(f"SSRC: [{cfg.ssrc}] Audio pipeline started  pcmrecord PID: [{self.sourceProcess.pid}]  sox PID: [{self.sinkProcess.pid}]")
+
+        self.pumpThread = threading.Thread(target=self.pumpHandler, daemon=True)
+        self.pumpThread.start()
+
+    def pumpHandler(self):
+        src = self.sourceProcess.stdout
+        dst = self.sinkProcess.stdin
+        try:
+            while True:
+                data = src.read1(65536)
+                if (not data):
+                    break
+                dst.write(data)
+                dst.flush()
+                self.bytesOut += len(data)
+        except (OSError, ValueError):
+            pass
+
+    def isAlive(self) -> bool:
+        return (self.sourceProcess is not None) and (self.sourceProcess.poll() is None) and \
+               (self.sinkProcess.poll() is None) and self.pumpThread.is_alive()
+
+    def close(self):
+        for p in (self.sourceProcess, self.sinkProcess):
+            if (p) and (p.poll() is None):
+                p.kill()
+                try:
+                    p.wait(1)
+                except subprocess.TimeoutExpired:
+                    self.log.error(f"Process with PID {p.pid} did not exit.")
+        if (self.pumpThread):
+            self.pumpThread.join(1)
+        self.sourceProcess = None
+        self.sinkProcess = None
+
+
+class AudioPipelineSupervisor():
+    """Watches the audio stage (child exit, output throughput, RTP / radiod packet rate) and restarts it with
+    backoff when it dies or stalls, rebuilding it when the channel's output rate or RTP destination changes.
+
+    A stage is any object with start(), close(), isAlive(), bytesOut and packets (RTP packets received, or None).
+    Stages that also have setSsrc(ssrc) can follow another channel on the same RTP group and format in place.
+    """
+
+    log: logging.Logger
+
+    ka9q_rs: Ka9qRadioStatusListener
+    ssrc: int
+    stageFactory: Callable[[AudioStageConfig], Any]
+
+    checkInterval: float
+    stallTimeout: float
+    backoffInitial: float
+    backoffMax: float
+    stableTime: float
+
+    stage: Any | None
+    stageConfig: AudioStageConfig | None
+    backoff: float
+    nextStartTime: float
+    stageStarted: float
+
+    lastBytes: int
+    lastProgress: float
+    lastPackets: int
+    lastPacketTime: float
+    lastUpstreamCount: int | None
+    upstreamChange: float
+
+    # Metrics
+    restarts: int
+    rebuilds: int
+    dropouts: int
+    dropoutTotal: float           # Seconds of silence caused by dropouts
+    recoveryTimes: list[float]    # Seconds from detection to audio flowing again
+    dropoutStart: float | None
+    dropoutDetected: float | None
+
+    running: bool
+    lock: threading.Lock          # check() (supervisor thread) vs setSsrc() (ie the Hamlib server thread)
+    stopEvent: threading.Event
+    supervisorThread: threading.Thread | None
+
+    def __init__(self, ka9q_rs: Ka9qRadioStatusListener, ssrc: int, stageFactory: Callable[[AudioStageConfig], Any],
+                 checkInterval: float = DEFAULT_CHECK_INTERVAL, stallTimeout: float = DEFAULT_STALL_TIMEOUT,
+                 backoffInitial: float = DEFAULT_BACKOFF_INITIAL, backoffMax: float = DEFAULT_BACKOFF_MAX,
+                 stableTime: float = DEFAULT_STABLE_TIME):
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        self.ka9q_rs = ka9q_rs
+        self.ssrc = ssrc
+        self.stageFactory = stageFactory
+        self.checkInterval = checkInterval
+        self.stallTimeout = stallTimeout
+        self.backoffInitial = backoffInitial
+        self.backoffMax = backoffMax
+        self.stableTime = stableTime
+
+        self.stage = None
+        self.stageConfig = None
+        self.backoff = 0.0
+        self.nextStartTime = 0.0
+
+        self.restarts = 0
+        self.rebuilds = 0
+        self.dropouts = 0
+        self.dropoutTotal = 0.0
+        self.recoveryTimes = []
+        self.dropoutStart = None
+        self.dropoutDetected = None
+
+        self.running = False
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.supervisorThread = None
+
+    def currentConfig(self) -> AudioStageConfig | None:
+        s = self.ka9q_rs.status.get(self.ssrc)
+        if (not s):
+            return None
+        sockinfo = s.get(StatusType.OUTPUT_DATA_DEST_SOCKET)
+        if (not sockinfo):
+            return None
+        return AudioStageConfig(ssrc=self.ssrc, rtp_ip=sockinfo['addr'], rtp_port=sockinfo['port'],
+                                samprate=s.get(StatusType.OUTPUT_SAMPRATE, 0),
+                                encoding=s.get(StatusType.OUTPUT_ENCODING, Encoding.S16BE.value),
+                                channels=s.get(StatusType.OUTPUT_CHANNELS, 1) or 1)
+
+    def upstreamCount(self) -> int | None:
+        # Packets radiod reports having sent for the channel
+        s = self.ka9q_rs.status.get(self.ssrc)
+        return s.get(StatusType.OUTPUT_DATA_PACKETS) if s else None
+
+    def startStage(self, cfg: AudioStageConfig, now: float):
+        try:
+            stage = self.stageFactory(cfg)
+            stage.start()
+        except Exception as e:
+            self.log.error(f"SSRC: [{cfg.ssrc}] Failed to start audio stage: {e}")
+            self.scheduleRestart(now)
+            return
+
+        self.stage = stage
+        self.stageConfig = cfg
+        self.stageStarted = now
+        self.lastBytes = stage.bytesOut
+        self.lastProgress = now
+        self.lastPackets = stage.packets or 0
+        self.lastPacketTime = now
+        self.lastUpstreamCount = self.upstreamCount()
+        self.upstreamChange = now
+
+    def stopStage(self):
+        if (self.stage):
+            try:
+                self.stage.close()
+            except Exception as e:
+                self.log.error(f"SSRC: [{self.ssrc}] Error stopping audio stage: {e}")
+            self.stage = None
+
+    def scheduleRestart(self, now: float):
+        self.nextStartTime = now + self.backoff
+        self.backoff = min(max(self.backoff * 2, self.backoffInitial), self.backoffMax)
+
+    def fail(self, reason: str, now: float):
+        if (self.dropoutStart is None):
+            self.dropoutStart = self.lastProgress
+            self.dropoutDetected = now
+            self.dropouts += 1
+            if (metrics.enabled):
+                AUDIO_UNDERRUNS.labels(self.ssrc).inc()
+        self.log.warning(f"SSRC: [{self.ssrc}] Audio stage {reason}, restarting in [{self.backoff:.2f}s]  Dropouts: [{self.dropouts}]")
+        self.stopStage()
+        self.restarts += 1
+        if (metrics.enabled):
+            AUDIO_RESTARTS.labels(self.ssrc).inc()
+        self.scheduleRestart(now)
+
+    def restart(self, reason: str):
+        # External trigger (ie radiod restarted), rebuilds the stage straight away rather than waiting for a stall
+        with self.lock:
+            now = time.monotonic()
+            if (self.stage):
+                self.fail(reason, now)
+            self.nextStartTime = now
+
+    def recovered(self, now: float):
+        duration = now - self.dropoutStart
+        ttr = now - self.dropoutDetected
+        self.dropoutTotal += duration
+        self.recoveryTimes.append(ttr)
+        if (len(self.recoveryTimes) > MAX_RECOVERY_HISTORY):
+            self.recoveryTimes.pop(0)
+        self.log.info(f"SSRC: [{self.ssrc}] Audio recovered  Dropout: [{duration:.3f}s]  Time to recover: [{ttr:.3f}s]")
+        self.dropoutStart = None
+        self.dropoutDetected = None
+
+    def check(self, now: float):
+        cfg = self.currentConfig()
+
+        if (self.stage is None):
+            if (cfg) and (now >= self.nextStartTime):
+                self.startStage(cfg, now)
+            return
+
+        if (cfg) and (cfg != self.stageConfig):
+            self.log.info(f"SSRC: [{self.ssrc}] Channel output changed, rebuilding audio stage: [{self.stageConfig}] -> [{cfg}]")
+            self.rebuilds += 1
+            self.stopStage()
+            self.startStage(cfg, now)
+            return
+
+        stage = self.stage
+        if (stage.bytesOut != self.lastBytes):
+            self.lastBytes = stage.bytesOut
+            self.lastProgress = now
+            if (self.dropoutStart is not None):
+                self.recovered(now)
+
+        if (self.backoff > 0) and (self.dropoutStart is None) and (now - self.stageStarted > self.stableTime):
+            self.backoff = 0.0
+
+        # Is anything arriving that should have produced output ?
+        if (stage.packets is not None):
+            if (stage.packets != self.lastPackets):
+                self.lastPackets = stage.packets
+                self.lastPacketTime = now
+            upstream = self.lastPacketTime
+        else:
+            count = self.upstreamCount()
+            if (count != self.lastUpstreamCount):
+                self.lastUpstreamCount = count
+                self.upstreamChange = now
+            upstream = self.upstreamChange
+
+        if (not stage.isAlive()):
+            self.fail("exited", now)
+        elif (now - self.lastProgress > self.stallTimeout) and (upstream > self.lastProgress):
+            self.fail("stalled", now)
+
+    def supervisorHandler(self):
+        while not self.stopEvent.wait(self.checkInterval):
+            try:
+                with self.lock:
+                    self.check(time.monotonic())
+            except Exception as e:
+                self.log.error(f"SSRC: [{self.ssrc}] An error occurred supervising audio stage: {e}")
+
+    def setSsrc(self, ssrc: int):
+        # Following a different channel (ie VFO A / B). Done now rather than on the next check: a stage able to
+        # switch in place does so without restarting the sink, otherwise the stage is rebuilt.
+        with self.lock:
+            if (ssrc == self.ssrc):
+                return
+            self.ssrc = ssrc
+            cfg = self.currentConfig()
+            if (self.stage is None) or (cfg is None):
+                return      # Started / rebuilt by check() once the channel's status arrives
+
+            now = time.monotonic()
+            if (hasattr(self.stage, 'setSsrc')) and (dataclasses.replace(self.stageConfig, ssrc=ssrc) == cfg):
+                self.stage.setSsrc(ssrc)
+                self.stageConfig = cfg
+                self.lastUpstreamCount = self.upstreamCount()
+                self.upstreamChange = now
+                self.log.info(f"SSRC: [{ssrc}] Audio stage switched channel in place.")
+                return
+
+            self.rebuilds += 1
+            self.stopStage()
+            self.startStage(cfg, now)
+
+    def getMetrics(self) -> dict[str, Any]:
+        return {
+            'restarts': self.restarts,
+            'rebuilds': self.rebuilds,
+            'dropouts': self.dropouts,
+            'dropout_seconds': self.dropoutTotal,
+            'last_recovery_seconds': self.recoveryTimes[-1] if self.recoveryTimes else None,
+            'max_recovery_seconds': max(self.recoveryTimes) if self.recoveryTimes else None,
+            'in_dropout': self.dropoutStart is not None,
+        }
+
+    def start(self):
+        self.stopEvent.clear()
+        self.running = True
+        with self.lock:
+            self.check(time.monotonic())
+        self.supervisorThread = threading.Thread(target=self.supervisorHandler, daemon=True)
+        self.supervisorThread.start()
+
+    def stop(self):
+        self.running = False
+        self.stopEvent.set()
+        if (self.supervisorThread):
+            self.supervisorThread.join(2)
+            self.supervisorThread = None
+        self.stopStage()
+        self.log.info(f"SSRC: [{self.ssrc}] Audio supervisor stopped. Metrics: {self.getMetrics()}")
@@ -0,0 +1,339 @@
+import collections
+import functools
+import io
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+# Opt-in tracing and profiling hooks for the packet and command paths.
+#
+# Enable with the KA9Q_TRACE environment variable (or --trace on the command line), its value being the
+# fraction of spans timed, ie KA9Q_TRACE=0.01 times 1 in 100. Set KA9Q_TRACE_MALLOC=1 (--trace-malloc) to
+# also track allocations with tracemalloc. Once enabled:
+#
+#   kill -USR1 <pid>    Logs the per span timing summary (and a tracemalloc diff since the last dump)
+#   kill -USR2 <pid>    Profiles the instrumented threads with cProfile for KA9Q_PROFILE_SECONDS (10),
+#                       then logs the top functions and saves the stats to ka9q-profile-<pid>-<time>.prof
+#
+# Spans are timed inline on hot paths:
+#
+#     t = tracing.start() if tracing.enabled else 0
+#     ...
+#     if (t): tracing.finish('listener.packet', t)
+#
+# or with the @traced(name) decorator elsewhere. While disabled both cost a single flag check.
+#
+# cProfile, pstats and tracemalloc are only imported once they're used, keeping them off every tool's startup.
+
+log = logging.getLogger(__name__)
+
+enabled = False
+sampleEvery = 1                   # Time 1 in N spans
+mallocTracing = False
+
+DEFAULT_PROFILE_SECONDS = 10.0
+DEFAULT_PROFILE_GRACE = 10.0      # Seconds after the window for threads to disenrol before the profile is saved
+GLOBAL_PROFILER = sys.version_info >= (3, 12)     # cProfile uses sys.monitoring, one profiler sees every thread
+MAX_SPAN_SAMPLES = 2048           # Recent durations kept per span for percentiles
+TRACEMALLOC_FRAMES = 5
+REPORT_TOP = 25
+
+_counter = 0
+_lock = threading.Lock()
+_lastSnapshot = None
+
+
+class SpanStats():
+
+    count: int
+    totalNs: int
+    maxNs: int
+    recent: collections.deque
+
+    def __init__(self):
+        self.count = 0
+        self.totalNs = 0
+        self.maxNs = 0
+        self.recent = collections.deque(maxlen=MAX_SPAN_SAMPLES)
+
+    def add(self, ns: int):
+        self.count += 1
+        self.totalNs += ns
+        if (ns > self.maxNs):
+            self.maxNs = ns
+        self.recent.append(ns)
+
+    def percentile(self, q: float) -> float:
+        s = sorted(self.recent)
+        return s[min(len(s) - 1, int(q * len(s)))] if s else 0
+
+
+spans: dict[str, SpanStats] = {}
+
+
+class ProfileWindow():
+    """Before Python 3.12 cProfile only profiles the thread that enabled it, so each instrumented thread
+    enrols itself from its next span while the window is open and disables its own profiler (writing its
+    stats back) on its first span after it has closed. From 3.12 a single profiler covers every thread
+    and is enabled / disabled centrally."""
+
+    until: float
+    profiler: 'cProfile.Profile | None'         # The one profiler (3.12+), None when per thread
+    profiles: dict[int, 'cProfile.Profile']
+    stats: list['pstats.Stats']
+    lock: threading.Lock
+
+    def __init__(self, seconds: float):
+        self.until = time.monotonic() + seconds
+        self.profiler = None
+        self.profiles = {}
+        self.stats = []
+        self.lock = threading.Lock()
+        if (GLOBAL_PROFILER):
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def close(self):
+        # Central stop, only possible with the one profiler
+        import pstats
+        if (self.profiler is not None):
+            self.profiler.disable()
+            with self.lock:
+                self.stats.append(pstats.Stats(self.profiler))
+
+    def hook(self):
+        global _profile
+        if (self.profiler is not None):
+            return
+        tid = threading.get_ident()
+        prof = self.profiles.get(tid)
+        if (time.monotonic() < self.until):
+            if (prof is None):
+                import cProfile
+                prof = cProfile.Profile()
+                with self.lock:
+                    self.profiles[tid] = prof
+                prof.enable()
+        elif (prof is not None):
+            import pstats
+            prof.disable()
+            with self.lock:
+                del self.profiles[tid]
+                self.stats.append(pstats.Stats(prof))
+                if (not self.profiles) and (_profile is self):
+                    _profile = None         # Last thread out, tracing's spans stop checking the window
+
+
+_profile: ProfileWindow | None = None
+
+
+def start() -> int:
+    # Returns the span start time (ns), or 0 when this span is not sampled
+    global _counter
+    if (_profile is not None):
+        _profile.hook()
+    _counter += 1
+    if (_counter % sampleEvery):
+        return 0
+    return time.perf_counter_ns()
+
+def finish(name: str, t0: int):
+    ns = time.perf_counter_ns() - t0
+    s = spans.get(name)
+    if (s is None):
+        with _lock:
+            s = spans.setdefault(name, SpanStats())
+    s.add(ns)
+
+def traced(name: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if (not enabled):
+                return fn(*args, **kwargs)
+            t = start()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if (t):
+                    finish(name, t)
+        return wrapper
+    return decorator
+
+
+def report() -> str:
+    lines = [f"Span timings (1 in {sampleEvery} sampled), by total time:",
+             f"{'Span':<32}{'Samples':>10}{'Mean us':>10}{'p50 us':>10}{'p99 us':>10}{'Max us':>10}{'Total ms':>10}"]
+    with _lock:
+        items = sorted(spans.items(), key=lambda kv: kv[1].totalNs, reverse=True)
+    for name, s in items:
+        mean = s.totalNs / s.count / 1000 if s.count else 0
+        lines.append(f"{name:<32}{s.count:>10}{mean:>10.1f}{s.percentile(0.5) / 1000:>10.1f}"
+                     f"{s.percentile(0.99) / 1000:>10.1f}{s.maxNs / 1000:>10.1f}{s.totalNs / 1e6:>10.1f}")
+    return '\n'.join(lines)
+
+def mallocReport() -> str:
+    global _lastSnapshot
+    import tracemalloc
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"tracemalloc: current [{current / 1024:.0f}KB]  peak [{peak / 1024:.0f}KB]"]
+    if (_lastSnapshot is not None):
+        lines.append("Top allocation changes since the last dump:")
+        stats = snapshot.compare_to(_lastSnapshot, 'lineno')
+    else:
+        lines.append("Top allocations:")
+        stats = snapshot.statistics('lineno')
+    lines.extend(f"  {stat}" for stat in stats[:REPORT_TOP])
+    _lastSnapshot = snapshot
+    return '\n'.join(lines)
+
+def dump():
+    log.info(report())
+    if (mallocTracing):
+        log.info(mallocReport())
+
+def startProfile(seconds: float = DEFAULT_PROFILE_SECONDS):
+    global _profile
+    if (_profile is not None):
+        log.warning("A profile is already running, or threads have yet to leave the last one.")
+        return
+    log.info(f"Profiling instrumented threads for [{seconds}s]...")
+    window = ProfileWindow(seconds)
+    _profile = window
+
+    def collect():
+        global _profile
+        time.sleep(seconds)
+        if (window.profiler is not None):
+            window.close()
+        else:
+            # Threads disable their own profiler on their next span, the window stays hooked until they all have
+            deadline = time.monotonic() + DEFAULT_PROFILE_GRACE
+            while window.profiles and time.monotonic() < deadline:
+                time.sleep(0.1)
+        with window.lock:
+            stats = list(window.stats)
+            enrolled = len(window.profiles)
+            if (not enrolled) and (_profile is window):
+                _profile = None
+        if (enrolled):
+            log.warning(f"[{enrolled}] threads are still profiling (no span since the window closed), their profiles "
+                        f"are left out and stop on their next span.")
+        if (not stats):
+            log.warning("Profile captured nothing, no instrumented spans ran.")
+            return
+        merged = stats[0]
+        for s in stats[1:]:
+            merged.add(s)
+        path = f"ka9q-profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.prof"
+        merged.dump_stats(path)
+        out = io.StringIO()
+        merged.stream = out
+        merged.sort_stats('cumulative').print_stats(REPORT_TOP)
+        log.info(f"Profile of [{len(stats)}] threads saved to [{path}]\n{out.getvalue()}")
+
+    threading.Thread(target=collect, daemon=True).start()
+
+
+def handleSignal(signum, frame):
+    # Do the work off the signal handler
+    if (signum == signal.SIGUSR1):
+        threading.Thread(target=dump, daemon=True).start()
+    elif (signum == signal.SIGUSR2):
+        startProfile(float(os.environ.get('KA9Q_PROFILE_SECONDS', DEFAULT_PROFILE_SECONDS)))
+
+def enable(rate: float = 1.0, malloc: bool = False):
+    # Must be called from the main thread (signal handlers)
+    global enabled, sampleEvery, mallocTracing
+    sampleEvery = max(1, round(1.0 / rate)) if rate > 0 else 1
+    mallocTracing = malloc
+    if (malloc):
+        import tracemalloc
+        if (not tracemalloc.is_tracing()):
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+    signal.signal(signal.SIGUSR1, handleSignal)
+    signal.signal(signal.SIGUSR2, handleSignal)
+    enabled = True
+    log.info(f"Tracing enabled, sampling 1 in [{sampleEvery}] spans  tracemalloc: [{malloc}]  PID: [{os.getpid()}]")
+
+def enableFromEnv():
+    rate = os.environ.get('KA9Q_TRACE')
+    if (rate):
+        enable(float(rate), os.environ.get('KA9Q_TRACE_MALLOC', '') not in ('', '0'))
+
+
+class SampledLogger():
+    """Wraps a logger for per packet messages: formatting only happens when the level is enabled, and at
+    most perSecond messages are emitted, with a count of those suppressed, so diagnostics can't flood the log."""
+
+    logger: logging.Logger
+    interval: float
+    nextTime: float
+    suppressed: int
+
+    def __init__(self, logger: logging.Logger, perSecond: float = 5.0):
+        self.logger = logger
+        self.interval = 1.0 / perSecond
+        self.nextTime = 0.0
+        self.suppressed = 0
+
+    def log(self, level: int, msg: str, *args):
+        if (not self.logger.isEnabledFor(level)):
+            return
+        now = time.monotonic()
+        if (now < self.nextTime):
+            self.suppressed += 1
+            return
+        self.nextTime = now + self.interval
+        if (self.suppressed):
+            msg = f"{msg} ({self.suppressed} suppressed)"
+            self.suppressed = 0
+        self.logger.log(level, msg, *args)
+
+    def debug(self, msg: str, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+
+class PhaseTimer():
+    """Wall time of each startup phase, reported as a single line so slow starts show where the time went."""
+
+    name: str
+    t0: float
+    last: float
+    phases: list[tuple[str, float]]
+
+    def __init__(self, name: str, t0: float | None = None):
+        # t0: an earlier perf_counter(), ie taken before the imports so they're counted too
+        self.name = name
+        self.t0 = t0 if t0 is not None else time.perf_counter()
+        self.last = self.t0
+        self.phases = []
+
+    def mark(self, phase: str):
+        # Ends the phase running since the previous mark
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def total(self) -> float:
+        return self.last - self.t0
+
+    def report(self) -> str:
+        return (f"{self.name}: [{self.total() * 1000:.1f}ms]  " +
+                "  ".join(f"{phase}: [{secs * 1000:.1f}ms]" for phase, secs in self.phases))
+
+
+def addArguments(parser):
+    parser.add_argument("--trace", type=float, nargs='?', const=1.0, help="Enable tracing spans, optionally the fraction sampled (ie 0.01). SIGUSR1 dumps, SIGUSR2 profiles.")
+    parser.add_argument("--trace-malloc", action='store_true', help="With --trace also track allocations (tracemalloc), diffed on each SIGUSR1.")
+
+def enableFromArgs(args):
+    if (args.trace):
+        enable(args.trace, args.trace_malloc)
+    else:
+        enableFromEnv()